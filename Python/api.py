@@ -1,9 +1,32 @@
-from fastapi import FastAPI
-from dto import MoveDTO
+import os
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException
+from dto import MoveDTO, HoldemInfoSetDTO
 from model import PokerMove
 from fastapi.middleware.cors import CORSMiddleware
+from strategy_file import StrategyFile
+import clustering_cache
+import node_io
 
-app = FastAPI()
+# Exported with `python strategy_file.py <node_map.parquet> <output>`; mapped, not loaded,
+# so every uvicorn worker shares the same pages
+STRATEGY_PATH = os.environ.get("POKER_STRATEGY_FILE", "bucket_5_50k_2.strategy")
+strategies = StrategyFile(STRATEGY_PATH) if os.path.exists(STRATEGY_PATH) else None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the clustering tables once per worker, before the first request: the tables the
+    # strategy file was trained with, or the unkeyed clustering_tables/ for files without a key.
+    # Set POKER_RELOAD_TABLES=1 to pick up regenerated tables without a restart.
+    clustering_key = strategies.clustering_key if strategies is not None else None
+    if strategies is not None and clustering_key is None:
+        if not node_io.allow_unkeyed_maps():
+            raise ValueError(f"{STRATEGY_PATH} records no clustering tables; set POKER_ALLOW_UNKEYED_MAPS=1 to serve it")
+        print(f"Warning: {STRATEGY_PATH} records no clustering tables; serving {clustering_cache.shared.directory}")
+    clustering_cache.shared.load(clustering_key)
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 
 app.add_middleware(
@@ -20,6 +43,19 @@ app.add_middleware(
 def hello():
     return {"message": "Hello from Poker API!"}
 
+@app.get("/strategy/{key}")
+def strategy(key: int):
+    if strategies is None:
+        raise HTTPException(status_code=503, detail="No strategy file loaded")
+    probabilities = strategies.get(key)
+    if probabilities is None:
+        raise HTTPException(status_code=404, detail="Unknown info set")
+    return {"strategy": probabilities.tolist()}
+
+@app.post("/strategy")
+def info_set_strategy(info_set: HoldemInfoSetDTO):
+    return strategy(info_set.to_holdem_info_set().key())
+
 @app.post("/")
 def post(nums: int):
     return MoveDTO(
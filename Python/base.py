@@ -1,34 +1,246 @@
+import time
+import numpy as np
+import random_streams
 
 class InfoSet:
     def __init__(self):
         self.history = ""
+
+class NodeStore:
+    """Node map backed by one contiguous float64 matrix per field.
+
+    Info set keys are mapped to integer node ids through `index`; the
+    regret_sum, strategy and strategy_sum of node `i` live in row `i` of the
+    corresponding matrix. Nodes stored here are thin views over their row.
+    Rows loaded in bulk have no node object until first accessed; those are
+    built on demand by `node_factory(store, key, node_id)`.
+    """
+    def __init__(self, num_actions, capacity=1024):
+        self.num_actions = num_actions
+        self.index = {}
+        self.nodes = []
+        self.row_keys = []
+        self.size = 0
+        self.strategy_weight = 1.0  # set by the update rule for iteration-weighted averaging
+        self.node_factory = None
+        self.grow_time = 0.0  # seconds spent growing the matrices, for metrics.TrainingMonitor
+        self.regret_sum = np.zeros((capacity, num_actions))
+        self.strategy = np.full((capacity, num_actions), 1.0 / num_actions)
+        self.strategy_sum = np.zeros((capacity, num_actions))
+
+    def allocate(self):
+        # Grow geometrically so appending nodes stays amortized O(1)
+        if self.size == len(self.regret_sum):
+            start = time.perf_counter()
+            capacity = max(1, 2 * self.size)
+            self.regret_sum = self._grow(self.regret_sum, capacity, 0.0)
+            self.strategy = self._grow(self.strategy, capacity, 1.0 / self.num_actions)
+            self.strategy_sum = self._grow(self.strategy_sum, capacity, 0.0)
+            self.grow_time += time.perf_counter() - start
+        node_id = self.size
+        self.size += 1
+        self.nodes.append(None)
+        self.row_keys.append(None)
+        return node_id
+
+    def find_or_add(self, key):
+        # Node id of an info set key; new keys get a row and a lazily built node
+        node_id = self.index.get(key)
+        if node_id is None:
+            node_id = self.allocate()
+            self.row_keys[node_id] = key
+            self.index[key] = node_id
+        return node_id
+
+    @staticmethod
+    def _grow(matrix, capacity, fill):
+        grown = np.full((capacity, matrix.shape[1]), fill)
+        grown[:len(matrix)] = matrix
+        return grown
+
+    def regret_matching(self, node_ids=None):
+        # Vectorized regret matching over the given rows (all rows by default)
+        if node_ids is None:
+            node_ids = slice(0, self.size)
+        positive = np.maximum(self.regret_sum[node_ids], 0.0)
+        normalizing_sum = positive.sum(axis=-1, keepdims=True)
+        uniform = np.full_like(positive, 1.0 / self.num_actions)
+        np.divide(positive, normalizing_sum, out=uniform, where=normalizing_sum > 0)
+        self.strategy[node_ids] = uniform
+        return uniform
+
+    def update_strategy(self, node_id, realization_weight):
+        positive = np.maximum(self.regret_sum[node_id], 0.0)
+        normalizing_sum = positive.sum()
+        if normalizing_sum > 0:
+            strategy = positive / normalizing_sum
+        else:
+            strategy = np.full(self.num_actions, 1.0 / self.num_actions)
+        self.strategy[node_id] = strategy
+        self.strategy_sum[node_id] += (self.strategy_weight * realization_weight) * strategy
+        return strategy
+
+    def snapshot(self):
+        return self.size, self.regret_sum[:self.size].copy(), self.strategy_sum[:self.size].copy()
+
+    def delta_since(self, snapshot):
+        # Keys and row deltas of every node that changed since the snapshot
+        size, regret_sum, strategy_sum = snapshot
+        regret_delta = self.regret_sum[:self.size].copy()
+        strategy_delta = self.strategy_sum[:self.size].copy()
+        regret_delta[:size] -= regret_sum
+        strategy_delta[:size] -= strategy_sum
+        changed = np.flatnonzero(regret_delta.any(axis=1) | strategy_delta.any(axis=1))
+        changed = [node_id for node_id in changed if self.row_keys[node_id] is not None]
+        keys = [self.row_keys[node_id] for node_id in changed]
+        return keys, regret_delta[changed], strategy_delta[changed]
+
+    def merge(self, keys, regret_delta, strategy_delta, create_node):
+        # Add row deltas keyed by info set, creating missing nodes on the way
+        node_ids = []
+        for key in keys:
+            if key not in self.index:
+                self[key] = create_node(key)
+            node_ids.append(self.index[key])
+        node_ids = np.array(node_ids, dtype=np.intp)
+        np.add.at(self.regret_sum, node_ids, regret_delta)
+        np.add.at(self.strategy_sum, node_ids, strategy_delta)
+
+    def average_strategy(self, node_ids=None):
+        if node_ids is None:
+            node_ids = slice(0, self.size)
+        strategy_sum = self.strategy_sum[node_ids]
+        normalizing_sum = strategy_sum.sum(axis=-1, keepdims=True)
+        average = np.full_like(strategy_sum, 1.0 / self.num_actions)
+        np.divide(strategy_sum, normalizing_sum, out=average, where=normalizing_sum > 0)
+        return average
+
+    def node(self, node_id):
+        node = self.nodes[node_id]
+        if node is None:
+            node = self.node_factory(self, self.row_keys[node_id], node_id)
+            self.nodes[node_id] = node
+        return node
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __getitem__(self, key):
+        return self.node(self.index[key])
+
+    def __setitem__(self, key, node):
+        if node._store is not self:
+            # Adopt a node created elsewhere by copying its row into this store
+            node_id = self.allocate()
+            self.regret_sum[node_id] = node.regret_sum
+            self.strategy[node_id] = node.strategy
+            self.strategy_sum[node_id] = node.strategy_sum
+            node._store = self
+            node._id = node_id
+        self.nodes[node._id] = node
+        self.row_keys[node._id] = key
+        self.index[key] = node._id
+
+    def __delitem__(self, key):
+        node_id = self.index.pop(key)
+        self.nodes[node_id] = None
+        self.row_keys[node_id] = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def keys(self):
+        return self.index.keys()
+
+    def values(self):
+        return (self.node(node_id) for node_id in self.index.values())
+
+    def items(self):
+        return ((key, self.node(node_id)) for key, node_id in self.index.items())
+
+    def get(self, key, default=None):
+        node_id = self.index.get(key)
+        return default if node_id is None else self.node(node_id)
+
+    def prune(self, min_mass):
+        """Copy of the store without the nodes whose strategy_sum mass, the
+        reach weight they accumulated over training, is below min_mass.
+        Such info sets were hardly ever reached, so their average strategy
+        is noise; lookups of dropped keys fall back to the caller's default."""
+        node_ids = np.fromiter(self.index.values(), dtype=np.intp, count=len(self.index))
+        kept = node_ids[self.strategy_sum[node_ids].sum(axis=1) >= min_mass]
+        kept_keys = [self.row_keys[node_id] for node_id in kept.tolist()]
+        return NodeStore.from_arrays(self.num_actions, kept_keys, self.regret_sum[kept], self.strategy_sum[kept],
+                                     self.node_factory)
+
+    @classmethod
+    def from_arrays(cls, num_actions, keys, regret_sum, strategy_sum, node_factory):
+        # Bulk load: rows are copied as a whole, nodes are created lazily
+        size = len(keys)
+        store = cls(num_actions, capacity=max(1, size))
+        store.regret_sum[:size] = regret_sum
+        store.strategy_sum[:size] = strategy_sum
+        store.size = size
+        store.row_keys = list(keys)
+        store.nodes = [None] * size
+        store.index = dict(zip(store.row_keys, range(size)))
+        store.node_factory = node_factory
+        return store
+
+    @classmethod
+    def from_node_map(cls, num_actions, node_map):
+        if isinstance(node_map, cls):
+            return node_map
+        store = cls(num_actions, capacity=max(1024, len(node_map)))
+        for key, node in node_map.items():
+            store[key] = node
+        return store
+
 class Node:
-    def __init__(self, info_set, num_actions):
+    def __init__(self, info_set, num_actions, store=None, node_id=None):
         self.info_set = info_set
         self.num_actions = num_actions
-        self.regret_sum = [0.0 for i in range(self.num_actions)]  # For 'p' and 'b'
-        self.strategy = [(1.0/self.num_actions) for i in range(self.num_actions)]
-        self.strategy_sum = [0.0 for i in range(self.num_actions)]
+        if store is None:
+            store = NodeStore(num_actions, capacity=1)
+        self._store = store
+        # node_id binds the node to an existing row instead of allocating one
+        self._id = store.allocate() if node_id is None else node_id
+
+    # Row views are looked up on every access because the store may have
+    # reallocated its matrices since the node was created
+    @property
+    def regret_sum(self):
+        return self._store.regret_sum[self._id]
+
+    @regret_sum.setter
+    def regret_sum(self, value):
+        self._store.regret_sum[self._id] = value
+
+    @property
+    def strategy(self):
+        return self._store.strategy[self._id]
+
+    @strategy.setter
+    def strategy(self, value):
+        self._store.strategy[self._id] = value
+
+    @property
+    def strategy_sum(self):
+        return self._store.strategy_sum[self._id]
+
+    @strategy_sum.setter
+    def strategy_sum(self, value):
+        self._store.strategy_sum[self._id] = value
 
     def get_strategy(self, realization_weight):
-        # Calculate strategy from regrets
-        self.strategy = [max(r, 0) for r in self.regret_sum]
-        normalizing_sum = sum(self.strategy)
-        if normalizing_sum > 0:
-            self.strategy = [s/normalizing_sum for s in self.strategy] 
-        else:
-            self.strategy = [(1.0/self.num_actions) for i in range(self.num_actions)]
-        
-        # Accumulate strategy weighted by realization weight
-        self.strategy_sum = [self.strategy_sum[i] + realization_weight * self.strategy[i] for i in range(len(self.strategy))]
-        return self.strategy
+        # Regret matching, then accumulate strategy weighted by realization weight
+        return self._store.update_strategy(self._id, realization_weight)
 
     def get_average_strategy(self):
-        normalizing_sum = sum(self.strategy_sum)
-        if normalizing_sum > 0:
-            return [s / normalizing_sum for s in self.strategy_sum]
-        else:
-            return [(1.0/self.num_actions) for i in range(self.num_actions)]
+        return self._store.average_strategy(self._id)
     @staticmethod
     def is_terminal(self, history):
         raise NotImplementedError
@@ -39,13 +251,109 @@ class Node:
     def get_terminal_utility(self, history, cards, fixed_player):
         raise NotImplementedError
     
+class UpdateRule:
+    """Vanilla CFR: plain regret sums and strategy_sum weighted by realization weight.
+
+    `averaging_power` weights the contribution of iteration t to the average
+    strategy by t ** averaging_power (0 is uniform averaging, 1 is linear).
+    """
+    name = "vanilla"
+
+    def __init__(self, averaging_power=0.0):
+        self.averaging_power = averaging_power
+
+    def begin_iteration(self, store, iteration):
+        store.strategy_weight = float(iteration) ** self.averaging_power
+
+    def end_iteration(self, store, iteration):
+        pass
+
+class CFRPlus(UpdateRule):
+    """CFR+: regrets are floored at zero after every iteration, linear averaging."""
+    name = "cfr+"
+
+    def __init__(self, averaging_power=1.0):
+        super().__init__(averaging_power)
+
+    def end_iteration(self, store, iteration):
+        regret_sum = store.regret_sum[:store.size]
+        np.maximum(regret_sum, 0.0, out=regret_sum)
+
+class DiscountedCFR(UpdateRule):
+    """DCFR: after iteration t positive regrets are scaled by t^alpha / (t^alpha + 1),
+    negative regrets by t^beta / (t^beta + 1) and strategy_sum by (t / (t + 1))^gamma."""
+    name = "dcfr"
+
+    def __init__(self, alpha=1.5, beta=0.0, gamma=2.0):
+        super().__init__(0.0)
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+
+    def end_iteration(self, store, iteration):
+        t = float(iteration)
+        positive_discount = t ** self.alpha / (t ** self.alpha + 1)
+        negative_discount = t ** self.beta / (t ** self.beta + 1)
+        regret_sum = store.regret_sum[:store.size]
+        regret_sum *= np.where(regret_sum > 0, positive_discount, negative_discount)
+        store.strategy_sum[:store.size] *= (t / (t + 1)) ** self.gamma
+
+class LinearCFR(DiscountedCFR):
+    """Linear CFR: iteration t contributes to regrets and the average strategy with weight t."""
+    name = "linear"
+
+    def __init__(self):
+        super().__init__(alpha=1.0, beta=1.0, gamma=1.0)
+
+UPDATE_RULES = {rule.name: rule for rule in (UpdateRule, CFRPlus, LinearCFR, DiscountedCFR)}
+
+def make_update_rule(update_rule):
+    if update_rule is None:
+        return UpdateRule()
+    if isinstance(update_rule, UpdateRule):
+        return update_rule
+    if update_rule not in UPDATE_RULES:
+        raise ValueError(f"Unknown update rule: {update_rule}")
+    return UPDATE_RULES[update_rule]()
+
 class CFR:
-    def __init__(self, num_actions, action_map = {0: 'p', 1: 'b', 2: 'f'}):
-        self.node_map = {}
+    # Phases of train_iteration timed in phase_times
+    PHASES = ("deal", "traversal", "update")
+    # Work counters, summed over workers by parallel.train_parallel
+    COUNTERS = ("node_visits", "pruned_branches", "pruned_visits")
+
+    def __init__(self, num_actions, action_map = {0: 'p', 1: 'b', 2: 'f'}, update_rule=None, seed=None):
+        self.node_map = NodeStore(num_actions)
         self.num_actions = num_actions
         self.action_map = action_map
+        self.update_rule = make_update_rule(update_rule)
+        self.iteration = 0
+        # Counters read by metrics.TrainingMonitor
+        self.node_visits = 0
+        # Actions skipped by regret-based pruning, and the node visits they would have cost
+        self.pruned_branches = 0
+        self.pruned_visits = 0
+        self.phase_times = dict.fromkeys(self.PHASES, 0.0)
+        # Deals and samples come from self.dealer and self.random, see reseed
+        self.streams = random_streams.RandomStreams(seed)
+        self.reseed()
+    def reseed(self, *path):
+        # Switches to the stream of path, e.g. an iteration block, or (block, worker) in parallel.run_training
+        stream = self.streams.stream(*path)
+        self.dealer = stream.dealer
+        self.random = stream.random
+    def record_phase(self, phase, start):
+        # Adds the time since start to phase and returns the current time
+        now = time.perf_counter()
+        self.phase_times[phase] += now - start
+        return now
     def create_node(self, info_set):
-        return Node(info_set, self.num_actions)
+        return Node(info_set, self.num_actions, self.node_map)
+    def begin_iteration(self):
+        self.iteration += 1
+        self.update_rule.begin_iteration(self.node_map, self.iteration)
+    def end_iteration(self):
+        self.update_rule.end_iteration(self.node_map, self.iteration)
     def cfr(self, cards, history, fixed_player, p0, p1):
 
          # Determine current player
@@ -59,6 +367,7 @@ class CFR:
         # Check if we're at a terminal state
         if node.is_terminal(history):
             return node.get_terminal_utility(history, cards, fixed_player)
+        self.node_visits += 1
         
         # Get current strategy
         strategy = node.get_strategy(p0 if current_player == 0 else p1)
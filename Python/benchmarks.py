@@ -0,0 +1,877 @@
+import argparse
+import checkpoint
+import clustering_cache
+import os
+import pickle
+import random_streams
+import sys
+import tempfile
+import time
+import deuces
+import equity
+import numpy as np
+import pyarrow as pa
+import pandas as pd
+import evaluator
+import exploitability
+import hand_engine
+import hand_index
+import holdem
+import holdem_3
+import key_codec
+import kuhn_exploitability
+import metrics
+import node_io
+import numba_cfr
+import parallel
+import potential_clustering
+import public_tree
+import strategy_file
+import test_numba_cfr
+import tournament
+
+def random_hands(num_hands, hand_size=7):
+    hands = []
+    for _ in range(num_hands):
+        deck = deuces.Deck()
+        hands.append(deck.draw(hand_size))
+    return hands
+
+def quick_clustering(num_clusters=5, num_simulations=2000):
+    # Coarse tables: bucket quality does not matter for throughput measurements
+    hc = evaluator.HandClustering()
+    hc.build_preflop_table(num_simulations // 20, num_clusters, exact=False)
+    hc.build_flop_table(num_simulations, num_clusters)
+    hc.build_turn_table(num_simulations, num_clusters)
+    hc.build_river_table(num_simulations, num_clusters)
+    return hc
+
+def report(name, count, elapsed, unit):
+    rate = count / elapsed if elapsed > 0 else float("inf")
+    print(f"{name:<40} {rate:>14,.0f} {unit}/s")
+    return rate
+
+def bench_evaluator(num_hands=50000):
+    """Evaluations per second of deuces.Evaluator against hand_engine.FastEvaluator."""
+    hands = random_hands(num_hands)
+    deuces_evaluator = deuces.Evaluator()
+    fast_evaluator = hand_engine.FastEvaluator()
+    results = {}
+
+    start = time.perf_counter()
+    expected = [deuces_evaluator.evaluate(hand[:2], hand[2:]) for hand in hands]
+    results["deuces"] = report("deuces.Evaluator.evaluate", num_hands, time.perf_counter() - start, "evaluations")
+
+    start = time.perf_counter()
+    fast = [fast_evaluator.evaluate(hand[:2], hand[2:]) for hand in hands]
+    results["fast"] = report("FastEvaluator.evaluate", num_hands, time.perf_counter() - start, "evaluations")
+
+    hand_array = np.array(hands, dtype=np.int64)
+    start = time.perf_counter()
+    batch = fast_evaluator.evaluate_batch(hand_array)
+    results["batch"] = report("FastEvaluator.evaluate_batch", num_hands, time.perf_counter() - start, "evaluations")
+
+    assert fast == expected and batch.tolist() == expected, "FastEvaluator disagrees with deuces"
+    return results
+
+def bench_parallel(iterations=400):
+    """Training iterations per second of holdem.HoldemCFR against worker count."""
+    hc = quick_clustering()
+    results = {}
+    cfr = holdem.HoldemCFR(3, hc)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        cfr.train_iteration()
+    results[0] = report("sequential", iterations, time.perf_counter() - start, "iterations")
+
+    cpus = os.cpu_count() or 1
+    worker_counts = sorted({1, cpus} | {2 ** k for k in range(1, cpus.bit_length()) if 2 ** k <= cpus})
+    for workers in worker_counts:
+        cfr = holdem.HoldemCFR(3, hc)
+        merge_every = max(1, iterations // (4 * workers))
+        start = time.perf_counter()
+        parallel.train_parallel(cfr, iterations, workers, merge_every)
+        results[workers] = report(f"{workers} worker(s)", iterations, time.perf_counter() - start, "iterations")
+    return results
+
+def bench_sampling(iterations=400):
+    """Training iterations per second of each holdem.HoldemCFR sampling mode."""
+    hc = quick_clustering()
+    results = {}
+    for sampling in holdem.HoldemCFR.SAMPLING_MODES:
+        cfr = holdem.HoldemCFR(3, hc, sampling=sampling)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            cfr.train_iteration()
+        results[sampling] = report(f"{sampling} sampling", iterations, time.perf_counter() - start, "iterations")
+    return results
+
+def check_numba(iterations=100, seeds=(0, 1, 2)):
+    """Checks on fixed seeds that the Python and Numba backends train the
+    same chance-sampled node map, with and without regret-based pruning, as
+    test_numba_cfr does under pytest. Skipped when Numba is not installed."""
+    if not numba_cfr.AVAILABLE:
+        print("Numba is not installed, skipped")
+        return False
+    hc = quick_clustering()
+    for seed in seeds:
+        for prune_threshold in (None, -5.0):
+            test_numba_cfr.assert_backends_match(hc, seed, prune_threshold, iterations)
+    print(f"Python and Numba node maps match on seeds {', '.join(map(str, seeds))}")
+    return True
+
+def bench_numba(iterations=400):
+    """Chance-sampled training iterations per second of the Python and Numba
+    backends; check_numba compares their node maps."""
+    if not numba_cfr.AVAILABLE:
+        print("Numba is not installed")
+        return {}
+    hc = quick_clustering()
+    # Compile the kernel outside the timed runs
+    holdem.HoldemCFR(3, hc, backend="numba").train_iteration()
+    results = {}
+    for backend in holdem.HoldemCFR.BACKENDS:
+        cfr = holdem.HoldemCFR(3, hc, backend=backend)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            cfr.train_iteration()
+        results[backend] = report(f"{backend} backend", iterations, time.perf_counter() - start, "iterations")
+        traversal = cfr.phase_times["traversal"]
+        print(f"{'':<4}traversal {1000 * traversal / iterations:.3f} ms/iteration, "
+              f"{cfr.node_visits / traversal:,.0f} node visits/s")
+    print(f"Speedup: {results['numba'] / results['python']:.1f}x")
+    return results
+
+def bench_pruning(iterations=8000, threshold=-20.0, min_mass=1.0):
+    """Iterations per second, node visits and node map size of external
+    sampling with and without regret-based pruning, then the share of nodes
+    dropped by NodeStore.prune before export."""
+    hc = quick_clustering()
+    # Chance-sampled CFR walks the whole tree on every deal, so pruned plus made visits must add up
+    runs = {}
+    for prune_threshold in (None, threshold):
+        cfr = holdem.HoldemCFR(3, hc, prune_threshold=prune_threshold, prune_after=200, seed=0)
+        for _ in range(400):
+            cfr.train_iteration()
+        runs[prune_threshold] = cfr
+    assert runs[threshold].pruned_branches > 0, "nothing was pruned"
+    assert runs[threshold].node_visits + runs[threshold].pruned_visits == runs[None].node_visits, \
+        "pruned visits do not account for the skipped subtrees"
+    results = {}
+    for prune_threshold in (None, threshold):
+        cfr = holdem.HoldemCFR(3, hc, sampling="external", prune_threshold=prune_threshold,
+                               prune_after=iterations // 4)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            cfr.train_iteration()
+        name = "no pruning" if prune_threshold is None else f"pruning below {prune_threshold:g}"
+        results[prune_threshold] = report(name, iterations, time.perf_counter() - start, "iterations")
+        print(f"{'':<4}{len(cfr.node_map):,} nodes, {cfr.node_visits:,} visits, {cfr.pruned_branches:,} pruned "
+              f"actions saving ~{cfr.pruned_visits:,.0f} visits")
+    pruned = cfr.node_map.prune(min_mass)
+    node_ids = np.fromiter(cfr.node_map.index.values(), dtype=np.intp, count=len(cfr.node_map))
+    assert len(pruned) == (cfr.node_map.strategy_sum[node_ids].sum(axis=1) >= min_mass).sum(), "wrong nodes pruned"
+    for key, node_id in pruned.index.items():
+        assert np.array_equal(pruned.strategy_sum[node_id], cfr.node_map.strategy_sum[cfr.node_map.index[key]])
+    print(f"NodeStore.prune({min_mass:g}) keeps {len(pruned):,} of {len(cfr.node_map):,} nodes")
+    return results
+
+def node_map_rows(cfr):
+    return {key: (cfr.node_map.regret_sum[node_id].tolist(), cfr.node_map.strategy_sum[node_id].tolist())
+            for key, node_id in cfr.node_map.index.items()}
+
+def bench_dealer(num_deals=200000, iterations=200):
+    """Heads-up deals per second of deuces.Deck() against
+    random_streams.Dealer, then checks that seeded training repeats: the
+    same seed gives the same node map sequentially, resumed at a block
+    boundary and on 2 workers, and another seed a different one."""
+    results = {}
+    start = time.perf_counter()
+    for _ in range(num_deals):
+        deck = deuces.Deck()
+        cards = [deck.draw(2), deck.draw(2)]
+        flop = deck.draw(3)
+        turn, river = deck.draw(2)
+    results["deck"] = report("deuces.Deck()", num_deals, time.perf_counter() - start, "deals")
+    dealer = random_streams.RandomStreams(0).stream().dealer
+    start = time.perf_counter()
+    deals = [dealer.deal(9) for _ in range(num_deals)]
+    results["dealer"] = report("random_streams.Dealer", num_deals, time.perf_counter() - start, "deals")
+    print(f"Speedup: {results['dealer'] / results['deck']:.1f}x")
+    assert all(len(set(cards)) == 9 for cards in deals), "dealt a card twice"
+    counts = np.unique(np.array(deals), return_counts=True)[1]
+    expected = num_deals * 9 / 52
+    assert len(counts) == 52 and np.abs(counts - expected).max() < 6 * np.sqrt(expected), "cards are not uniform"
+
+    hc = quick_clustering()
+    for sampling in ("chance", "external"):
+        runs = {}
+        for name, seed in (("first", 1), ("repeat", 1), ("other", 2)):
+            cfr = holdem.HoldemCFR(3, hc, sampling=sampling, seed=seed)
+            parallel.run_training(cfr, iterations, merge_every=50)
+            runs[name] = node_map_rows(cfr)
+        cfr = holdem.HoldemCFR(3, hc, sampling=sampling, seed=1)
+        parallel.run_training(cfr, iterations // 2, merge_every=50)
+        parallel.run_training(cfr, iterations - iterations // 2, merge_every=50, start=iterations // 2)
+        assert node_map_rows(cfr) == runs["first"], f"{sampling}: resumed run differs"
+        assert runs["first"] == runs["repeat"], f"{sampling}: same seed, different node maps"
+        assert runs["first"] != runs["other"], f"{sampling}: different seeds, same node maps"
+    parallel_runs = []
+    for _ in range(2):
+        cfr = holdem.HoldemCFR(3, hc, seed=1)
+        parallel.run_training(cfr, iterations, workers=2, merge_every=25)
+        parallel_runs.append(node_map_rows(cfr))
+    assert parallel_runs[0] == parallel_runs[1], "parallel runs with the same seed differ"
+    print("Seeded runs repeat sequentially, resumed and on 2 workers")
+    return results
+
+def bench_public_tree(iterations=20):
+    """Public tree sizes and build time, and 3-player training iterations per second."""
+    hc = quick_clustering()
+    results = {}
+    for num_players in (2, 3):
+        cfr = holdem_3.HoldemCFR(3, hc, num_players=num_players)
+        holdem_3.PUBLIC_TREES.clear()
+        start = time.perf_counter()
+        tree = holdem_3.get_public_tree(cfr)
+        elapsed = time.perf_counter() - start
+        decisions = tree.decision_nodes()
+        print(f"{num_players} players: {len(tree):,} nodes, {len(decisions):,} decision nodes, built in {elapsed:.3f}s")
+        for node in decisions:
+            history = tree.histories[node]
+            assert tree.key_bases_list[node] == cfr.key_base(history, tree.players_list[node]), "key base mismatch"
+            assert len(tree.edges_list[node]) == len(cfr.legal_actions(history)), "missing children"
+        start = time.perf_counter()
+        for _ in range(iterations):
+            cfr.train_iteration()
+        results[num_players] = report(f"{num_players}-player holdem_3 CFR", iterations, time.perf_counter() - start,
+                                      "iterations")
+    two_player = holdem.get_public_tree(holdem.HoldemCFR(3, hc))
+    # The 2-player engines share the betting rules, so their trees have the same shape
+    assert (two_player.node_types == holdem_3.get_public_tree(holdem_3.HoldemCFR(3, hc)).node_types).all()
+    return results
+
+class BucketDeal:
+    # Stand-in for hand_engine.DealEvaluation with given bucket sequences and showdown winner
+    def __init__(self, sequences, player_wins):
+        self.clusters = [[None if c < 0 else int(c) for c in sequence] for sequence in sequences]
+        self.scores = [1, 2] if player_wins else [2, 1]
+
+    def get_clusters(self, player, round):
+        return self.clusters[player][:round + 1]
+
+    def get_showdown_score(self, player):
+        return self.scores[player]
+
+def bench_vector_cfr(iterations=50):
+    """Hand pairs per second covered by chance-sampled CFR (one pair per
+    iteration) against vector CFR (every pair on a sampled board)."""
+    hc = quick_clustering(num_clusters=3)
+    # One board of vector CFR equals scalar CFR summed over the bucket pairs, weighted by their probability
+    board = deuces.Deck().draw(5)
+    buckets = hand_engine.BoardEvaluation(board[:3], board[3], board[4], hc)
+    vector = holdem.HoldemCFR(3, hc, sampling="vector", node_map={})
+    reach = [np.ones(len(buckets)), np.ones(len(buckets))]
+    vector.vector_cfr(buckets, vector.board_info_sets(buckets), 0, 0, reach)
+    scalar = holdem.HoldemCFR(3, hc, node_map={})
+    expected = {}
+    for s in range(len(buckets)):
+        for t in range(len(buckets)):
+            for win, weight in ((True, buckets.wins[s, t]), (False, buckets.joint[s, t] - buckets.wins[s, t])):
+                if weight <= 0:
+                    continue
+                deal = BucketDeal(buckets.sequences[[s, t]], win)
+                scalar.cfr(deal, scalar.cluster_codes(deal), 0, 0, 1.0, 1.0)
+                for key, node_id in scalar.node_map.index.items():
+                    expected[key] = expected.get(key, 0.0) + weight * scalar.node_map.regret_sum[node_id]
+                scalar.node_map.regret_sum[:] = 0.0
+    for key, node_id in vector.node_map.index.items():
+        assert np.allclose(vector.node_map.regret_sum[node_id], expected.get(key, 0.0)), "vector CFR regrets differ"
+
+    results = {}
+    pairs_per_board = len(buckets.hands) * 990  # 45 choose 2 opponent hands per hand
+    for sampling, pairs in (("chance", 1), ("vector", pairs_per_board)):
+        cfr = holdem.HoldemCFR(3, hc, sampling=sampling, node_map={})
+        count = iterations if sampling == "vector" else 10 * iterations
+        start = time.perf_counter()
+        for _ in range(count):
+            cfr.train_iteration()
+        elapsed = time.perf_counter() - start
+        report(f"{sampling} iterations", count, elapsed, "iterations")
+        results[sampling] = report(f"{sampling} hand pairs", count * pairs, elapsed, "pairs")
+    return results
+
+def bench_key_codec(iterations=200):
+    """Lookup rate, memory and Parquet size of tuple keys against packed integer keys."""
+    hc = quick_clustering()
+    cfr = holdem.HoldemCFR(3, hc)
+    for _ in range(iterations):
+        cfr.train_iteration()
+    codes = list(cfr.node_map.keys())
+    tuples = [holdem.HoldemInfoSet.from_key(code) for code in codes]
+    tuples = [(tuple(i.history), tuple(i.clusters), i.round, tuple(i.pot)) for i in tuples]
+    assert [holdem.KEY_CODEC.encode(*key) for key in tuples] == codes, "KeyCodec round trip failed"
+    results = {}
+    for name, keys in (("tuple", tuples), ("int", codes)):
+        # Fresh, equal copies so lookups hash the key instead of hitting identity
+        table = {key: i for i, key in enumerate(keys)}
+        probes = pickle.loads(pickle.dumps(keys)) * 20
+        start = time.perf_counter()
+        for key in probes:
+            table[key]
+        results[name] = report(f"{name} key lookups", len(probes), time.perf_counter() - start, "lookups")
+        memory = sum(deep_size(key) for key in keys) / len(keys)
+        print(f"{'':<40} {memory:>14,.0f} bytes/key")
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "node_map.parquet")
+        cfr.save_node_map(filename)
+        packed = os.path.getsize(filename)
+        df = pd.read_parquet(filename)
+        df = df.drop(columns=["key_code"]).assign(key=[pickle.dumps(key) for key in tuples])
+        df.to_parquet(filename)
+        legacy = os.path.getsize(filename)
+        start = time.perf_counter()
+        migrated = holdem.load_node_map(filename, 3)
+        report("legacy map migration", len(tuples), time.perf_counter() - start, "nodes")
+        assert sorted(migrated.keys()) == sorted(codes), "legacy keys migrated incorrectly"
+    print(f"Parquet size: {legacy:,} bytes pickled keys, {packed:,} bytes packed keys")
+    return results
+
+def bench_node_io(iterations=300):
+    """Save and load rate of node maps, row-by-row pandas against node_io."""
+    hc = quick_clustering()
+    cfr = holdem.HoldemCFR(3, hc)
+    for _ in range(iterations):
+        cfr.train_iteration()
+    count = len(cfr.node_map)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "node_map.parquet")
+        # The row-by-row format with pickled tuple keys that node_io replaces
+        tuple_keys = {}
+        for key in cfr.node_map.keys():
+            info_set = holdem.HoldemInfoSet.from_key(key)
+            tuple_keys[key] = (tuple(info_set.history), tuple(info_set.clusters), info_set.round, tuple(info_set.pot))
+        start = time.perf_counter()
+        rows = []
+        for key, node in cfr.node_map.items():
+            rows.append({"key": pickle.dumps(tuple_keys[key]),
+                         "regret_sum": node.regret_sum, "strategy_sum": node.strategy_sum})
+        pd.DataFrame(rows).to_parquet(filename, index=False)
+        results["rows_save"] = report("row-by-row save", count, time.perf_counter() - start, "nodes")
+        start = time.perf_counter()
+        rows_map = {}
+        for _, row in pd.read_parquet(filename).iterrows():
+            info_set = holdem.HoldemInfoSet.from_key(pickle.loads(row["key"]))
+            node = holdem.HoldemNode(info_set, 3)
+            node.regret_sum = list(row["regret_sum"])
+            node.strategy_sum = list(row["strategy_sum"])
+            rows_map[info_set.key()] = node
+        results["rows_load"] = report("row-by-row load", count, time.perf_counter() - start, "nodes")
+
+        start = time.perf_counter()
+        cfr.save_node_map(filename)
+        results["bulk_save"] = report("node_io save", count, time.perf_counter() - start, "nodes")
+        start = time.perf_counter()
+        loaded = holdem.load_node_map(filename, 3)
+        results["bulk_load"] = report("node_io load", count, time.perf_counter() - start, "nodes")
+    for key, node in rows_map.items():
+        assert np.array_equal(loaded[key].regret_sum, node.regret_sum), "node_io round trip failed"
+        assert np.array_equal(loaded[key].strategy_sum, node.strategy_sum), "node_io round trip failed"
+    print(f"Speedup: save {results['bulk_save'] / results['rows_save']:.1f}x, "
+          f"load {results['bulk_load'] / results['rows_load']:.1f}x")
+    return results
+
+def bench_stream_node_map(copies=4, source="bucket_5_50k.parquet"):
+    """Per-round statistics of a node map streamed with node_io.iter_node_rows
+    against load_node_map, peak Arrow memory at 1x and `copies`x the map
+    size, and the rows read with a history prefix filter."""
+    if os.path.exists(source):
+        node_map = holdem.load_node_map(source, 3)
+    else:
+        cfr = holdem.HoldemCFR(3, quick_clustering())
+        for _ in range(300):
+            cfr.train_iteration()
+        node_map = cfr.node_map
+    keys = np.array(list(node_map.index.keys()), dtype=np.int64)
+    node_ids = np.array(list(node_map.index.values()), dtype=np.intp)
+    expected = np.bincount(holdem.KEY_CODEC.round_of(keys), minlength=4)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for scale in (1, copies):
+            # Repeated rows stand in for a larger abstraction; streaming does not need unique keys
+            filename = os.path.join(directory, f"map_{scale}.parquet")
+            node_io.write_node_rows(filename, keys.tolist() * scale, np.tile(node_ids, scale), node_map.regret_sum,
+                                    node_map.strategy_sum, holdem.KEY_CODEC)
+            size = os.path.getsize(filename)
+            start = time.perf_counter()
+            with open(filename, "rb") as f:
+                while f.read(1 << 24):
+                    pass
+            read = time.perf_counter() - start
+            start = time.perf_counter()
+            counts = np.zeros(4, dtype=np.int64)
+            strategy_totals = np.zeros((4, 3))
+            peak = 0
+            for batch_keys, _, strategy_sum in holdem.iter_node_map(filename, 3, columns=("strategy_sum",)):
+                rounds = holdem.KEY_CODEC.round_of(batch_keys)
+                counts += np.bincount(rounds, minlength=4)
+                for a in range(3):
+                    strategy_totals[:, a] += np.bincount(rounds, strategy_sum[:, a], minlength=4)
+                peak = max(peak, pa.total_allocated_bytes())
+            stream = time.perf_counter() - start
+            assert (counts == scale * expected).all(), "streamed round counts differ"
+            results[scale] = peak
+            print(f"{scale}x map, {size / 2 ** 20:.1f} MB: raw read {size / 2 ** 20 / read:,.0f} MB/s, "
+                  f"streamed statistics {size / 2 ** 20 / stream:,.0f} MB/s ({scale * len(keys) / stream:,.0f} "
+                  f"nodes/s), peak Arrow memory {peak / 2 ** 20:.1f} MB")
+        start = time.perf_counter()
+        holdem.load_node_map(os.path.join(directory, "map_1.parquet"), 3)
+        report("load_node_map", len(keys), time.perf_counter() - start, "nodes")
+        # Histories of a node deep in the map, so the prefix selects a narrow key range
+        history_prefix = holdem.KEY_CODEC.decode(int(np.sort(keys)[len(keys) // 2]))[0][:3]
+        start = time.perf_counter()
+        matched = sum(len(batch_keys) for batch_keys, _, _ in
+                      holdem.iter_node_map(os.path.join(directory, "map_1.parquet"), 3, history_prefix=history_prefix))
+        assert matched == holdem.KEY_CODEC.matches_history(keys, history_prefix).sum(), "history filter differs"
+        print(f"history prefix {history_prefix}: {matched:,} of {len(keys):,} nodes in "
+              f"{1000 * (time.perf_counter() - start):.1f} ms")
+    return results
+
+def bench_checkpoint(iterations=300, repeats=5):
+    """Training stall per checkpoint: synchronous save_node_map against the
+    snapshot copy of checkpoint.Checkpointer, plus TrainingMonitor overhead."""
+    hc = quick_clustering()
+    cfr = holdem.HoldemCFR(3, hc)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        cfr.train_iteration()
+    plain = time.perf_counter() - start
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        for i in range(repeats):
+            cfr.save_node_map(os.path.join(directory, f"sync_{i}.parquet"))
+        sync = (time.perf_counter() - start) / repeats
+        checkpointer = cfr.checkpointer(directory, every_iterations=None, keep_last=2)
+        stalls = []
+        for i in range(repeats):
+            checkpointer.wait()
+            start = time.perf_counter()
+            checkpointer.save(i + 1)
+            stalls.append(time.perf_counter() - start)
+        checkpointer.close()
+        saved = checkpoint.list_checkpoints(directory)
+        assert [iteration for iteration, _ in saved] == [repeats - 1, repeats], "retention kept the wrong checkpoints"
+        loaded = holdem.load_node_map(saved[-1][1], 3)
+        assert sorted(loaded.keys()) == sorted(cfr.node_map.keys()), "checkpoint lost nodes"
+        # Parallel runs report at merges only: 3 workers merging every 100 iterations
+        scheduled = cfr.checkpointer(os.path.join(directory, "merges"), every_iterations=1000, keep_last=1,
+                                     keep_every=2000)
+        due = []
+        for iteration in range(300, 6001, 300):
+            if scheduled.due(iteration):
+                due.append(iteration)
+                scheduled.save(iteration)
+        scheduled.close()
+        assert due == [1200, 2100, 3000, 4200, 5100, 6000], "checkpoints missed at merge points"
+        assert [iteration for iteration, _ in checkpoint.list_checkpoints(scheduled.directory)] == [2100, 4200, 6000], \
+            "retention kept the wrong checkpoints"
+    print(f"{len(cfr.node_map):,} nodes: synchronous save {1000 * sync:.1f} ms, "
+          f"background checkpoint stall {1000 * np.mean(stalls):.1f} ms")
+    monitored = holdem.HoldemCFR(3, hc)
+    monitor = metrics.TrainingMonitor(monitored, quiet=True)
+    start = time.perf_counter()
+    for i in range(iterations):
+        monitored.train_iteration()
+        monitor.step(i + 1)
+    report("plain iterations", iterations, plain, "iterations")
+    report("monitored iterations", iterations, time.perf_counter() - start, "iterations")
+    return {"sync": sync, "stall": float(np.mean(stalls))}
+
+def bench_delta_checkpoint(iterations=50, snapshots=6, warmup=1000):
+    """Disk size and write time of full checkpoints against delta chains,
+    checking that load_checkpoint rebuilds every iteration and that compact
+    keeps the latest one intact."""
+    hc = quick_clustering()
+    hc.cache_key = "quick"
+    cfr = holdem.HoldemCFR(3, hc, sampling="external")
+    for _ in range(warmup):
+        cfr.train_iteration()
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        expected = {}
+        checkpointers = {"full": cfr.checkpointer(os.path.join(directory, "full"), every_iterations=None, keep_last=0,
+                                                  keep_every=1),
+                         "delta": cfr.checkpointer(os.path.join(directory, "delta"), every_iterations=None, keep_last=0,
+                                                   keep_every=1, full_every=snapshots)}
+        times = dict.fromkeys(checkpointers, 0.0)
+        for i in range(1, snapshots + 1):
+            for _ in range(iterations):
+                cfr.train_iteration()
+            expected[i] = {key: (cfr.node_map.regret_sum[node_id].copy(), cfr.node_map.strategy_sum[node_id].copy())
+                           for key, node_id in cfr.node_map.index.items()}
+            for name, checkpointer in checkpointers.items():
+                start = time.perf_counter()
+                checkpointer.save(i)
+                checkpointer.wait()
+                times[name] += time.perf_counter() - start
+        for name, checkpointer in checkpointers.items():
+            checkpointer.close()
+            files = checkpoint.list_checkpoints(checkpointer.directory)
+            results[name] = sum(os.path.getsize(filename) for _, filename in files)
+            print(f"{name:<6} {len(files)} files, {results[name] / 2 ** 20:6.2f} MB, "
+                  f"{1000 * times[name] / snapshots:6.1f} ms per snapshot")
+        delta_dir = checkpointers["delta"].directory
+        entries = checkpoint.read_manifest(delta_dir)
+        assert [entry["parent"] for entry in entries] == [None] + list(range(1, snapshots)), "wrong delta chain"
+        for i in range(1, snapshots + 1):
+            start = time.perf_counter()
+            store = checkpoint.load_checkpoint(delta_dir, 3, holdem.KEY_CODEC, iteration=i)
+            elapsed = time.perf_counter() - start
+            assert len(store) == len(expected[i]), f"rebuild of iteration {i} has the wrong nodes"
+            for key, (regret_sum, strategy_sum) in expected[i].items():
+                node_id = store.index[key]
+                assert np.array_equal(store.regret_sum[node_id], regret_sum), f"rebuild of iteration {i} differs"
+                assert np.array_equal(store.strategy_sum[node_id], strategy_sum), f"rebuild of iteration {i} differs"
+        print(f"rebuild of iteration {snapshots} ({snapshots - 1} deltas): {1000 * elapsed:.1f} ms")
+        checkpoint.compact(delta_dir, 3, holdem.KEY_CODEC)
+        entries = checkpoint.read_manifest(delta_dir)
+        assert [(entry["iteration"], entry["parent"]) for entry in entries] == [(snapshots, None)], "compaction failed"
+        store = checkpoint.load_checkpoint(delta_dir, 3, holdem.KEY_CODEC, clustering_key="quick")
+        try:
+            checkpoint.load_checkpoint(delta_dir, 3, holdem.KEY_CODEC, clustering_key="other")
+            raise AssertionError("checkpoint of other clustering tables loaded")
+        except ValueError:
+            pass
+        # Maps without a key predate the preflop bucket fix: refused unless explicitly allowed
+        unkeyed = os.path.join(directory, "unkeyed.parquet")
+        node_io.save_node_map(store, unkeyed, holdem.KEY_CODEC)
+        try:
+            holdem.load_node_map(unkeyed, 3, "quick")
+            raise AssertionError("node map without clustering tables loaded")
+        except ValueError:
+            pass
+        os.environ["POKER_ALLOW_UNKEYED_MAPS"] = "1"
+        try:
+            assert len(holdem.load_node_map(unkeyed, 3, "quick")) == len(store), "unkeyed map not loaded"
+        finally:
+            del os.environ["POKER_ALLOW_UNKEYED_MAPS"]
+        assert all(np.array_equal(store.regret_sum[store.index[key]], regret_sum)
+                   for key, (regret_sum, _) in expected[snapshots].items()), "compaction changed the rows"
+    print(f"Delta chain size: {results['delta'] / results['full']:.2f}x of full checkpoints")
+    return results
+
+def bench_strategy_file(num_lookups=200000):
+    """Open time and lookup rate of a strategy file against loading the node map."""
+    hc = quick_clustering()
+    hc.cache_key = "quick"
+    cfr = holdem.HoldemCFR(3, hc)
+    for _ in range(300):
+        cfr.train_iteration()
+    keys = list(cfr.node_map.keys())
+    probes = [keys[i] for i in np.random.randint(len(keys), size=num_lookups)]
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        map_filename = os.path.join(directory, "node_map.parquet")
+        strategy_filename = os.path.join(directory, "node_map.strategy")
+        cfr.save_node_map(map_filename)
+        strategy_file.export_strategies(cfr.node_map, strategy_filename, node_io.read_clustering_key(map_filename))
+
+        start = time.perf_counter()
+        node_map = holdem.load_node_map(map_filename, 3)
+        print(f"{'load_node_map':<40} {time.perf_counter() - start:>14.4f} s")
+        start = time.perf_counter()
+        strategies = strategy_file.StrategyFile(strategy_filename)
+        print(f"{'StrategyFile open':<40} {time.perf_counter() - start:>14.4f} s")
+
+        start = time.perf_counter()
+        for key in probes:
+            node_map[key].get_average_strategy()
+        results["node_map"] = report("node map get_average_strategy", num_lookups, time.perf_counter() - start, "lookups")
+        start = time.perf_counter()
+        for key in probes:
+            strategies[key]
+        results["mmap"] = report("StrategyFile lookup", num_lookups, time.perf_counter() - start, "lookups")
+        start = time.perf_counter()
+        batch = strategies.get_batch(probes)
+        results["batch"] = report("StrategyFile.get_batch", num_lookups, time.perf_counter() - start, "lookups")
+        expected = np.array([node_map[key].get_average_strategy() for key in probes], dtype=np.float32)
+        assert np.allclose(batch, expected), "strategy file disagrees with the node map"
+        # The serving cache loads the tables the strategy records, and refuses other ones
+        assert strategies.clustering_key == "quick", "strategy file lost the clustering key"
+        hc.save_tables(os.path.join(directory, "cache", "quick"))
+        with open(os.path.join(directory, "cache", "quick", "params.json"), "w") as f:
+            f.write('{"algorithm": "percentile"}')
+        cache = clustering_cache.ClusteringCache(cache_directory=os.path.join(directory, "cache"))
+        served = cache.load(strategies.clustering_key)
+        assert served.cache_key == "quick" and np.array_equal(served.flop_map, hc.flop_map), "served other tables"
+        try:
+            cache.load("other")
+            raise AssertionError("strategy of other clustering tables served")
+        except ValueError:
+            pass
+        del strategies, batch
+    return results
+
+def bench_clustering(num_hands=50000):
+    """Cluster lookups per second: hand-class dict against dense tables, scalar and batch."""
+    hc = quick_clustering()
+    hands = random_hands(num_hands)
+    fast_evaluator = hand_engine.FastEvaluator()
+    ranks = [fast_evaluator.evaluate(hand[:2], hand[2:5]) for hand in hands]
+    results = {}
+
+    start = time.perf_counter()
+    expected = [hc.preflop_map.get(evaluator.hand_class(*map(evaluator.card_index, hand[:2])))
+                for hand in hands]
+    results["class_key"] = report("preflop via hand class dict", num_hands, time.perf_counter() - start, "lookups")
+    start = time.perf_counter()
+    preflop = [hc.get_preflop_cluster(hand[:2]) for hand in hands]
+    results["preflop"] = report("get_preflop_cluster", num_hands, time.perf_counter() - start, "lookups")
+    start = time.perf_counter()
+    batch = hc.get_preflop_clusters(np.array(hands)[:, :2])
+    results["preflop_batch"] = report("get_preflop_clusters", num_hands, time.perf_counter() - start, "lookups")
+    start = time.perf_counter()
+    flop = [hc.get_flop_cluster(rank) for rank in ranks]
+    results["flop"] = report("get_flop_cluster", num_hands, time.perf_counter() - start, "lookups")
+    start = time.perf_counter()
+    flop_batch = hc.get_flop_clusters(np.array(ranks))
+    results["flop_batch"] = report("get_flop_clusters", num_hands, time.perf_counter() - start, "lookups")
+
+    assert preflop == expected and batch.tolist() == expected, "preflop tables disagree"
+    assert flop_batch.tolist() == flop, "flop tables disagree"
+    return results
+
+def bench_equity(num_simulations=1000):
+    """Preflop equity tables: Monte Carlo estimate against the exact table and its cache."""
+    results = {}
+    start = time.perf_counter()
+    estimate = evaluator.estimate_all_equities(num_simulations)
+    results["monte_carlo"] = report(f"estimate_all_equities({num_simulations})", 169, time.perf_counter() - start, "classes")
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        exact = equity.preflop_equities(exact=True, workers=os.cpu_count() or 1, directory=directory)
+        results["exact"] = report("exact enumeration", 169, time.perf_counter() - start, "classes")
+        start = time.perf_counter()
+        equity.preflop_equities(exact=True, directory=directory)
+        results["cached"] = report("exact, cached", 169, time.perf_counter() - start, "classes")
+    error = max(abs(estimate[key] - exact[key]) for key in exact)
+    print(f"Largest Monte Carlo error: {error:.4f}")
+    assert abs(exact[("A", "A", "")] - 0.8520) < 1e-4, "exact AA equity is off"
+
+    hole = [deuces.Card.new("As"), deuces.Card.new("Kd")]
+    for street, board in (("flop", ["Qh", "7c", "2s"]), ("turn", ["Qh", "7c", "2s", "Td"])):
+        board = [deuces.Card.new(card) for card in board]
+        start = time.perf_counter()
+        equity.exact_equity(hole, board)
+        results[street] = report(f"exact_equity on the {street}", 1, time.perf_counter() - start, "hands")
+    return results
+
+def bench_potential_clustering(num_boards=100):
+    """Clustering rate of PotentialClustering per street on num_boards boards (complete=False: the hands
+    of other canonical boards stay unassigned), checks of the index keyed lookups, then a few HoldemCFR
+    iterations on the tables."""
+    workers = os.cpu_count() or 1
+    hc = potential_clustering.PotentialClustering(workers=workers, seed=0, complete=False)
+    results = {}
+    hc.build_preflop_table(0, 5)
+    for street in ("flop", "turn", "river"):
+        start = time.perf_counter()
+        getattr(hc, f"build_{street}_table")(num_boards, 5)
+        results[street] = report(f"{street} table, {workers} worker(s)", num_boards, time.perf_counter() - start, "boards")
+    # Flop buckets are keyed by the cards, not the rank: some rank must span several buckets
+    fast_evaluator = hand_engine.FastEvaluator()
+    indexer = potential_clustering.STREET_INDEXERS[3]
+    indices = np.flatnonzero(hc.flop_index_map >= 0)[::50]
+    cards = potential_clustering.CARD_INTS[[indexer.unindex(1, int(index)) for index in indices]]
+    ranks = fast_evaluator.evaluate_batch(cards)
+    buckets_per_rank = [len(set(hc.flop_index_map[indices[ranks == rank]])) for rank in np.unique(ranks)]
+    assert max(buckets_per_rank) > 1, "flop buckets depend on the rank only"
+    # Deal and board lookups agree with the tables, and a suit permutation keeps every bucket
+    suits = {1: 4, 2: 8, 4: 1, 8: 2}
+    for hand in cards[:20]:
+        hand = hand.tolist()
+        deck = [card for card in deuces.Deck.GetFullDeck() if card not in hand]
+        deal = [hand[:2], deck[:2]], hand[2:], deck[2], deck[3]
+        permuted = [[[card & ~0xF000 | suits[(card >> 12) & 0xF] << 12 for card in cards] for cards in deal[0]],
+                    [card & ~0xF000 | suits[(card >> 12) & 0xF] << 12 for card in deal[1]],
+                    *(card & ~0xF000 | suits[(card >> 12) & 0xF] << 12 for card in deal[2:])]
+        evaluation = hand_engine.DealEvaluation(*deal, hc)
+        assert evaluation.clusters == hand_engine.DealEvaluation(*permuted, hc).clusters, "suit permutation"
+        assert evaluation.clusters[0][1] == hc._cluster(hc.flop_index_map[indexer.index(hand)]), "flop lookup"
+        board = hand_engine.BoardEvaluation(*deal[1:], hc)
+        row = next(i for i, h in enumerate(board.hands.tolist()) if sorted(h) == sorted(hand[:2]))
+        expected = [-1 if c is None else c for c in evaluation.clusters[0]]
+        assert board.sequences[board.sequence_of_hand[row]].tolist() == expected, "board lookup"
+    cfr = holdem.HoldemCFR(3, hc)
+    for _ in range(20):
+        cfr.train_iteration()
+    return results
+
+def bench_exploitability(num_deals=500000):
+    """Chance model estimation and best-response rate of exploitability, with the Kuhn equilibrium as a check."""
+    class FixedNode:
+        def __init__(self, strategy):
+            self.strategy = strategy
+
+        def get_average_strategy(self):
+            return self.strategy
+    # The alpha = 0 member of the Kuhn equilibrium family
+    nash = {"J": [1, 0], "Q": [1, 0], "K": [1, 0], "Jpb": [1, 0], "Qpb": [2 / 3, 1 / 3], "Kpb": [0, 1],
+            "Jb": [1, 0], "Qb": [2 / 3, 1 / 3], "Kb": [0, 1], "Jp": [2 / 3, 1 / 3], "Qp": [1, 0], "Kp": [0, 1]}
+    nash_conv = kuhn_exploitability.kuhn_nash_conv({k: FixedNode(v) for k, v in nash.items()})["nash_conv"]
+    assert abs(nash_conv) < 1e-12, "Kuhn equilibrium is exploitable"
+    assert abs(kuhn_exploitability.kuhn_nash_conv({})["exploitability"] - 11 / 24) < 1e-12, "uniform Kuhn exploitability"
+    results = {}
+    hc = quick_clustering()
+    start = time.perf_counter()
+    model = exploitability.BucketModel.estimate(hc, num_deals)
+    results["chance_model"] = report("BucketModel.estimate", num_deals, time.perf_counter() - start, "deals")
+    best_response = exploitability.BestResponse(model)
+    cfr = holdem.HoldemCFR(3, hc)
+    for _ in range(200):
+        cfr.train_iteration()
+    policy = tournament.load_policy(cfr)
+    start = time.perf_counter()
+    result = best_response.exploitability((policy, policy))
+    # A best response and a profile value per seat, on the model and on each of its groups
+    passes = 4 * (1 + len(model.groups))
+    results["best_response"] = report("tree walks", passes, time.perf_counter() - start, "walks")
+    print(f"exploitability after 200 iterations: {result['exploitability']:,.0f} +- {result['stderr']:,.0f} mbb/hand")
+    assert result["br_seat0"] > 0 and result["br_seat1"] > 0, "best response does not beat the trained strategy"
+    return results
+
+def bench_hand_evaluator(num_simulations=200000):
+    """Simulated games per second of the former per-game HandEvaluator loop against the batched simulator."""
+    hand = [deuces.Card.new("As"), deuces.Card.new("Kd")]
+    board = [deuces.Card.new("Qs"), deuces.Card.new("Js"), deuces.Card.new("2c")]
+    results = {}
+    # The loop HandEvaluator.simulate_preflop_games ran before batching
+    deuces_evaluator = deuces.Evaluator()
+    remaining_cards = [card for card in deuces.Deck.GetFullDeck() if card not in hand]
+    num_loop = max(1, num_simulations // 100)
+    start = time.perf_counter()
+    for _ in range(num_loop):
+        simulated_hand = np.random.choice(remaining_cards, 2, replace=False)
+        cards_for_board = [card for card in remaining_cards if card not in simulated_hand]
+        simulated_board = np.random.choice(cards_for_board, 5, replace=False)
+        deuces_evaluator.evaluate(simulated_board.tolist(), hand)
+        deuces_evaluator.evaluate(simulated_board.tolist(), simulated_hand.tolist())
+    results["loop"] = report("per-game loop", num_loop, time.perf_counter() - start, "games")
+
+    he = evaluator.HandEvaluator(hand, board, rng=np.random.default_rng(0))
+    start = time.perf_counter()
+    result = he.simulate(num_simulations)
+    results["batch"] = report("HandEvaluator.simulate", num_simulations, time.perf_counter() - start, "games")
+    exact = equity.exact_equity(hand, board)
+    print(f"{result!r}, exact win/draw/loss {exact[0]:.4f} / {exact[1]:.4f} / {exact[2]:.4f}")
+    # 99.9% intervals, so a correct simulator essentially never trips this
+    wide = evaluator.SimulationResult(result.wins, result.draws, result.losses, confidence=0.999)
+    assert all(low <= p <= high for (low, high), p in zip(wide.intervals, exact)), "simulation disagrees with exact equity"
+    result = he.simulate(num_simulations * 10, tolerance=0.005)
+    print(f"early stop at {result.num_simulations:,} games for +/-0.005")
+    return results
+
+def bench_hand_index(num_hands=20000):
+    """Index rate of hand_index.HandIndexer per Hold'em round, scalar and batch, with consistency checks."""
+    indexer = hand_index.HandIndexer()
+    sizes = [indexer.size(round) for round in range(4)]
+    assert sizes == [169, 1286792, 55190538, 2428287420], f"unexpected index sizes {sizes}"
+    print("Index sizes: " + ", ".join(f"{size:,}" for size in sizes))
+    results = {}
+    for round, num_cards in enumerate((2, 5, 6, 7)):
+        hands = random_hands(num_hands, num_cards)
+        start = time.perf_counter()
+        indices = [indexer.index(hand) for hand in hands]
+        results[f"round_{round}"] = report(f"index, round {round}", num_hands, time.perf_counter() - start, "hands")
+        start = time.perf_counter()
+        batch = indexer.index_batch(np.array(hands))
+        results[f"round_{round}_batch"] = report(f"index_batch, round {round}", num_hands,
+                                                 time.perf_counter() - start, "hands")
+        assert batch.tolist() == indices, "index_batch disagrees with index"
+        for hand, index in zip(hands[:200], indices):
+            # Permuting suits and reordering cards within a round keep the index
+            permutation = dict(zip((1, 2, 4, 8), np.random.permutation([1, 2, 4, 8]).tolist()))
+            permuted = [card & ~0xF000 | permutation[(card >> 12) & 0xF] << 12 for card in hand]
+            permuted = permuted[1::-1] + permuted[2:5][::-1] + permuted[5:]
+            assert indexer.index(permuted) == index, "index is not suit isomorphic"
+            canonical = [deuces.Card.new(deuces.Card.STR_RANKS[c // 4] + "shdc"[c % 4])
+                         for c in indexer.unindex(round, index)]
+            assert indexer.index(canonical) == index, "unindex does not invert index"
+    return results
+
+def bench_info_set_dto(num_requests=20000):
+    """Latency of dto.HoldemInfoSetDTO.to_holdem_info_set with the shared clustering cache."""
+    import dto
+    from model import Card, Suit
+    cache = clustering_cache.ClusteringCache()
+    cache.set(quick_clustering())
+    suits = {"s": Suit.SPADE, "h": Suit.HEART, "d": Suit.DIAMOND, "c": Suit.CLUB}
+    ranks = {"A": 1, "T": 10, "J": 11, "Q": 12, "K": 13}
+
+    def to_card(card):
+        text = deuces.Card.int_to_str(card)
+        return Card(rank=ranks.get(text[0]) or int(text[0]), suit=suits[text[1]])
+
+    requests = []
+    for i, hand in enumerate(random_hands(num_requests)):
+        cards = [to_card(card) for card in hand]
+        requests.append(dto.HoldemInfoSetDTO(own_cards=cards[:2], flop=cards[2:5], turn=cards[5],
+                                             river=cards[6], round=i % 4))
+    latencies = []
+    for request in requests:
+        start = time.perf_counter()
+        request.to_holdem_info_set(cache)
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1e6
+    report("to_holdem_info_set", num_requests, latencies.sum() / 1e6, "conversions")
+    print(f"{'latency p50 / p99':<40} {np.percentile(latencies, 50):>8.1f} / {np.percentile(latencies, 99):.1f} us")
+    return latencies
+
+def deep_size(key):
+    if isinstance(key, tuple):
+        return sys.getsizeof(key) + sum(deep_size(item) for item in key)
+    return sys.getsizeof(key)
+
+BENCHMARKS = {
+    "checkpoint": bench_checkpoint,
+    "clustering": bench_clustering,
+    "dealer": bench_dealer,
+    "delta_checkpoint": bench_delta_checkpoint,
+    "equity": bench_equity,
+    "evaluator": bench_evaluator,
+    "exploitability": bench_exploitability,
+    "hand_evaluator": bench_hand_evaluator,
+    "hand_index": bench_hand_index,
+    "info_set_dto": bench_info_set_dto,
+    "key_codec": bench_key_codec,
+    "node_io": bench_node_io,
+    "numba": bench_numba,
+    "parallel": bench_parallel,
+    "potential_clustering": bench_potential_clustering,
+    "pruning": bench_pruning,
+    "public_tree": bench_public_tree,
+    "sampling": bench_sampling,
+    "strategy_file": bench_strategy_file,
+    "stream_node_map": bench_stream_node_map,
+    "vector_cfr": bench_vector_cfr,
+}
+
+# Correctness checks kept out of the timed runs, run with --check
+CHECKS = {
+    "numba": check_numba,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Performance benchmarks for the CFR engines.")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("-n", "--num", type=int, default=None, help="Workload size passed to the benchmark")
+    parser.add_argument("--check", action="store_true", help=f"Run the correctness check instead ({', '.join(CHECKS)})")
+    args = parser.parse_args()
+    functions = CHECKS if args.check else BENCHMARKS
+    if args.benchmark not in functions:
+        parser.error(f"{args.benchmark} has no separate check")
+    if args.num is None:
+        functions[args.benchmark]()
+    else:
+        functions[args.benchmark](args.num)
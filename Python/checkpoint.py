@@ -0,0 +1,234 @@
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pyarrow.parquet as pq
+import node_io
+
+def checkpoint_name(prefix, iteration, delta=False):
+    return f"{prefix}_{iteration:09d}{'.delta' if delta else ''}.parquet"
+
+def manifest_name(directory, prefix):
+    return os.path.join(directory, f"{prefix}_manifest.json")
+
+def read_manifest(directory, prefix="checkpoint"):
+    """Checkpoint entries of directory, oldest first: dicts with the
+    iteration, the file name, the parent iteration a delta applies to (None
+    for a full file) and the row count. Directories without a manifest list
+    their full checkpoint files."""
+    filename = manifest_name(directory, prefix)
+    if os.path.exists(filename):
+        with open(filename) as f:
+            return json.load(f)["checkpoints"]
+    if not os.path.isdir(directory):
+        return []
+    pattern = re.compile(re.escape(prefix) + r"_(\d+)\.parquet$")
+    entries = []
+    for name in os.listdir(directory):
+        match = pattern.match(name)
+        if match:
+            entries.append({"iteration": int(match.group(1)), "file": name, "parent": None, "rows": None})
+    return sorted(entries, key=lambda entry: entry["iteration"])
+
+def write_manifest(directory, prefix, entries):
+    filename = manifest_name(directory, prefix)
+    with open(filename + ".tmp", "w") as f:
+        json.dump({"checkpoints": entries}, f, indent=1)
+    os.replace(filename + ".tmp", filename)
+
+def list_checkpoints(directory, prefix="checkpoint"):
+    # (iteration, filename) of every checkpoint in directory, oldest first
+    return [(entry["iteration"], os.path.join(directory, entry["file"])) for entry in read_manifest(directory, prefix)]
+
+def chain(entries, iteration):
+    # Entries to apply in order to rebuild iteration: a full file, then its deltas
+    by_iteration = {entry["iteration"]: entry for entry in entries}
+    links = []
+    while iteration is not None:
+        entry = by_iteration[iteration]
+        links.append(entry)
+        iteration = entry["parent"]
+    return links[::-1]
+
+def latest_checkpoint(directory, prefix="checkpoint"):
+    """Newest checkpoint iteration whose whole chain reads back as complete
+    Parquet files, None if there is none."""
+    entries = read_manifest(directory, prefix)
+    for entry in reversed(entries):
+        try:
+            for link in chain(entries, entry["iteration"]):
+                pq.read_metadata(os.path.join(directory, link["file"]))
+        except (KeyError, OSError, ValueError):
+            continue
+        return entry["iteration"]
+    return None
+
+def load_checkpoint(directory, num_actions, codec, node_factory=None, iteration=None, prefix="checkpoint",
+                    clustering_key=None):
+    """NodeStore of a checkpoint iteration (the latest by default): the full
+    file of its chain, with the rows of every following delta written over
+    it. clustering_key is checked against the full file as by
+    node_io.load_node_map."""
+    entries = read_manifest(directory, prefix)
+    if iteration is None:
+        iteration = latest_checkpoint(directory, prefix)
+        if iteration is None:
+            raise FileNotFoundError(f"No checkpoint in {directory}")
+    links = chain(entries, iteration)
+    store = node_io.load_node_map(os.path.join(directory, links[0]["file"]), num_actions, codec, node_factory,
+                                  clustering_key=clustering_key)
+    for link in links[1:]:
+        keys, regret_sum, strategy_sum = node_io.read_node_rows(os.path.join(directory, link["file"]), num_actions,
+                                                                 codec)
+        node_ids = np.fromiter((store.find_or_add(key) for key in keys), dtype=np.intp, count=len(keys))
+        store.regret_sum[node_ids] = regret_sum
+        store.strategy_sum[node_ids] = strategy_sum
+    return store
+
+def compact(directory, num_actions, codec, iteration=None, prefix="checkpoint", keep_history=False):
+    """Folds the chain of a checkpoint iteration (the latest by default) into
+    one full file, so later deltas no longer depend on the files before it.
+    Unless keep_history, the checkpoints before it are removed."""
+    if iteration is None:
+        iteration = latest_checkpoint(directory, prefix)
+    entries = read_manifest(directory, prefix)
+    entry = next(entry for entry in entries if entry["iteration"] == iteration)
+    if entry["parent"] is not None:
+        base_file = os.path.join(directory, chain(entries, iteration)[0]["file"])
+        store = load_checkpoint(directory, num_actions, codec, iteration=iteration, prefix=prefix)
+        name = checkpoint_name(prefix, iteration)
+        filename = os.path.join(directory, name)
+        node_io.save_node_map(store, filename + ".tmp", codec, clustering_key=node_io.read_clustering_key(base_file),
+                              metadata={"iteration": iteration})
+        os.replace(filename + ".tmp", filename)
+        os.remove(os.path.join(directory, entry["file"]))
+        entry.update(file=name, parent=None, rows=len(store))
+    if not keep_history:
+        entries = remove_unneeded(directory, entries, {e["iteration"] for e in entries if e["iteration"] >= iteration})
+    write_manifest(directory, prefix, entries)
+    return entries
+
+def remove_unneeded(directory, entries, kept):
+    # Deletes the files of entries that neither are kept nor lead to a kept entry
+    needed = set()
+    for iteration in kept:
+        needed.update(link["iteration"] for link in chain(entries, iteration))
+    for entry in entries:
+        if entry["iteration"] not in needed and os.path.exists(os.path.join(directory, entry["file"])):
+            os.remove(os.path.join(directory, entry["file"]))
+    return [entry for entry in entries if entry["iteration"] in needed]
+
+class Checkpointer:
+    """Periodic node map snapshots of a training run, written in the background.
+
+    `maybe_save(iteration)` takes a snapshot whenever iteration passes a
+    multiple of `every_iterations` since the last snapshot (or since
+    `start`, the iteration the run resumes from), so parallel runs that
+    report only at merges still save once per multiple, and/or every
+    `every_seconds` seconds. Only the copy of the
+    keys and rows happens on the training thread; a writer thread serializes
+    it to a .tmp file and renames it into place, then updates the manifest
+    the same way, so a crash never leaves a partial checkpoint in the
+    manifest. One write is in flight at a time: a snapshot due while the
+    previous one is still being written waits for it.
+
+    With full_every > 1 snapshots are incremental: only every full_every-th
+    one is a full file, the others are deltas holding the rows whose
+    regret_sum or strategy_sum changed since the previous snapshot. Each
+    delta names its parent in the manifest; load_checkpoint rebuilds any
+    iteration from its chain and compact folds a chain into a full file.
+
+    After each write only the `keep_last` newest checkpoints are kept, plus
+    the first one at or past each multiple of `keep_every`, plus the files
+    their chains need.
+    """
+    def __init__(self, node_map, directory, codec, prefix="checkpoint", every_iterations=1000, every_seconds=None,
+                 keep_last=3, keep_every=None, clustering_key=None, full_every=1, start=0):
+        self.node_map = node_map
+        self.directory = directory
+        self.codec = codec
+        self.prefix = prefix
+        self.every_iterations = every_iterations
+        self.every_seconds = every_seconds
+        self.keep_last = keep_last
+        self.keep_every = keep_every
+        self.clustering_key = clustering_key
+        self.full_every = full_every
+        self.start = start
+        self.last_iteration = None
+        self.last_time = time.monotonic()
+        # Rows as of the previous snapshot, compared against by the next delta
+        self.previous = None
+        self.chain_length = 0
+        self.pending = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        os.makedirs(directory, exist_ok=True)
+
+    def due(self, iteration):
+        last = self.start if self.last_iteration is None else self.last_iteration
+        if self.every_iterations and iteration // self.every_iterations > last // self.every_iterations:
+            return True
+        return self.every_seconds is not None and time.monotonic() - self.last_time >= self.every_seconds
+
+    def maybe_save(self, iteration):
+        if self.due(iteration):
+            self.save(iteration)
+
+    def save(self, iteration):
+        # Snapshot now, write in the background
+        self.wait()
+        store = self.node_map
+        parent = self.last_iteration
+        full = self.previous is None or self.chain_length + 1 >= self.full_every
+        if full:
+            keys = list(store.index.keys())
+            node_ids = np.fromiter(store.index.values(), dtype=np.intp, count=len(keys))
+            parent = None
+            self.chain_length = 0
+        else:
+            size, regret_sum, strategy_sum = self.previous
+            changed = np.ones(store.size, dtype=bool)
+            changed[:size] = ((store.regret_sum[:size] != regret_sum).any(axis=1)
+                              | (store.strategy_sum[:size] != strategy_sum).any(axis=1))
+            node_ids = np.array([node_id for node_id in np.flatnonzero(changed).tolist()
+                                 if store.row_keys[node_id] is not None], dtype=np.intp)
+            keys = [store.row_keys[node_id] for node_id in node_ids.tolist()]
+            self.chain_length += 1
+        regret_sum = store.regret_sum[node_ids]
+        strategy_sum = store.strategy_sum[node_ids]
+        if self.full_every > 1:
+            self.previous = store.snapshot()
+        self.last_iteration = iteration
+        self.last_time = time.monotonic()
+        self.pending = self.executor.submit(self._write, iteration, parent, keys, regret_sum, strategy_sum)
+
+    def _write(self, iteration, parent, keys, regret_sum, strategy_sum):
+        name = checkpoint_name(self.prefix, iteration, delta=parent is not None)
+        filename = os.path.join(self.directory, name)
+        node_io.write_node_rows(filename + ".tmp", keys, np.arange(len(keys)), regret_sum, strategy_sum, self.codec,
+                                clustering_key=self.clustering_key,
+                                metadata={"iteration": iteration, "parent": "" if parent is None else parent})
+        os.replace(filename + ".tmp", filename)
+        entries = [entry for entry in read_manifest(self.directory, self.prefix) if entry["iteration"] != iteration]
+        entries.append({"iteration": iteration, "file": name, "parent": parent, "rows": len(keys)})
+        entries.sort(key=lambda entry: entry["iteration"])
+        kept = {entry["iteration"] for entry in entries[-self.keep_last:]} if self.keep_last else set()
+        if self.keep_every:
+            previous = [0] + [entry["iteration"] for entry in entries[:-1]]
+            kept.update(entry["iteration"] for last, entry in zip(previous, entries)
+                        if entry["iteration"] // self.keep_every > last // self.keep_every)
+        write_manifest(self.directory, self.prefix, remove_unneeded(self.directory, entries, kept))
+        return filename
+
+    def wait(self):
+        # Blocks until the write in flight is done; re-raises its error
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            return pending.result()
+        return None
+
+    def close(self):
+        self.wait()
+        self.executor.shutdown()
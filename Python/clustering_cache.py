@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import numpy as np
+import evaluator
+import hand_engine
+import potential_clustering
+
+# Per algorithm, so that bumping one leaves the keys of the others (and of node maps trained on them) alone
+TABLE_CACHE_VERSIONS = {"percentile": 1, "potential": 2}
+
+def build_percentile_tables(num_clusters, num_simulations):
+    hc = evaluator.HandClustering()
+    hc.build_preflop_table(num_simulations, num_clusters)
+    hc.build_flop_table(num_simulations, num_clusters)
+    hc.build_turn_table(num_simulations, num_clusters)
+    hc.build_river_table(num_simulations, num_clusters)
+    return hc
+
+def build_potential_tables(num_clusters, num_simulations):
+    # num_simulations caps the number of boards clustered per street; on the flop and turn the hands
+    # of the other canonical boards are then assigned to the nearest bucket
+    hc = potential_clustering.PotentialClustering(workers=os.cpu_count() or 1, seed=np.random.randint(2 ** 31))
+    hc.build_preflop_table(num_simulations, num_clusters)
+    hc.build_flop_table(num_simulations, num_clusters)
+    hc.build_turn_table(num_simulations, num_clusters)
+    hc.build_river_table(num_simulations, num_clusters)
+    return hc
+
+# algorithm name -> builder(num_clusters, num_simulations) returning a HandClustering
+ALGORITHMS = {"percentile": build_percentile_tables, "potential": build_potential_tables}
+# algorithm name -> HandClustering class its tables are loaded into
+TABLE_CLASSES = {"percentile": evaluator.HandClustering, "potential": potential_clustering.PotentialClustering}
+
+def table_cache_key(num_clusters, num_simulations=20000, seed=0, algorithm="percentile"):
+    params = {"num_clusters": num_clusters, "num_simulations": num_simulations, "seed": seed,
+              "algorithm": algorithm, "version": TABLE_CACHE_VERSIONS[algorithm]}
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16], params
+
+def load_or_build(num_clusters, num_simulations=20000, seed=0, algorithm="percentile",
+                  directory="clustering_tables/cache"):
+    """Clustering tables for the given parameters, built once and then read
+    from `directory/<key>`, where key is a hash of the parameters.
+
+    The builders sample with the global random and numpy.random generators,
+    which are seeded with `seed` for the build and restored afterwards. The
+    returned clustering carries the key in `cache_key`.
+    """
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"Unknown clustering algorithm: {algorithm}")
+    key, params = table_cache_key(num_clusters, num_simulations, seed, algorithm)
+    path = os.path.join(directory, key)
+    if os.path.exists(os.path.join(path, "params.json")):
+        hc = TABLE_CLASSES[algorithm]()
+        hc.load_tables(path, verbose=False)
+        print(f"Loaded lookup tables {key}")
+    else:
+        print(f"Building lookup tables {key}...")
+        random_state, numpy_state = random.getstate(), np.random.get_state()
+        random.seed(seed)
+        np.random.seed(seed)
+        try:
+            hc = ALGORITHMS[algorithm](num_clusters, num_simulations)
+        finally:
+            random.setstate(random_state)
+            np.random.set_state(numpy_state)
+        hc.save_tables(path)
+        # Written last so an interrupted build is not mistaken for a cached one
+        with open(os.path.join(path, "params.json"), "w") as f:
+            json.dump(params, f, indent=2)
+    hc.cache_key = key
+    return hc
+
+class ClusteringCache:
+    """Process-wide HandClustering and hand evaluator, loaded once.
+
+    Without a clustering key the tables are read from `directory`. With one,
+    given here or by the strategy passed to `load`, they are the
+    load_or_build tables in `cache_directory/<key>`, so a strategy is served
+    with the buckets it was trained on; a strategy trained on other tables
+    is refused. With `reload` set, `get_clustering` checks the table files' modification
+    times at most every `check_interval` seconds and reloads them when they
+    change. A reload builds a new HandClustering and swaps it in, so requests
+    in flight keep the tables they started with.
+    """
+    def __init__(self, directory="clustering_tables", reload=False, check_interval=1.0, clustering_key=None,
+                 cache_directory="clustering_tables/cache"):
+        self.directory = directory
+        self.clustering_key = clustering_key
+        self.cache_directory = cache_directory
+        self.reload = reload
+        self.check_interval = check_interval
+        self.clustering = None
+        self.evaluator = None
+        self.mtimes = None
+        self.last_check = 0.0
+        self.lock = threading.Lock()
+
+    def table_directory(self):
+        if self.clustering_key is None:
+            return self.directory
+        return os.path.join(self.cache_directory, self.clustering_key)
+
+    def table_mtimes(self):
+        directory = self.table_directory()
+        if not os.path.isdir(directory):
+            return ()
+        names = sorted(name for name in os.listdir(directory) if name.endswith(".parquet"))
+        return tuple((name, os.path.getmtime(os.path.join(directory, name))) for name in names)
+
+    def load(self, clustering_key=None):
+        # clustering_key: the key recorded by the strategy being served, if any
+        with self.lock:
+            if clustering_key is not None:
+                if self.clustering_key is not None and clustering_key != self.clustering_key:
+                    raise ValueError(f"The strategy was trained with clustering tables {clustering_key}, "
+                                     f"not {self.clustering_key}")
+                self.clustering_key = clustering_key
+            directory = self.table_directory()
+            if self.clustering_key is None:
+                clustering = evaluator.HandClustering()
+            else:
+                params_path = os.path.join(directory, "params.json")
+                if not os.path.exists(params_path):
+                    raise ValueError(f"Clustering tables {self.clustering_key} not found in {self.cache_directory}")
+                with open(params_path) as f:
+                    clustering = TABLE_CLASSES[json.load(f)["algorithm"]]()
+            mtimes = self.table_mtimes()
+            clustering.load_tables(directory, verbose=False)
+            clustering.cache_key = self.clustering_key
+            if self.evaluator is None:
+                self.evaluator = hand_engine.FastEvaluator()
+            self.clustering = clustering
+            self.mtimes = mtimes
+            self.last_check = time.monotonic()
+        return clustering
+
+    def set(self, clustering):
+        # Serve tables built in memory instead of the files in `directory`
+        with self.lock:
+            if self.evaluator is None:
+                self.evaluator = hand_engine.FastEvaluator()
+            self.clustering = clustering
+            self.mtimes = None
+
+    def get_clustering(self):
+        if self.clustering is None:
+            return self.load()
+        if self.reload and self.mtimes is not None:
+            now = time.monotonic()
+            if now - self.last_check >= self.check_interval:
+                self.last_check = now
+                if self.table_mtimes() != self.mtimes:
+                    return self.load()
+        return self.clustering
+
+    def get_evaluator(self):
+        if self.evaluator is None:
+            self.load()
+        return self.evaluator
+
+shared = ClusteringCache(os.environ.get("POKER_CLUSTERING_TABLES", "clustering_tables"),
+                         reload=os.environ.get("POKER_RELOAD_TABLES", "0") == "1",
+                         clustering_key=os.environ.get("POKER_CLUSTERING_KEY"))
@@ -1,14 +1,18 @@
-import random
 import deuces
+import os
 import holdem
+import random_streams
+import tournament
 import evaluator
 from rule_based_models import RuleBasedModel, RuleBasedNode
 
-def play_hand(cfr_player0, cfr_player1, hc5, hc6):
-    deck = deuces.Deck()
-    cards = [deck.draw(2), deck.draw(2)]
-    flop = deck.draw(3)
-    turn, river = deck.draw(2)
+def play_hand(cfr_player0, cfr_player1, hc5, hc6, seed=None):
+    # seed: an int, None, or a random_streams.Stream that consecutive hands keep drawing from
+    stream = random_streams.stream(seed)
+    dealt = stream.dealer.deal(9)
+    cards = [dealt[0:2], dealt[2:4]]
+    flop = dealt[4:7]
+    turn, river = dealt[7:9]
 
     history = holdem.HoldemInfoSet()  # shared copy for simulation
     evaluator = deuces.Evaluator()
@@ -30,13 +34,13 @@ def play_hand(cfr_player0, cfr_player1, hc5, hc6):
         history.add_cluster(clustering.get_preflop_cluster(cards[current_player]))
         if round >= 1:
             eval_f = evaluator.evaluate(cards[current_player], flop)
-            history.add_cluster(clustering.get_flop_cluster(eval_f))
+            history.add_cluster(clustering.get_street_cluster(1, cards[current_player], flop, eval_f))
         if round >= 2:
             eval_t = evaluator.evaluate(cards[current_player], flop + [turn])
-            history.add_cluster(clustering.get_turn_cluster(eval_t))
+            history.add_cluster(clustering.get_street_cluster(2, cards[current_player], flop + [turn], eval_t))
         if round >= 3:
             eval_r = evaluator.evaluate(cards[current_player], flop + [turn, river])
-            history.add_cluster(clustering.get_river_cluster(eval_r))
+            history.add_cluster(clustering.get_street_cluster(3, cards[current_player], flop + [turn, river], eval_r))
 
         info_set_key = history.key()
         model = cfr_player0 if current_player == 0 else cfr_player1
@@ -68,7 +72,7 @@ def play_hand(cfr_player0, cfr_player1, hc5, hc6):
             strategy = [1.0 / 3] * 3
 
         # Choose action
-        action = random.choices(range(3), weights=strategy)[0]
+        action = stream.random.choices(range(3), weights=strategy)[0]
 
         # Only allow 2 raises/bets
         if history.get_history().count('b') >= 2 and action == 1:
@@ -88,10 +92,11 @@ def play_hand(cfr_player0, cfr_player1, hc5, hc6):
 
         current_player = 1 - current_player
 
-def evaluate_models(cfr_lower, cfr_higher, hc_lower, hc_higher, num_games=10000):
+def evaluate_models(cfr_lower, cfr_higher, hc_lower, hc_higher, num_games=10000, seed=None):
+    stream = random_streams.stream(seed)
     results = {"cfrlow_win": 0, "cfrhigh_win": 0, "tie": 0, "total": 0}
     for i in range(num_games):
-        result = play_hand(cfr_lower, cfr_higher, hc_lower, hc_higher)
+        result = play_hand(cfr_lower, cfr_higher, hc_lower, hc_higher, stream)
         if result > 0:
             results["cfrlow_win"] += 1
         elif result < 0:
@@ -103,10 +108,11 @@ def evaluate_models(cfr_lower, cfr_higher, hc_lower, hc_higher, num_games=10000)
             print(f"Played {i+1} games")
     return results
 
-def evaluate_models_by_sum(cfr0, cfr1, hc0, hc1, num_games=10000):
+def evaluate_models_by_sum(cfr0, cfr1, hc0, hc1, num_games=10000, seed=None):
+    stream = random_streams.stream(seed)
     results = {"player0_utility": 0, "player1_utility": 0, "total": 0}
     for i in range(num_games):
-        result = play_hand(cfr0, cfr1, hc0, hc1)
+        result = play_hand(cfr0, cfr1, hc0, hc1, stream)
         results["player0_utility"] += result
         results["total"] += 1
         if (i + 1) % 1000 == 0:
@@ -130,16 +136,6 @@ def evaluate_models_by_sum(cfr0, cfr1, hc0, hc1, num_games=10000):
 # hc6.build_river_table(20000, 6)
 # print("Building river table finished.")
 
-hc = evaluator.HandClustering()
-
-
-print("Building lookup tables...")
-hc.build_preflop_table(20000, 5)
-hc.build_flop_table(20000, 5)
-hc.build_turn_table(20000, 5)
-hc.build_river_table(20000, 5)
-print("Building lookup tables finished.")
-
 action_map = {0: 'p', 1: 'b', 2: 'f'}
 
 always_call_model = RuleBasedModel(
@@ -153,23 +149,24 @@ always_raise_model = RuleBasedModel(
     strategy=[0.0, 1.0, 0.0]  # 0% call/check, 100% bet/raise, 0% fold
 )
 
-cfr1 = holdem.HoldemCFR(3, hc, action_map={0: 'p', 1: 'b', 2: 'f'}, node_map=holdem.load_node_map("bucket_5_1k.parquet", 3))
-cfr10 = holdem.HoldemCFR(3, hc, action_map={0: 'p', 1: 'b', 2: 'f'}, node_map=holdem.load_node_map("bucket_5_10k.parquet", 3))
-cfr20 = holdem.HoldemCFR(3, hc, action_map={0: 'p', 1: 'b', 2: 'f'}, node_map=holdem.load_node_map("bucket_5_20k.parquet", 3))
-cfr30 = holdem.HoldemCFR(3, hc, action_map={0: 'p', 1: 'b', 2: 'f'}, node_map=holdem.load_node_map("bucket_5_30k.parquet", 3))
-cfr50 = holdem.HoldemCFR(3, hc, action_map={0: 'p', 1: 'b', 2: 'f'}, node_map=holdem.load_node_map("bucket_5_50k_2.parquet", 3))
-cfr_against_calling_station = holdem.HoldemCFR(3, hc, action_map, node_map=holdem.load_node_map("against_calling_machine_50k.parquet", 3))
-
-#cfr_list = [always_call_model, always_raise_model, cfr1, cfr10, cfr20, cfr30, cfr50]
-cfr_list = [always_call_model, cfr50]
-results = []
-for i in range(len(cfr_list)):
-    for j in range (i+1, len(cfr_list)):
-        result = evaluate_models_by_sum(cfr_list[i], cfr_list[j], hc, hc, num_games=20000)
-        print("Evaluation Results:", result)
-        result = evaluate_models_by_sum(cfr_list[j], cfr_list[i], hc, hc, num_games=20000)
-        print("Evaluation Results:", result)
-        results.append(result)
-
-#print("Evaluation Results:", results)
-
+models = {
+    "always_call": always_call_model,
+    "always_raise": always_raise_model,
+    "cfr1": "bucket_5_1k.parquet",
+    "cfr10": "bucket_5_10k.parquet",
+    "cfr20": "bucket_5_20k.parquet",
+    "cfr30": "bucket_5_30k.parquet",
+    "cfr50": "bucket_5_50k_2.parquet",
+    "cfr_against_calling_station": "against_calling_machine_50k.parquet",
+}
+
+if __name__ == "__main__":
+    # The bucket_5_* maps predate clustering keys and the preflop bucket fix
+    os.environ.setdefault("POKER_ALLOW_UNKEYED_MAPS", "1")
+    # Duplicate matches on a process pool, both seatings per deal; see tournament.run_tournament.
+    # evaluate_models takes the tables explicitly: clustering_cache.load_or_build(5)
+    #matrix, pairings = tournament.run_tournament(models, num_clusters=5, num_hands=20000, output="comparison.csv")
+    matrix, pairings = tournament.run_tournament({name: models[name] for name in ("always_call", "cfr50")},
+                                                 num_clusters=5, num_hands=20000, output="comparison.csv")
+    print("Evaluation Results:")
+    print(matrix.round(1))
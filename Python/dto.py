@@ -1,8 +1,8 @@
-from pydantic import Field
+from pydantic import BaseModel, ConfigDict, Field
 from model import Move, PokerMove, Card, Suit
 from holdem import HoldemInfoSet
-from deuces import Card as DeucesCard, Evaluator
-from evaluator import HandClustering
+from deuces import Card as DeucesCard
+import clustering_cache
 
 class MoveDTO:
     poker_move: PokerMove
@@ -18,7 +18,9 @@ class MoveDTO:
         )
     
 
-class HoldemInfoSetDTO:
+class HoldemInfoSetDTO(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
     history: list[str] = Field(default=["", "", "", ""])
     own_cards: list[Card] = Field(alias="ownCards", default=[])
     flop: list[Card] = Field(default=[])
@@ -27,51 +29,49 @@ class HoldemInfoSetDTO:
     round: int = Field(default=0)
     pot: list[int] = Field(default=[0,0])
 
-    def to_holdem_info_set(self):
+    def to_holdem_info_set(self, cache: clustering_cache.ClusteringCache = clustering_cache.shared):
+        # Tables and evaluator come from the process-wide cache loaded at startup
+        hand_clustering = cache.get_clustering()
+        evaluator = cache.get_evaluator()
         info_set = HoldemInfoSet()
-        info_set.history=self.history
+        info_set.history=list(self.history)
         info_set.round=self.round
-        info_set.pot=self.pot
+        info_set.pot=list(self.pot)
         hand = [card_to_deuces_card(own_card) for own_card in self.own_cards]
-        flop = [card_to_deuces_card(flop_card) for flop_card in self.flop]
-        turn = card_to_deuces_card(self.turn)
-        river = card_to_deuces_card(self.river)
         info_set.clear_clusters()
-        evaluator = Evaluator()
-        hand_clustering = HandClustering()
-        hand_clustering.load_tables()
         info_set.add_cluster(hand_clustering.get_preflop_cluster(hand))
         board = []
         if self.round >=1:
-            board +=flop
-            evaluation = evaluator.evaluate(hand, flop)
-            info_set.add_cluster(hand_clustering.get_flop_cluster(evaluation))
-        if round >=2:
-            board.append(turn)
+            board += [card_to_deuces_card(flop_card) for flop_card in self.flop]
+            evaluation = evaluator.evaluate(hand, board)
+            info_set.add_cluster(hand_clustering.get_street_cluster(1, hand, board, evaluation))
+        if self.round >=2:
+            board.append(card_to_deuces_card(self.turn))
             evaluation = evaluator.evaluate(hand, board)
-            info_set.add_cluster(hand_clustering.get_turn_cluster(evaluation))
-        if round >=3:
-            board.append(river)
+            info_set.add_cluster(hand_clustering.get_street_cluster(2, hand, board, evaluation))
+        if self.round >=3:
+            board.append(card_to_deuces_card(self.river))
             evaluation = evaluator.evaluate(hand, board)
-            info_set.add_cluster(hand_clustering.get_river_cluster(evaluation))
+            info_set.add_cluster(hand_clustering.get_street_cluster(3, hand, board, evaluation))
         return info_set
 
 
+SUIT_MAP = {
+    Suit.HEART: 'h',
+    Suit.SPADE: 's',
+    Suit.CLUB: 'c',
+    Suit.DIAMOND: 'd'
+}
+
+RANK_MAP = {
+    1: 'A', 2: '2', 3: '3', 4: '4', 5: '5', 6: '6',
+    7: '7', 8: '8', 9: '9', 10: 'T',
+    11: 'J', 12: 'Q', 13: 'K'
+}
+
+# All 52 conversions computed once instead of parsing a card string per call
+DEUCES_CARDS = {(rank, suit): DeucesCard.new(rank_char + suit_char)
+                for rank, rank_char in RANK_MAP.items() for suit, suit_char in SUIT_MAP.items()}
+
 def card_to_deuces_card(card: Card) -> int:
-    suit_map = {
-        Suit.HEART: 'h',
-        Suit.SPADE: 's',
-        Suit.CLUB: 'c',
-        Suit.DIAMOND: 'd'
-    }
-    
-    rank_map = {
-        1: 'A', 2: '2', 3: '3', 4: '4', 5: '5', 6: '6',
-        7: '7', 8: '8', 9: '9', 10: 'T',
-        11: 'J', 12: 'Q', 13: 'K'
-    }
-    
-    rank_char = rank_map[card.rank]
-    suit_char = suit_map[card.suit]
-    card_str = rank_char + suit_char
-    return DeucesCard.new(card_str)
\ No newline at end of file
+    return DEUCES_CARDS[(card.rank, card.suit)]
\ No newline at end of file
@@ -0,0 +1,211 @@
+import hashlib
+import json
+import multiprocessing
+import os
+from itertools import combinations, permutations
+import numpy as np
+import pandas as pd
+from deuces import Card
+import evaluator
+import hand_engine
+
+CARD_PRIMES = np.array([Card.PRIMES[i // 4] for i in range(52)], dtype=np.int64)
+CARD_RANK_BITS = np.array([1 << (i // 4) for i in range(52)], dtype=np.int64)
+COMBOS = np.array(list(combinations(range(52), 2)), dtype=np.int64)  # the 1326 two-card hands
+COMBO_INDEX = np.full((52, 52), -1, dtype=np.int64)
+COMBO_INDEX[COMBOS[:, 0], COMBOS[:, 1]] = np.arange(len(COMBOS))
+COMBO_INDEX[COMBOS[:, 1], COMBOS[:, 0]] = np.arange(len(COMBOS))
+# CARD_COMBOS[c] lists the 51 combos holding card c
+CARD_COMBOS = np.array([[COMBO_INDEX[c, o] for o in range(52) if o != c] for c in range(52)])
+HAND_CLASSES = sorted(evaluator.generate_169_hands())
+COMBO_CLASSES = np.array([HAND_CLASSES.index(evaluator.hand_class(*combo)) for combo in COMBOS])
+RANK_STRIDE = 8192  # larger than any deuces rank, used to batch searchsorted over rows
+
+def combo_masks(cards):
+    # Prime product, per-suit card counts and per-suit rank masks of card index sets
+    cards = np.asarray(cards)
+    products = CARD_PRIMES[cards].prod(axis=-1)
+    suits = cards % 4
+    counts = np.stack([(suits == s).sum(axis=-1) for s in range(4)], axis=-1)
+    masks = np.stack([np.where(suits == s, CARD_RANK_BITS[cards], 0).sum(axis=-1) for s in range(4)], axis=-1)
+    return products, counts, masks
+
+COMBO_PRODUCTS, COMBO_SUIT_COUNTS, COMBO_SUIT_MASKS = combo_masks(COMBOS)
+
+def rank_all_combos(boards, fast_evaluator=None):
+    """Deuces rank of every two-card hand on each board of 3 to 5 cards.
+
+    boards: (n, size) array of card indices. Returns an (n, 1326) int16 array
+    with 0 for hands that share a card with the board; 0 is better than any
+    real rank, so those hands never count as losing to or tying anything.
+    """
+    if fast_evaluator is None:
+        fast_evaluator = hand_engine.FastEvaluator()
+    boards = np.asarray(boards, dtype=np.int64)
+    board_products, board_counts, board_masks = combo_masks(boards)
+    products = board_products[:, None] * COMBO_PRODUCTS[None, :]
+    positions = np.searchsorted(fast_evaluator.sorted_products, products)
+    positions = np.minimum(positions, len(fast_evaluator.sorted_products) - 1)
+    ranks = fast_evaluator.sorted_ranks[positions]
+    for s in range(4):
+        flush = board_counts[:, s, None] + COMBO_SUIT_COUNTS[None, :, s] >= 5
+        if flush.any():
+            masks = board_masks[:, s, None] | COMBO_SUIT_MASKS[None, :, s]
+            ranks = np.where(flush, np.minimum(ranks, fast_evaluator.flush_table[masks & 0x1FFF]), ranks)
+    in_board = np.zeros((len(boards), 52), dtype=bool)
+    np.put_along_axis(in_board, boards, True, axis=1)
+    conflict = in_board[:, COMBOS[:, 0]] | in_board[:, COMBOS[:, 1]]
+    return np.where(conflict, 0, ranks).astype(np.int16)
+
+def canonical_boards(size=5):
+    """Suit-isomorphism classes of the boards of `size` cards (134,459 of the
+    2,598,960 five-card boards, 1,755 flops).
+
+    Returns the representative boards (card index arrays) and the number of
+    boards in each class; summing a suit-symmetric statistic over the
+    representatives with these weights equals summing it over every board.
+    """
+    boards = np.array(list(combinations(range(52), size)), dtype=np.int64)
+    ranks = boards // 4
+    suits = boards % 4
+    powers = 52 ** np.arange(size - 1, -1, -1)
+    codes = None
+    for permutation in permutations(range(4)):
+        mapped = np.sort(ranks * 4 + np.array(permutation)[suits], axis=1)
+        code = (mapped * powers).sum(axis=1)
+        codes = code if codes is None else np.minimum(codes, code)
+    codes, weights = np.unique(codes, return_counts=True)
+    canonical = np.stack([(codes // power) % 52 for power in powers], axis=1)
+    return canonical, weights
+
+def board_outcomes(ranks):
+    """Wins and ties of every hand against every disjoint opponent hand.
+
+    ranks: (n, 1326) output of rank_all_combos. Counts over all 1326 hands
+    are corrected for card removal by inclusion-exclusion over the hands
+    that hold either of the hero's two cards.
+    """
+    n = len(ranks)
+    ranks = ranks.astype(np.int64)
+    rows = np.arange(n)[:, None]
+
+    sorted_all = np.sort(ranks, axis=1)
+    flat_all = (sorted_all + rows * RANK_STRIDE).ravel()
+    queries = ranks + rows * RANK_STRIDE
+    right = np.searchsorted(flat_all, queries, side="right") - rows * ranks.shape[1]
+    left = np.searchsorted(flat_all, queries, side="left") - rows * ranks.shape[1]
+    worse = ranks.shape[1] - right
+    equal = right - left
+
+    by_card = np.sort(ranks[:, CARD_COMBOS], axis=2)  # (n, 52, 51)
+    card_rows = rows[:, :, None] * 52 + np.arange(52)[None, :, None]
+    flat_card = (by_card + card_rows * RANK_STRIDE).ravel()
+    for column in (0, 1):
+        card = COMBOS[:, column][None, :]
+        queries = ranks + (rows * 52 + card) * RANK_STRIDE
+        base = (rows * 52 + card) * CARD_COMBOS.shape[1]
+        card_right = np.searchsorted(flat_card, queries, side="right") - base
+        card_left = np.searchsorted(flat_card, queries, side="left") - base
+        worse -= CARD_COMBOS.shape[1] - card_right
+        equal -= card_right - card_left
+    # The hero hand is counted once in the total and once per card as equal
+    equal += 1
+    return worse, equal
+
+def hand_strengths(boards, fast_evaluator=None):
+    """River hand strength, (wins + ties / 2) / 990, of every two-card hand on
+    each 5-card board, as an (n, 1326) array with NaN for hands sharing a
+    card with the board."""
+    ranks = rank_all_combos(boards, fast_evaluator)
+    worse, equal = board_outcomes(ranks)
+    return np.where(ranks > 0, (worse + 0.5 * equal) / 990, np.nan)
+
+def _preflop_chunk(args):
+    boards, weights = args
+    fast_evaluator = hand_engine.FastEvaluator()
+    ranks = rank_all_combos(boards, fast_evaluator)
+    valid = ranks > 0
+    worse, equal = board_outcomes(ranks)
+    w = weights[:, None] * valid
+    wins = np.bincount(COMBO_CLASSES, weights=(w * worse).sum(axis=0), minlength=len(HAND_CLASSES))
+    ties = np.bincount(COMBO_CLASSES, weights=(w * equal).sum(axis=0), minlength=len(HAND_CLASSES))
+    totals = np.bincount(COMBO_CLASSES, weights=w.sum(axis=0) * 990, minlength=len(HAND_CLASSES))
+    return wins, ties, totals
+
+def exact_preflop_equities(workers=1, chunk_size=256):
+    """Exact all-in equity of each of the 169 hand classes against a random hand.
+
+    Every (hero, opponent, board) deal is counted once: boards are enumerated
+    up to suit isomorphism and, on each, all 1326 hands are ranked and
+    compared at once. Returns a DataFrame with hand_key, win, tie, equity.
+    """
+    boards, weights = canonical_boards()
+    chunks = [(boards[i:i + chunk_size], weights[i:i + chunk_size]) for i in range(0, len(boards), chunk_size)]
+    if workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            results = pool.map(_preflop_chunk, chunks)
+    else:
+        results = [_preflop_chunk(chunk) for chunk in chunks]
+    wins = sum(r[0] for r in results)
+    ties = sum(r[1] for r in results)
+    totals = sum(r[2] for r in results)
+    return pd.DataFrame({
+        "hand_key": HAND_CLASSES,
+        "win": wins / totals,
+        "tie": ties / totals,
+        "equity": (wins + 0.5 * ties) / totals,
+    })
+
+def cache_path(directory, name, params):
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+    return os.path.join(directory, f"{name}_{digest}.parquet")
+
+def preflop_equities(exact=True, num_simulations=1000, workers=1, directory="equity_cache"):
+    """Preflop equity of the 169 hand classes as {hand_key: equity}, cached on disk.
+
+    The cache file name is a hash of the parameters that change the result,
+    so exact tables are computed once per machine and Monte Carlo tables
+    once per simulation count.
+    """
+    params = {"method": "exact"} if exact else {"method": "monte_carlo", "num_simulations": num_simulations}
+    path = cache_path(directory, "preflop_equity", params)
+    if os.path.exists(path):
+        df = pd.read_parquet(path)
+    else:
+        if exact:
+            df = exact_preflop_equities(workers)
+        else:
+            equity_map = evaluator.estimate_all_equities(num_simulations)
+            df = pd.DataFrame({"hand_key": list(equity_map), "equity": list(equity_map.values())})
+        os.makedirs(directory, exist_ok=True)
+        df.assign(hand_key=df["hand_key"].map(list)).to_parquet(path, index=False)
+    return dict(zip(map(tuple, df["hand_key"]), df["equity"]))
+
+def exact_equity(hole, board=(), directory="equity_cache"):
+    """Exact [win, tie, loss] probabilities of hole cards against one random hand.
+
+    hole and board are deuces card ints; board may hold 0, 3, 4 or 5 cards.
+    All board completions and opponent hands are enumerated; the preflop
+    case is read from the cached exact preflop table.
+    """
+    hole = [evaluator.card_index(card) for card in hole]
+    board = [evaluator.card_index(card) for card in board]
+    if not board:
+        path = cache_path(directory, "preflop_equity", {"method": "exact"})
+        if not os.path.exists(path):
+            preflop_equities(True, directory=directory)
+        df = pd.read_parquet(path)
+        row = df[df["hand_key"].map(tuple) == evaluator.hand_class(*hole)].iloc[0]
+        return [row["win"], row["tie"], 1.0 - row["win"] - row["tie"]]
+    known = set(hole) | set(board)
+    remaining = [c for c in range(52) if c not in known]
+    completions = np.array([board + list(extra) for extra in combinations(remaining, 5 - len(board))])
+    ranks = rank_all_combos(completions).astype(np.int64)
+    hero = ranks[:, COMBO_INDEX[hole[0], hole[1]]][:, None]
+    opponents = ranks > 0
+    for card in hole:
+        opponents[:, CARD_COMBOS[card]] = False
+    total = opponents.sum()
+    wins = (opponents & (ranks > hero)).sum() / total
+    ties = (opponents & (ranks == hero)).sum() / total
+    return [wins, ties, 1.0 - wins - ties]
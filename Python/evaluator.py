@@ -4,6 +4,9 @@ import numpy as np
 import pandas as pd
 import os
 import random
+from math import sqrt
+from statistics import NormalDist
+import hand_engine
 # card = Card.new('Qh')
 # board = [
 #     Card.new('Ah'),
@@ -77,6 +80,26 @@ def str_to_card(card_str):
 def card_obj_to_str(card):
     return Card.int_to_str(card)  # e.g., 'Ah', 'Td', etc.
 
+SUIT_INDEX = {1: 0, 2: 1, 4: 2, 8: 3}
+SUIT_INDEX_ARRAY = np.array([-1, 0, 1, -1, 2, -1, -1, -1, 3])
+NUM_RANKS = 7463  # deuces ranks run from 1 (royal flush) to 7462
+
+def card_index(card):
+    # 0..51, rank-major: 4 * rank + suit, with deuces rank 0 = '2'
+    return ((card >> 8) & 0xF) * 4 + SUIT_INDEX[(card >> 12) & 0xF]
+
+def card_indices(cards):
+    cards = np.asarray(cards, dtype=np.int64)
+    return ((cards >> 8) & 0xF) * 4 + SUIT_INDEX_ARRAY[(cards >> 12) & 0xF]
+
+def hand_class(index1, index2):
+    # Class key of a two-card hand in the form used by generate_169_hands
+    r1, r2 = sorted((index1 // 4, index2 // 4), reverse=True)
+    rank1, rank2 = Card.STR_RANKS[r1], Card.STR_RANKS[r2]
+    if r1 == r2:
+        return (rank1, rank2, '')
+    return (rank1, rank2, 's' if index1 % 4 == index2 % 4 else 'o')
+
 def canonical_hand_key(card1, card2):
     r1 = card_obj_to_str(card1)[0]
     r2 = card_obj_to_str(card2)[0]
@@ -124,95 +147,207 @@ def estimate_all_equities(num_simulations=1000):
 
     return equity_map
 
+class SimulationResult:
+    """Win/draw/loss counts of a simulation with Wilson score intervals at
+    the given confidence level."""
+    def __init__(self, wins, draws, losses, confidence=0.95):
+        self.wins = int(wins)
+        self.draws = int(draws)
+        self.losses = int(losses)
+        self.confidence = confidence
+
+    @property
+    def num_simulations(self):
+        return self.wins + self.draws + self.losses
+
+    @property
+    def probabilities(self):
+        n = self.num_simulations
+        return [self.wins / n, self.draws / n, self.losses / n]
+
+    @property
+    def equity(self):
+        return (self.wins + 0.5 * self.draws) / self.num_simulations
+
+    @property
+    def intervals(self):
+        # [(low, high)] for win, draw and loss
+        n = self.num_simulations
+        z = NormalDist().inv_cdf(0.5 + self.confidence / 2)
+        intervals = []
+        for p in self.probabilities:
+            center = (p + z * z / (2 * n)) / (1 + z * z / n)
+            half_width = z / (1 + z * z / n) * sqrt(p * (1 - p) / n + z * z / (4 * n * n))
+            intervals.append((center - half_width, center + half_width))
+        return intervals
+
+    @property
+    def half_width(self):
+        return max(high - low for low, high in self.intervals) / 2
+
+    def __repr__(self):
+        win, draw, loss = self.probabilities
+        return (f"SimulationResult(win={win:.4f}, draw={draw:.4f}, loss={loss:.4f}, "
+                f"n={self.num_simulations}, +/-{self.half_width:.4f})")
+
+def sample_cards(rng, deck, num_samples, num_cards):
+    # num_samples draws of num_cards distinct cards of deck, as an (n, num_cards) array
+    keys = rng.random((num_samples, len(deck)))
+    return deck[np.argpartition(keys, num_cards - 1, axis=1)[:, :num_cards]]
+
 class HandEvaluator:
-    def __init__(self, hand, board):
+    """Monte Carlo win/draw/loss of `hand` on `board` against one random hand.
+
+    `simulate` draws opponent hands and board run-outs for a whole batch in
+    one step and ranks them with FastEvaluator.evaluate_batch. The
+    simulate_* methods keep their list results and sample through it.
+    Draws come from `rng`, or a generator of `seed`; a seed passed to a
+    simulation method replays that seed for the call instead.
+    """
+    def __init__(self, hand, board, rng=None, seed=None):
         self.hand = hand
         self.board = board
         full_deck = Deck().GetFullDeck()
         known_cards = np.concatenate([board, hand], axis=0)
         self.remaining_cards = [card for card in full_deck if card not in known_cards]
-
-    def simulate_games(self, num_simulations):
-        evaluator = Evaluator()
-        base_eval = evaluator.evaluate(self.board, self.hand)
-        wins = 0
-        draws = 0
-        losses = 0
-        for i in range(num_simulations):
-            simulated_hand = np.random.choice(self.remaining_cards, 2, replace=False)
-            simulated_eval = evaluator.evaluate(self.board, simulated_hand.tolist())
-            if base_eval < simulated_eval:
-                wins +=1
-            elif base_eval == simulated_eval:
-                draws +=1
-            else:
-                losses +=1
-        return [wins/num_simulations, draws/num_simulations, losses/num_simulations]
-    
-    def simulate_games_by_eval(self, eval, num_simulations, board_size):
-        evaluator = Evaluator()
-        wins = 0
-        draws = 0
-        losses = 0
-        for i in range(num_simulations):
-            deck = Deck()
-            simulated_hand = deck.draw(2)
-            simulated_board = deck.draw(board_size)
-            simulated_eval = evaluator.evaluate(simulated_board, simulated_hand)
-            if eval < simulated_eval:
-                wins +=1
-            elif eval == simulated_eval:
-                draws +=1
-            else:
-                losses +=1
-        return [wins/num_simulations, draws/num_simulations, losses/num_simulations]
-    def simulate_preflop_games(self, num_simulations):
-        evaluator = Evaluator()
-        wins = 0
-        draws = 0
-        losses = 0
-        remaining_cards = np.concatenate([self.remaining_cards, self.board], axis=0)
-        for i in range(num_simulations):
-            simulated_hand = np.random.choice(remaining_cards, 2, replace=False)
-            cards_for_board = [card for card in remaining_cards if card not in simulated_hand]
-            simulated_board = np.random.choice(cards_for_board, 5, replace=False)
-            eval = evaluator.evaluate(simulated_board.tolist(), self.hand)
-            simulated_eval = evaluator.evaluate(simulated_board.tolist(), simulated_hand.tolist())
-            if eval < simulated_eval:
-                wins +=1
-            elif eval == simulated_eval:
-                draws +=1
-            else:
-                losses +=1
-        return [wins/num_simulations, draws/num_simulations, losses/num_simulations]
+        # Without a generator, draw its seed from numpy.random so that seeding the global state still applies
+        if rng is None:
+            rng = np.random.default_rng(seed if seed is not None else np.random.randint(2 ** 31))
+        self.rng = rng
+        self.evaluator = hand_engine.FastEvaluator()
+
+    def generator(self, seed=None):
+        return self.rng if seed is None else np.random.default_rng(seed)
+
+    def simulate(self, num_simulations, board=None, run_out=True, batch_size=8192,
+                 tolerance=None, confidence=0.95, seed=None):
+        """Simulates up to num_simulations games in batches of batch_size.
+
+        The board (self.board unless given) is completed to five cards when
+        run_out is set and evaluated as it is otherwise. With a tolerance,
+        simulation stops after the first batch at which every win/draw/loss
+        interval has a half width of at most tolerance.
+        """
+        rng = self.generator(seed)
+        board = list(self.board if board is None else board)
+        known = set(self.hand) | set(board)
+        deck = np.array([card for card in Deck.GetFullDeck() if card not in known], dtype=np.int64)
+        num_board_cards = 5 - len(board) if run_out else 0
+        board_cards = np.array(board, dtype=np.int64)
+        hand_cards = np.array(self.hand, dtype=np.int64)
+        wins = draws = losses = 0
+        result = None
+        while num_simulations > 0:
+            n = min(batch_size, num_simulations)
+            num_simulations -= n
+            drawn = sample_cards(rng, deck, n, 2 + num_board_cards)
+            boards = np.hstack([np.broadcast_to(board_cards, (n, len(board))), drawn[:, 2:]])
+            hero = self.evaluator.evaluate_batch(np.hstack([np.broadcast_to(hand_cards, (n, 2)), boards]))
+            opponent = self.evaluator.evaluate_batch(np.hstack([drawn[:, :2], boards]))
+            wins += int((hero < opponent).sum())
+            draws += int((hero == opponent).sum())
+            losses += int((hero > opponent).sum())
+            result = SimulationResult(wins, draws, losses, confidence)
+            if tolerance is not None and result.half_width <= tolerance:
+                break
+        return result
+
+    def simulate_games(self, num_simulations, seed=None):
+        # Opponent hands on the current board, without run-out
+        return self.simulate(num_simulations, run_out=False, seed=seed).probabilities
+
+    def simulate_games_by_eval(self, eval, num_simulations, board_size, batch_size=8192, seed=None):
+        # A fixed rank against random hands on random boards of board_size cards
+        rng = self.generator(seed)
+        deck = np.array(Deck.GetFullDeck(), dtype=np.int64)
+        wins = draws = losses = 0
+        while num_simulations > 0:
+            n = min(batch_size, num_simulations)
+            num_simulations -= n
+            simulated_evals = self.evaluator.evaluate_batch(sample_cards(rng, deck, n, 2 + board_size))
+            wins += int((eval < simulated_evals).sum())
+            draws += int((eval == simulated_evals).sum())
+            losses += int((eval > simulated_evals).sum())
+        return SimulationResult(wins, draws, losses).probabilities
+
+    def simulate_preflop_games(self, num_simulations, seed=None):
+        # All five board cards dealt at random, ignoring the current board
+        return self.simulate(num_simulations, board=[], seed=seed).probabilities
     
 class HandClustering:
 
+    """Bucket tables for every street.
+
+    The flop, turn and river tables are arrays indexed by deuces rank
+    (1..7462); the preflop table is a 52x52 matrix indexed by card_index of
+    both hole cards, derived from preflop_map (hand class -> cluster).
+    Entries that have no cluster hold -1 and read back as None.
+    """
     def __init__(self):
         self.preflop_map = {}
-        self.flop_map = {}
-        self.turn_map = {}
-        self.river_map = {}
+        self.preflop_matrix = np.full((52, 52), -1, dtype=np.int16)
+        self.flop_map = np.full(NUM_RANKS, -1, dtype=np.int16)
+        self.turn_map = np.full(NUM_RANKS, -1, dtype=np.int16)
+        self.river_map = np.full(NUM_RANKS, -1, dtype=np.int16)
+        self.cache_key = None  # set by clustering_cache.load_or_build
+
+    def set_preflop_map(self, preflop_map):
+        self.preflop_map = preflop_map
+        for i in range(52):
+            for j in range(52):
+                if i != j:
+                    self.preflop_matrix[i, j] = preflop_map.get(hand_class(i, j), -1)
+
+    @staticmethod
+    def _cluster(cluster):
+        return None if cluster < 0 else cluster
 
     def get_preflop_cluster(self, hand):
         [card1, card2] = hand
-        key = canonical_hand_key(card1, card2)
-        if key in self.preflop_map:
-            return self.preflop_map[key]
+        return self._cluster(self.preflop_matrix.item(card_index(card1), card_index(card2)))
         
     def get_flop_cluster(self, eval):
-        if eval in self.flop_map:
-            return self.flop_map[eval]
+        return self._cluster(self.flop_map.item(eval))
         
     def get_turn_cluster(self, eval):
-        if eval in self.turn_map:
-            return self.turn_map[eval]
+        return self._cluster(self.turn_map.item(eval))
         
     def get_river_cluster(self, eval):
-        if eval in self.river_map:
-            return self.river_map[eval]
+        return self._cluster(self.river_map.item(eval))
+
+    # Batch variants: arrays in, int16 arrays of clusters out (-1 for no cluster)
+    def get_preflop_clusters(self, hands):
+        # hands: (n, 2) array of deuces card ints
+        indices = card_indices(hands)
+        return self.preflop_matrix[indices[:, 0], indices[:, 1]]
+
+    def get_flop_clusters(self, evals):
+        return self.flop_map[np.asarray(evals)]
+
+    def get_turn_clusters(self, evals):
+        return self.turn_map[np.asarray(evals)]
+
+    def get_river_clusters(self, evals):
+        return self.river_map[np.asarray(evals)]
+
+    # Street buckets from the cards: round 1..3 (flop..river), hand and board in deuces ints and
+    # evaluation, the deuces rank of hand on board. The rank tables only read the evaluation;
+    # subclasses keyed by the cards (potential_clustering) override these
+    def get_street_cluster(self, round, hand, board, evaluation):
+        return (self.get_flop_cluster, self.get_turn_cluster, self.get_river_cluster)[round - 1](evaluation)
+
+    def get_street_clusters(self, round, hands, boards, evaluations):
+        # hands: (n, 2), boards: (n, round + 2) arrays
+        return (self.get_flop_clusters, self.get_turn_clusters, self.get_river_clusters)[round - 1](evaluations)
+
+    @staticmethod
+    def _assign_clusters(table, cluster_borders):
+        # Cluster of rank i is the number of borders <= i
+        table[1:] = np.searchsorted(cluster_borders, np.arange(1, NUM_RANKS), side='right')
     
-    def build_preflop_table(self, num_simulations, num_clusters):
+    def build_preflop_table(self, num_simulations, num_clusters, exact=True):
+        # Exact equities ignore num_simulations; both kinds are cached in equity_cache/
+        import equity  # imported here because equity builds on this module
         # full_deck1 = Deck().GetFullDeck()
         # full_deck2 = Deck().GetFullDeck()
         # pairs = [(card1, card2) for card1 in full_deck1 for card2 in full_deck2 if card1 != card2]
@@ -225,7 +360,7 @@ class HandClustering:
         # clusters = self.get_clusters(10, results)
         # for i, pair in enumerate(pairs):
         #     self.preflop_map[pair] = clusters[i]
-        equity_map = estimate_all_equities(num_simulations)
+        equity_map = equity.preflop_equities(exact, num_simulations)
         sorted_items = sorted(equity_map.items(), key=lambda x: x[1])
         cluster_size = len(sorted_items) // num_clusters
         clusters = {}
@@ -235,7 +370,7 @@ class HandClustering:
             end = (cluster_id + 1) * cluster_size if cluster_id < num_clusters - 1 else len(sorted_items)
             for i in range(start, end):
                 clusters[sorted_items[i][0]] = cluster_id
-        self.preflop_map = clusters
+        self.set_preflop_map(clusters)
         print(self.preflop_map)
 
         
@@ -263,13 +398,7 @@ class HandClustering:
             border_index = int(i * len(evals) / num_clusters)
             cluster_borders.append(evals[border_index])
         
-        for i in range(1, 7463):  
-            for cluster_id, border in enumerate(cluster_borders):
-                if i < border:
-                    self.flop_map[i] = cluster_id
-                    break
-            else:
-                self.flop_map[i] = num_clusters - 1
+        self._assign_clusters(self.flop_map, cluster_borders)
         
 
         
@@ -298,13 +427,7 @@ class HandClustering:
             border_index = int(i * len(evals) / num_clusters)
             cluster_borders.append(evals[border_index])
         
-        for i in range(1, 7463):  
-            for cluster_id, border in enumerate(cluster_borders):
-                if i < border:
-                    self.turn_map[i] = cluster_id
-                    break
-            else:
-                self.turn_map[i] = num_clusters - 1
+        self._assign_clusters(self.turn_map, cluster_borders)
 
     def build_river_table(self, num_simulations, num_clusters):
         # deck = Deck()
@@ -330,13 +453,7 @@ class HandClustering:
             border_index = int(i * len(evals) / num_clusters)
             cluster_borders.append(evals[border_index])
         print(cluster_borders)
-        for i in range(1, 7463):  
-            for cluster_id, border in enumerate(cluster_borders):
-                if i < border:
-                    self.river_map[i] = cluster_id
-                    break
-            else:
-                self.river_map[i] = num_clusters - 1
+        self._assign_clusters(self.river_map, cluster_borders)
     
     def save_tables(self, directory="clustering_tables"):
         Path(directory).mkdir(parents=True, exist_ok=True)
@@ -346,64 +463,76 @@ class HandClustering:
             df_preflop.to_parquet(os.path.join(directory, 'preflop_map.parquet'), index=False)
             print(f"Saved preflop map with {len(self.preflop_map)} entries")
 
-        if self.flop_map:
-            df_flop = pd.DataFrame(list(self.flop_map.items()), columns=['eval', 'cluster'])
+        if (self.flop_map >= 0).any():
+            evals = np.flatnonzero(self.flop_map >= 0)
+            df_flop = pd.DataFrame({'eval': evals, 'cluster': self.flop_map[evals].astype(np.int64)})
             df_flop.to_parquet(os.path.join(directory, 'flop_map.parquet'), index = False)
-            print(f"Saved flop map with {len(self.flop_map)} entries")
+            print(f"Saved flop map with {len(evals)} entries")
 
-        if self.turn_map:
-            df_turn = pd.DataFrame(list(self.turn_map.items()), columns=['eval', 'cluster'])
+        if (self.turn_map >= 0).any():
+            evals = np.flatnonzero(self.turn_map >= 0)
+            df_turn = pd.DataFrame({'eval': evals, 'cluster': self.turn_map[evals].astype(np.int64)})
             df_turn.to_parquet(os.path.join(directory, 'turn_map.parquet'), index = False)
-            print(f"Saved turn map with {len(self.turn_map)} entries")
+            print(f"Saved turn map with {len(evals)} entries")
 
-        if self.river_map:
-            df_river = pd.DataFrame(list(self.river_map.items()), columns=['eval', 'cluster'])
+        if (self.river_map >= 0).any():
+            evals = np.flatnonzero(self.river_map >= 0)
+            df_river = pd.DataFrame({'eval': evals, 'cluster': self.river_map[evals].astype(np.int64)})
             df_river.to_parquet(os.path.join(directory, 'river_map.parquet'), index = False)
-            print(f"Saved river map with {len(self.river_map)} entries")
-    def load_tables(self, directory="clustering_tables"):
+            print(f"Saved river map with {len(evals)} entries")
+    def load_tables(self, directory="clustering_tables", verbose=True):
 
         preflop_path = os.path.join(directory, 'preflop_map.parquet')
         if os.path.exists(preflop_path):
             df_preflop = pd.read_parquet(preflop_path)
-            self.preflop_map = dict(zip(df_preflop['hand_key'], df_preflop['cluster']))
-            print(f"Loaded preflop_map with {len(self.preflop_map)} entries")
-        else:
+            # Parquet returns the tuple keys as arrays, which are not hashable
+            self.set_preflop_map(dict(zip(map(tuple, df_preflop['hand_key']), df_preflop['cluster'])))
+            if verbose:
+                print(f"Loaded preflop_map with {len(self.preflop_map)} entries")
+        elif verbose:
             print(f"Warning: {preflop_path} not found")
 
         flop_path = os.path.join(directory, 'flop_map.parquet')
         if os.path.exists(flop_path):
             df_flop = pd.read_parquet(flop_path)
-            self.flop_map = dict(zip(df_flop['eval'], df_flop['cluster']))
-            print(f"Loaded flop map with {len(self.flop_map)} entries")
-        else:
+            self.flop_map = np.full(NUM_RANKS, -1, dtype=np.int16)
+            self.flop_map[df_flop['eval'].to_numpy()] = df_flop['cluster'].to_numpy()
+            if verbose:
+                print(f"Loaded flop map with {len(df_flop)} entries")
+        elif verbose:
             print(f"Warning: {flop_path} not found")
 
         turn_path = os.path.join(directory, 'turn_map.parquet')
         if os.path.exists(turn_path):
             df_turn = pd.read_parquet(turn_path)
-            self.turn_map = dict(zip(df_turn['eval'], df_turn['cluster']))
-            print(f"Loaded turn map with {len(self.turn_map)} entries")
-        else:
+            self.turn_map = np.full(NUM_RANKS, -1, dtype=np.int16)
+            self.turn_map[df_turn['eval'].to_numpy()] = df_turn['cluster'].to_numpy()
+            if verbose:
+                print(f"Loaded turn map with {len(df_turn)} entries")
+        elif verbose:
             print(f"Warning: {turn_path} not found")
 
         river_path = os.path.join(directory, 'river_map.parquet')
         if os.path.exists(river_path):
             df_river = pd.read_parquet(river_path)
-            self.river_map = dict(zip(df_river['eval'], df_river['cluster']))
-            print(f"Loaded river map with {len(self.river_map)} entries")
-        else:
+            self.river_map = np.full(NUM_RANKS, -1, dtype=np.int16)
+            self.river_map[df_river['eval'].to_numpy()] = df_river['cluster'].to_numpy()
+            if verbose:
+                print(f"Loaded river map with {len(df_river)} entries")
+        elif verbose:
             print(f"Warning: {river_path} not found")
 
 
-hc = HandClustering()
-print("Building lookup tables...")
-hc.build_preflop_table(20000, 5)
-print("Building preflop table finished.")
-hc.build_flop_table(20000, 5)
-print("Building flop table finished.")
-hc.build_turn_table(20000, 5)
-print("Building turn table finished.")
-hc.build_river_table(20000, 5)
-print("Building river table finished.")
+if __name__ == "__main__":
+    hc = HandClustering()
+    print("Building lookup tables...")
+    hc.build_preflop_table(20000, 5)
+    print("Building preflop table finished.")
+    hc.build_flop_table(20000, 5)
+    print("Building flop table finished.")
+    hc.build_turn_table(20000, 5)
+    print("Building turn table finished.")
+    hc.build_river_table(20000, 5)
+    print("Building river table finished.")
 
-hc.save_tables()
\ No newline at end of file
+    hc.save_tables()
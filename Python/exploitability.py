@@ -0,0 +1,236 @@
+import argparse
+import multiprocessing
+import os
+import numpy as np
+import pandas as pd
+import checkpoint
+import clustering_cache
+import deuces
+import evaluator
+import hand_engine
+import holdem
+import public_tree
+import tournament
+
+FULL_DECK = np.array(deuces.Deck.GetFullDeck(), dtype=np.int64)
+NUM_ROUNDS = 4
+
+def _sample_chunk(args):
+    # Clusters per round of both players (-1 for None) and the showdown result for player 0
+    clustering, num_deals, seed = args
+    rng = np.random.default_rng(seed)
+    fast_evaluator = hand_engine.FastEvaluator()
+    dealt = evaluator.sample_cards(rng, FULL_DECK, num_deals, 9)
+    clusters = np.empty((2, num_deals, NUM_ROUNDS), dtype=np.int64)
+    river = []
+    for player in range(2):
+        hand = dealt[:, 2 * player:2 * player + 2]
+        clusters[player, :, 0] = clustering.get_preflop_clusters(hand)
+        for round in (1, 2, 3):
+            board = dealt[:, 4:6 + round]
+            ranks = fast_evaluator.evaluate_batch(np.hstack([hand, board]))
+            clusters[player, :, round] = clustering.get_street_clusters(round, hand, board, ranks)
+        river.append(ranks.astype(np.int64))
+    return clusters, np.sign(river[1] - river[0])
+
+class BucketModel:
+    """Chance model of the bucketed game that HoldemCFR plays.
+
+    A player only sees its sequence of buckets, so the game reduces to a
+    deal of a bucket sequence to each player: `joint[s, t]` is the
+    probability that a player holds s and the other t, `wins[s, t]` the
+    part of it where the holder of s wins at showdown and `ties[s, t]` the
+    part where they tie. All three are estimated from sampled deals and
+    symmetrized over the seats; enumerating every deal is out of reach, so
+    `groups` holds models of disjoint parts of the deals, from which
+    BestResponse gives the standard error of its result.
+    Sequences are numbered in mixed radix over `sizes`, the number of
+    buckets per round, the last one of which stands for None when a table
+    has gaps.
+    """
+    def __init__(self, sizes, joint, wins, ties, has_none, groups=()):
+        self.sizes = sizes
+        self.joint = joint
+        self.wins = wins
+        self.ties = ties
+        self.has_none = has_none
+        self.groups = list(groups)
+        self.num_sequences = int(np.prod(sizes))
+        # prefixes[r][s]: index of the first r + 1 buckets of sequence s
+        self.prefixes = [np.arange(self.num_sequences) // int(np.prod(sizes[r + 1:])) for r in range(NUM_ROUNDS)]
+
+    @classmethod
+    def estimate(cls, clustering, num_deals=2000000, workers=1, seed=0, chunk_size=250000, groups=10):
+        chunks = [(clustering, min(chunk_size, num_deals - start), np.random.SeedSequence([seed, i]))
+                  for i, start in enumerate(range(0, num_deals, chunk_size))]
+        if workers > 1:
+            with multiprocessing.Pool(workers) as pool:
+                results = pool.map(_sample_chunk, chunks)
+        else:
+            results = [_sample_chunk(chunk) for chunk in chunks]
+        clusters = np.concatenate([r[0] for r in results], axis=1)
+        outcomes = np.concatenate([r[1] for r in results])
+        has_none = [(clusters[..., r] < 0).any() for r in range(NUM_ROUNDS)]
+        sizes = [int(clusters[..., r].max()) + 1 + int(has_none[r]) for r in range(NUM_ROUNDS)]
+        sequences = np.zeros((2, len(outcomes)), dtype=np.int64)
+        for r in range(NUM_ROUNDS):
+            buckets = np.where(clusters[..., r] < 0, sizes[r] - 1, clusters[..., r])
+            sequences = sequences * sizes[r] + buckets
+        parts = np.array_split(np.arange(len(outcomes)), groups) if groups > 1 else []
+        return cls.from_deals(sizes, sequences, outcomes, has_none,
+                              [cls.from_deals(sizes, sequences[:, part], outcomes[part], has_none) for part in parts])
+
+    @classmethod
+    def from_deals(cls, sizes, sequences, outcomes, has_none, groups=()):
+        # sequences: (2, n) bucket sequence of each seat, outcomes: showdown result for seat 0
+        n = int(np.prod(sizes))
+        pairs = sequences[0] * n + sequences[1]
+
+        def matrix(weights=None):
+            return np.bincount(pairs, weights=weights, minlength=n * n).reshape(n, n) / len(outcomes)
+        joint, ties = matrix(), matrix(outcomes == 0)
+        wins = (matrix(outcomes > 0) + matrix(outcomes < 0).T) / 2
+        return cls(sizes, (joint + joint.T) / 2, wins, (ties + ties.T) / 2, has_none, groups)
+
+    def prefix_clusters(self, round):
+        # (num_prefixes, round + 1) cluster values of every bucket prefix, -1 for None
+        count = int(np.prod(self.sizes[:round + 1]))
+        clusters = np.empty((count, round + 1), dtype=np.int64)
+        rest = np.arange(count)
+        for r in range(round, -1, -1):
+            buckets = rest % self.sizes[r]
+            rest //= self.sizes[r]
+            clusters[:, r] = np.where(self.has_none[r] & (buckets == self.sizes[r] - 1), -1, buckets)
+        return clusters
+
+class BestResponse:
+    """Best response to a bucket-level strategy in the bucketed game.
+
+    The public betting tree of HoldemCFR is walked once per best responder
+    with the opponent's reach probability of every bucket sequence as one
+    vector; terminal values are products of the model matrices with that
+    vector, and the responder picks the best action per bucket prefix, i.e.
+    per information set. Payoffs are those HoldemCFR trains on: nothing is
+    expanded after two bets in a round, so such nodes are worth 0, and ties
+    at showdown go to the player whose value is computed. The game is thus
+    not zero-sum, and exploitability subtracts the values of the profile
+    itself from the best responses (NashConv).
+    """
+    def __init__(self, model, num_actions=3, codec=holdem.KEY_CODEC):
+        self.model = model
+        self.codec = codec
+        self.tree = holdem.get_public_tree(holdem.HoldemCFR(num_actions, evaluator.HandClustering()))
+        self.prefix_clusters = [model.prefix_clusters(r) for r in range(NUM_ROUNDS)]
+
+    def strategies(self, policy, node, model):
+        # Normalized (num_sequences, num_actions) strategy at a decision node, for the acting player
+        history = self.tree.histories[node]
+        round = history.round
+        keys = self.codec.encode_batch(history.history, self.prefix_clusters[round], round, history.pot)
+        strategy = np.maximum(policy.get_batch(keys), 0.0)
+        totals = strategy.sum(axis=1, keepdims=True)
+        strategy = np.divide(strategy, totals, out=np.full_like(strategy, 1.0 / strategy.shape[1]),
+                             where=totals > 0)
+        return strategy[model.prefixes[round]]
+
+    def values(self, policy, player, own_policy=None, model=None, node=0, reach=None):
+        """Counterfactual values of `player` against `policy`, per bucket
+        sequence of `player`; their sum is the value of the game. `player`
+        best responds, or plays own_policy when it is given."""
+        model = self.model if model is None else model
+        tree = self.tree
+        if reach is None:
+            reach = np.ones(model.num_sequences)
+        node_type = tree.node_types_list[node]
+        if node_type == public_tree.TERMINAL:
+            pot = tree.pots_list[node]
+            joint = model.joint @ reach
+            folded = tree.folded_list[node]
+            if folded:
+                return (-pot[player] if folded >> player & 1 else pot[1 - player]) * joint
+            won = (model.wins + model.ties) @ reach
+            return pot[1 - player] * won - pot[player] * (joint - won)
+        if node_type == public_tree.CHANCE:
+            return self.values(policy, player, own_policy, model, tree.next_nodes_list[node], reach)
+        edges = tree.edges_list[node]
+        if not edges:
+            return np.zeros(model.num_sequences)
+        if tree.players_list[node] != player:
+            strategy = self.strategies(policy, node, model)
+            return sum(self.values(policy, player, own_policy, model, child, reach * strategy[:, a])
+                       for a, child in edges)
+        action_values = np.array([self.values(policy, player, own_policy, model, child, reach)
+                                  for a, child in edges])
+        if own_policy is not None:
+            strategy = self.strategies(own_policy, node, model)[:, [a for a, _ in edges]]
+            return (strategy.T * action_values).sum(axis=0)
+        prefixes = model.prefixes[tree.rounds_list[node]]
+        totals = np.array([np.bincount(prefixes, weights=v) for v in action_values])
+        best = totals.argmax(axis=0)
+        return action_values[best[prefixes], np.arange(len(prefixes))]
+
+    def gains(self, policies, model):
+        # Best response value minus the profile's own value, per seat
+        return [self.values(policies[1 - p], p, model=model).sum()
+                - self.values(policies[1 - p], p, policies[p], model).sum() for p in range(2)]
+
+    def exploitability(self, policies):
+        """Exploitability in mbb/hand (1 pot unit = 1 big blind) of the
+        strategy profile policies = (seat 0 policy, seat 1 policy), i.e.
+        the mean gain of a best response over both seats, with the standard
+        error of the sampled chance model when it has groups. The best
+        response also exploits the sampling noise of the model, which
+        biases the estimate upwards."""
+        gain0, gain1 = self.gains(policies, self.model)
+        result = {"br_seat0": 1000 * gain0, "br_seat1": 1000 * gain1, "exploitability": 1000 * (gain0 + gain1) / 2}
+        if len(self.model.groups) > 1:
+            estimates = [1000 * sum(self.gains(policies, group)) / 2 for group in self.model.groups]
+            result["stderr"] = float(np.std(estimates, ddof=1) / np.sqrt(len(estimates)))
+        return result
+
+def checkpoint_policies(spec, clustering_key=None):
+    """(name, policy) of a node map or strategy file, or of every
+    checkpoint of a checkpoint directory, delta chains included."""
+    if not os.path.isdir(spec):
+        return [(spec, tournament.load_policy(spec, clustering_key=clustering_key))]
+    policies = []
+    for iteration, filename in checkpoint.list_checkpoints(spec):
+        store = checkpoint.load_checkpoint(spec, 3, holdem.KEY_CODEC, holdem.HoldemNode.from_row, iteration,
+                                           clustering_key=clustering_key)
+        policies.append((filename, tournament.load_policy(store)))
+    return policies
+
+def checkpoint_exploitability(specs, num_clusters=5, num_deals=2000000, workers=1, seed=0, output=None):
+    """Exploitability of each node map checkpoint (the same map plays both
+    seats), all against one estimated BucketModel. specs are node map or
+    strategy files, or checkpoint directories (checkpoint.Checkpointer), in
+    training order."""
+    clustering = clustering_cache.load_or_build(num_clusters)
+    model = BucketModel.estimate(clustering, num_deals, workers, seed)
+    best_response = BestResponse(model)
+    rows = []
+    for spec in specs:
+        for name, policy in checkpoint_policies(spec, clustering.cache_key):
+            row = {"node_map": name, **best_response.exploitability((policy, policy))}
+            print(f"{name}: {row['exploitability']:.1f} +- {row['stderr']:.1f} mbb/hand")
+            rows.append(row)
+    df = pd.DataFrame(rows)
+    if output is not None:
+        df.to_csv(output, index=False)
+    return df
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exploitability of Hold'em node maps in the bucketed game.")
+    parser.add_argument("node_maps", nargs="+", help="Node maps or checkpoint directories, in training order")
+    parser.add_argument("--clusters", type=int, default=5)
+    parser.add_argument("--deals", type=int, default=2000000, help="Sampled deals for the chance model")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="CSV file for the results")
+    parser.add_argument("--allow-unkeyed", action="store_true",
+                        help="Load node maps that record no clustering tables (trained before the preflop bucket fix)")
+    args = parser.parse_args()
+    if args.allow_unkeyed:
+        # Read by node_io.allow_unkeyed_maps, here and in the worker processes
+        os.environ["POKER_ALLOW_UNKEYED_MAPS"] = "1"
+    print(checkpoint_exploitability(args.node_maps, args.clusters, args.deals, args.workers, args.seed, args.output))
@@ -0,0 +1,162 @@
+from deuces import Card, Deck, Evaluator
+from deuces.lookup import LookupTable
+from itertools import combinations, combinations_with_replacement
+import numpy as np
+
+SUIT_BITS = (0x1000, 0x2000, 0x4000, 0x8000)
+FIVE_CARD_SUBSETS = {k: np.array(list(combinations(range(k), 5))) for k in (5, 6, 7)}
+
+class FastEvaluator(Evaluator):
+    """Drop-in replacement for deuces.Evaluator with 5-7 card lookup tables.
+
+    Instead of evaluating every 5-card subset like deuces does, the best rank
+    of each rank multiset (keyed by its prime product) and of each flush rank
+    mask is precomputed once per process, so a 7-card evaluation is a product,
+    a dict probe and a suit count. `evaluate_batch` does the same with NumPy
+    over arrays of hands.
+    """
+    _tables = None
+
+    def __init__(self):
+        if FastEvaluator._tables is None:
+            FastEvaluator._tables = FastEvaluator._build_tables()
+        (self.unsuited_lookup, self.sorted_products,
+         self.sorted_ranks, self.flush_table) = FastEvaluator._tables
+
+    @staticmethod
+    def _build_tables():
+        table = LookupTable()
+        five_products = np.array(sorted(table.unsuited_lookup), dtype=np.int64)
+        five_ranks = np.array([table.unsuited_lookup[p] for p in five_products], dtype=np.int16)
+        primes = np.array(Card.PRIMES, dtype=np.int64)
+
+        # Best non-flush rank for every multiset of 5, 6 and 7 ranks
+        products = [five_products]
+        ranks = [five_ranks]
+        for size in (6, 7):
+            multisets = np.array([m for m in combinations_with_replacement(range(13), size)
+                                  if max(m.count(r) for r in set(m)) <= 4])
+            subset_primes = primes[multisets[:, FIVE_CARD_SUBSETS[size]]]
+            subset_ranks = five_ranks[np.searchsorted(five_products, subset_primes.prod(axis=2))]
+            products.append(primes[multisets].prod(axis=1))
+            ranks.append(subset_ranks.min(axis=1))
+        products = np.concatenate(products)
+        ranks = np.concatenate(ranks)
+        order = np.argsort(products)
+        sorted_products = products[order]
+        sorted_ranks = ranks[order]
+        unsuited_lookup = dict(zip(sorted_products.tolist(), sorted_ranks.tolist()))
+
+        # Best flush rank for every 13-bit rank mask with at least 5 bits set
+        flush_table = np.full(1 << 13, LookupTable.MAX_HIGH_CARD + 1, dtype=np.int16)
+        for mask in range(1 << 13):
+            bits = [1 << r for r in range(13) if mask & (1 << r)]
+            if len(bits) < 5:
+                continue
+            flush_table[mask] = min(table.flush_lookup[Card.prime_product_from_rankbits(sum(subset))]
+                                    for subset in combinations(bits, 5))
+        return unsuited_lookup, sorted_products, sorted_ranks, flush_table
+
+    def evaluate(self, cards, board):
+        all_cards = cards + board
+        product = 1
+        for c in all_cards:
+            product *= c & 0xFF
+        rank = self.unsuited_lookup[product]
+        # With 7 or fewer cards at most one suit can hold five of them
+        for suit in SUIT_BITS:
+            suited = [c for c in all_cards if c & suit]
+            if len(suited) >= 5:
+                mask = 0
+                for c in suited:
+                    mask |= c >> 16
+                return min(rank, int(self.flush_table[mask]))
+        return rank
+
+    def evaluate_batch(self, hands):
+        # hands: integer array of shape (n, 5..7) with deuces card ints
+        hands = np.asarray(hands, dtype=np.int64)
+        products = (hands & 0xFF).prod(axis=1)
+        ranks = self.sorted_ranks[np.searchsorted(self.sorted_products, products)]
+        rank_bits = (hands >> 16) & 0x1FFF
+        for suit in SUIT_BITS:
+            in_suit = (hands & suit) != 0
+            flush = in_suit.sum(axis=1) >= 5
+            if flush.any():
+                mask = np.bitwise_or.reduce(np.where(in_suit[flush], rank_bits[flush], 0), axis=1)
+                ranks[flush] = np.minimum(ranks[flush], self.flush_table[mask])
+        return ranks
+
+
+class DealEvaluation:
+    """Per-street evaluations and clusters of one dealt hand, computed once.
+
+    A CFR traversal visits the same (player, round) pair at many nodes; this
+    object is built at the root of the tree walk and shared by every node.
+    """
+    def __init__(self, cards, flop, turn, river, clustering, evaluator=None):
+        if evaluator is None:
+            evaluator = FastEvaluator()
+        self.cards = cards
+        self.boards = [[], list(flop), list(flop) + [turn], list(flop) + [turn, river]]
+        self.evaluations = []
+        self.clusters = []
+        for hand in cards:
+            evaluations = [None] + [evaluator.evaluate(hand, board) for board in self.boards[1:]]
+            self.evaluations.append(evaluations)
+            self.clusters.append([clustering.get_preflop_cluster(hand)] + [
+                clustering.get_street_cluster(round, hand, self.boards[round], evaluations[round])
+                for round in (1, 2, 3)])
+
+    def get_board(self, round):
+        return self.boards[round]
+
+    def get_clusters(self, player, round):
+        return self.clusters[player][:round + 1]
+
+    def get_showdown_score(self, player):
+        return self.evaluations[player][3]
+
+class BoardEvaluation:
+    """Clusters and showdowns of every pair of private hands on one board.
+
+    Vector CFR walks the betting tree once per sampled board for all hands
+    at once. Hands with the same cluster in every round are indistinguishable
+    to their holder, so they are merged into `sequences` (k, 4) of clusters
+    (-1 for None), each with probability `hand_probs[s]`. For a pair of
+    sequences, `joint[s, t]` is the probability that one player holds s and
+    the other t, and `wins[s, t]` the part of it where the holder of s wins
+    or ties at showdown (CFR credits ties to the traversing player).
+    """
+    def __init__(self, flop, turn, river, clustering, evaluator=None):
+        if evaluator is None:
+            evaluator = FastEvaluator()
+        board = list(flop) + [turn, river]
+        self.board = board
+        deck = np.array([card for card in Deck.GetFullDeck() if card not in board], dtype=np.int64)
+        pairs = np.array(list(combinations(range(len(deck)), 2)))
+        self.hands = deck[pairs]
+        clusters = np.empty((len(self.hands), 4), dtype=np.int64)
+        clusters[:, 0] = clustering.get_preflop_clusters(self.hands)
+        for round in (1, 2, 3):
+            boards = np.tile(np.array(board[:round + 2], dtype=np.int64), (len(self.hands), 1))
+            scores = evaluator.evaluate_batch(np.hstack([self.hands, boards]))
+            clusters[:, round] = clustering.get_street_clusters(round, self.hands, boards, scores)
+        # Showdown scores on the river, lower is better
+        self.scores = scores
+        self.sequences, self.sequence_of_hand = np.unique(clusters, axis=0, return_inverse=True)
+        self.sequence_of_hand = self.sequence_of_hand.ravel()
+        num_sequences = len(self.sequences)
+        self.hand_probs = np.bincount(self.sequence_of_hand, minlength=num_sequences) / len(self.hands)
+        # Hand pairs sharing a card cannot be dealt together
+        masks = (np.int64(1) << pairs[:, 0]) | (np.int64(1) << pairs[:, 1])
+        compatible = (masks[:, None] & masks[None, :]) == 0
+        wins = compatible & (scores[:, None] <= scores[None, :])
+        one_hot = np.zeros((len(self.hands), num_sequences))
+        one_hot[np.arange(len(self.hands)), self.sequence_of_hand] = 1.0
+        num_pairs = compatible.sum()
+        self.joint = one_hot.T @ compatible @ one_hot / num_pairs
+        self.wins = one_hot.T @ wins @ one_hot / num_pairs
+
+    def __len__(self):
+        return len(self.sequences)
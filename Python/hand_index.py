@@ -0,0 +1,270 @@
+from itertools import combinations_with_replacement, product
+from math import comb
+import numpy as np
+
+NUM_SUITS = 4
+NUM_RANKS = 13
+HOLDEM_ROUNDS = (2, 3, 1, 1)
+SUIT_INDEX = {1: 0, 2: 1, 4: 2, 8: 3}
+SUIT_INDEX_ARRAY = np.array([-1, 0, 1, -1, 2, -1, -1, -1, 3])
+POPCOUNT = np.array([bin(mask).count("1") for mask in range(1 << NUM_RANKS)], dtype=np.int64)
+# Colex rank of a rank set: sum of C(rank, k) over its ranks in increasing order, k = 1, 2, ...
+COLEX = np.array([sum(comb(r, k + 1) for k, r in enumerate(r for r in range(NUM_RANKS) if mask >> r & 1))
+                  for mask in range(1 << NUM_RANKS)], dtype=np.int64)
+# RADIX[u, c]: ways to choose c ranks of a suit when u of its ranks are already dealt
+RADIX = np.array([[comb(NUM_RANKS - u, c) for c in range(NUM_RANKS + 1)] for u in range(NUM_RANKS + 1)],
+                 dtype=np.int64)
+# Plain-list copies for the scalar path, where NumPy indexing costs more than the arithmetic
+POPCOUNT_LIST = POPCOUNT.tolist()
+RADIX_LIST = RADIX.tolist()
+COMB_LIST = [[comb(n, k) for k in range(NUM_RANKS + 1)] for n in range(NUM_RANKS + 1)]
+
+def compress(mask, used):
+    # Drop the bits of `used` from `mask`, shifting the higher bits down
+    result = 0
+    position = 0
+    for r in range(NUM_RANKS):
+        if not used >> r & 1:
+            result |= (mask >> r & 1) << position
+            position += 1
+    return result
+
+def expand(mask, used):
+    # Inverse of compress: place the bits of `mask` on the ranks not in `used`
+    result = 0
+    position = 0
+    for r in range(NUM_RANKS):
+        if not used >> r & 1:
+            result |= (mask >> position & 1) << r
+            position += 1
+    return result
+
+def unrank_colex(rank, size):
+    # Rank set of `size` ranks with the given colex rank
+    mask = 0
+    for k in range(size, 0, -1):
+        r = k - 1
+        while comb(r + 1, k) <= rank:
+            r += 1
+        mask |= 1 << r
+        rank -= comb(r, k)
+    return mask
+
+class HandIndexer:
+    """Dense index of suit-isomorphic hands, in the style of Waugh's hand
+    isomorphism indexer.
+
+    Cards are dealt in rounds (2 hole cards, then 3, 1 and 1 board cards for
+    Hold'em). A hand after `round` rounds is indexed in [0, size(round));
+    two hands share an index exactly when a permutation of suits maps one to
+    the other. With turn and river as separate rounds there are 169 preflop,
+    1,286,792 flop, 55,190,538 turn and 2,428,287,420 river indices; with
+    rounds (2, 5) the river has 123,156,254. HandIndexer((2, 3)) and
+    HandIndexer((2, 4)) key the flop and turn tables of
+    potential_clustering.PotentialClustering.
+
+    Each suit is described by its shape (cards of the suit per round) and
+    the mixed-radix colex rank of its rank sets. A hand is the multiset of
+    its four (shape, rank) pairs: the shapes select a configuration and
+    the ranks of suits sharing a shape are numbered as a multiset.
+    """
+    def __init__(self, cards_per_round=HOLDEM_ROUNDS):
+        self.cards_per_round = tuple(cards_per_round)
+        self.rounds = []
+        for round in range(len(self.cards_per_round)):
+            self.rounds.append(self._build_round(self.cards_per_round[:round + 1]))
+
+    @staticmethod
+    def _build_round(counts):
+        shapes = sorted(product(*(range(c + 1) for c in counts)), reverse=True)
+        shape_sizes = []
+        for shape in shapes:
+            size, used = 1, 0
+            for c in shape:
+                size *= comb(NUM_RANKS - used, c)
+                used += c
+            shape_sizes.append(size)
+        configurations = []
+        for suits in combinations_with_replacement(range(len(shapes)), NUM_SUITS):
+            if all(sum(shapes[s][i] for s in suits) == counts[i] for i in range(len(counts))):
+                configurations.append(suits)
+        # Per configuration: offset, and per sorted suit position its position
+        # within its group of equal shapes (1-based) and the group's multiplier
+        offsets, positions, multipliers = [], [], []
+        total = 0
+        for suits in configurations:
+            offsets.append(total)
+            position, multiplier, size = [], [], 1
+            start = 0
+            while start < NUM_SUITS:
+                end = start
+                while end < NUM_SUITS and suits[end] == suits[start]:
+                    end += 1
+                group = end - start
+                position += list(range(1, group + 1))
+                multiplier += [size] * group
+                size *= comb(shape_sizes[suits[start]] + group - 1, group)
+                start = end
+            positions.append(position)
+            multipliers.append(multiplier)
+            total += size
+        shape_codes = {shape: i for i, shape in enumerate(shapes)}
+        shape_table = np.zeros(tuple(c + 1 for c in counts), dtype=np.int64)
+        for shape, code in shape_codes.items():
+            shape_table[shape] = code
+        configuration_codes = np.full(len(shapes) ** NUM_SUITS, -1, dtype=np.int64)
+        for i, suits in enumerate(configurations):
+            configuration_codes[np.ravel_multi_index(suits, (len(shapes),) * NUM_SUITS)] = i
+        lookup = {suits: (offsets[i], positions[i], multipliers[i]) for i, suits in enumerate(configurations)}
+        return {
+            "counts": counts,
+            "lookup": lookup,
+            "shapes": shapes,
+            "shape_codes": shape_codes,
+            "shape_table": shape_table,
+            "shape_sizes": shape_sizes,
+            "configurations": configurations,
+            "configuration_codes": configuration_codes,
+            "offsets": np.array(offsets + [total], dtype=np.int64),
+            "positions": np.array(positions, dtype=np.int64),
+            "multipliers": np.array(multipliers, dtype=np.int64),
+            "size": total,
+        }
+
+    def size(self, round):
+        return self.rounds[round]["size"]
+
+    def _round_of(self, num_cards):
+        total = 0
+        for round, count in enumerate(self.cards_per_round):
+            total += count
+            if total == num_cards:
+                return round
+        raise ValueError(f"{num_cards} cards do not end a round of {self.cards_per_round}")
+
+    def index(self, cards):
+        """Index of a hand given as deuces card ints in dealing order (hole
+        cards, then the board); the round follows from the number of cards."""
+        round = self._round_of(len(cards))
+        table = self.rounds[round]
+        # Rank set of every suit in every round
+        sets = [[0] * (round + 1) for _ in range(NUM_SUITS)]
+        position = 0
+        for r, count in enumerate(self.cards_per_round[:round + 1]):
+            for card in cards[position:position + count]:
+                sets[SUIT_INDEX[(card >> 12) & 0xF]][r] |= 1 << ((card >> 8) & 0xF)
+            position += count
+        suits = []
+        for suit_sets in sets:
+            shape = []
+            index, used = 0, 0
+            for mask in suit_sets:
+                # Colex rank of the rank set after removing the ranks dealt earlier
+                rank, k, remaining = 0, 0, mask
+                while remaining:
+                    low = remaining & -remaining
+                    k += 1
+                    rank += COMB_LIST[low.bit_length() - 1 - POPCOUNT_LIST[used & (low - 1)]][k]
+                    remaining ^= low
+                index = index * RADIX_LIST[POPCOUNT_LIST[used]][k] + rank
+                used |= mask
+                shape.append(k)
+            suits.append((table["shape_codes"][tuple(shape)], index))
+        suits.sort()
+        offset, positions, multipliers = table["lookup"][tuple(s for s, _ in suits)]
+        index = offset
+        for (_, suit_index), j, multiplier in zip(suits, positions, multipliers):
+            # Multiset rank: the j-th smallest element shifted by j - 1, colex
+            index += comb(suit_index + j - 1, j) * multiplier
+        return index
+
+    def index_batch(self, cards):
+        """Vectorized index: `cards` is an (n, k) array of deuces card ints in
+        dealing order, all hands after the same round."""
+        cards = np.asarray(cards, dtype=np.int64)
+        round = self._round_of(cards.shape[1])
+        table = self.rounds[round]
+        n = len(cards)
+        ranks = (cards >> 8) & 0xF
+        suits = SUIT_INDEX_ARRAY[(cards >> 12) & 0xF]
+        round_of_card = np.repeat(np.arange(round + 1), self.cards_per_round[:round + 1])
+        sets = np.zeros((n, NUM_SUITS, round + 1), dtype=np.int64)
+        for k in range(cards.shape[1]):
+            np.bitwise_or.at(sets, (np.arange(n), suits[:, k], round_of_card[k]), 1 << ranks[:, k])
+        shape_counts = POPCOUNT[sets]
+        shape_codes = table["shape_table"][tuple(shape_counts[..., r] for r in range(round + 1))]
+        suit_index = np.zeros((n, NUM_SUITS), dtype=np.int64)
+        used = np.zeros((n, NUM_SUITS), dtype=np.int64)
+        for r in range(round + 1):
+            mask = sets[..., r]
+            compressed = np.zeros_like(mask)
+            position = np.zeros_like(mask)
+            for bit in range(NUM_RANKS):
+                free = (used >> bit & 1) == 0
+                compressed |= np.where(free, (mask >> bit & 1) << position, 0)
+                position += free
+            suit_index = suit_index * RADIX[POPCOUNT[used], shape_counts[..., r]] + COLEX[compressed]
+            used |= mask
+        # Sort the suits of every hand by (shape, index) in one go
+        keys = shape_codes * (1 << 40) + suit_index
+        keys.sort(axis=1)
+        shape_codes = keys >> 40
+        suit_index = keys & ((1 << 40) - 1)
+        configuration = table["configuration_codes"][np.ravel_multi_index(
+            tuple(shape_codes.T), (len(table["shapes"]),) * NUM_SUITS)]
+        positions = table["positions"][configuration]
+        multipliers = table["multipliers"][configuration]
+        index = table["offsets"][configuration].copy()
+        for k in range(NUM_SUITS):
+            j = positions[:, k]
+            index += multiset_term(suit_index[:, k] + j - 1, j) * multipliers[:, k]
+        return index
+
+    def unindex(self, round, index):
+        """A canonical hand (card index list, 4 * rank + suit, in dealing
+        order) with the given index after `round`."""
+        table = self.rounds[round]
+        configuration = int(np.searchsorted(table["offsets"], index, side="right")) - 1
+        remainder = index - int(table["offsets"][configuration])
+        suits = table["configurations"][configuration]
+        suit_indices = [0] * NUM_SUITS
+        start = 0
+        while start < NUM_SUITS:
+            end = start
+            while end < NUM_SUITS and suits[end] == suits[start]:
+                end += 1
+            group = end - start
+            group_size = comb(table["shape_sizes"][suits[start]] + group - 1, group)
+            rank = remainder % group_size
+            remainder //= group_size
+            for j in range(group, 0, -1):
+                b = j - 1
+                while comb(b + 1, j) <= rank:
+                    b += 1
+                rank -= comb(b, j)
+                suit_indices[start + j - 1] = b - (j - 1)
+            start = end
+        cards = [[] for _ in range(round + 1)]
+        for suit, (shape_code, suit_index) in enumerate(zip(suits, suit_indices)):
+            shape = table["shapes"][shape_code]
+            radices, used = [], 0
+            for c in shape:
+                radices.append(comb(NUM_RANKS - used, c))
+                used += c
+            digits = []
+            for radix in reversed(radices):
+                digits.append(suit_index % radix)
+                suit_index //= radix
+            used = 0
+            for r, (c, digit) in enumerate(zip(shape, reversed(digits))):
+                mask = expand(unrank_colex(digit, c), used)
+                used |= mask
+                cards[r] += [4 * rank + suit for rank in range(NUM_RANKS) if mask >> rank & 1]
+        return [card for round_cards in cards for card in round_cards]
+
+def multiset_term(n, k):
+    # Vectorized C(n, k) for small k, 0 when n < k
+    result = np.ones_like(n)
+    for i in range(NUM_SUITS):
+        result = np.where(k > i, result * np.maximum(n - i, 0) // (i + 1), result)
+    return np.where(n >= k, result, 0)
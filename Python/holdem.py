@@ -1,10 +1,31 @@
+import argparse
+import checkpoint
+import clustering_cache
 import base
 import deuces
 import evaluator
+import hand_engine
+import key_codec
+import metrics
+import node_io
+import numba_cfr
+import os
 from typing import List
-import pandas as pd
-import pickle
+import numpy as np
+import parallel
+import public_tree
+import time
+import warnings
 
+KEY_CODEC = key_codec.KeyCodec(num_players=2)
+PUBLIC_TREES = {}
+
+def get_public_tree(cfr):
+    # The betting tree only depends on the actions, so it is built once per process
+    tree_key = (cfr.num_actions, tuple(cfr.action_map.items()))
+    if tree_key not in PUBLIC_TREES:
+        PUBLIC_TREES[tree_key] = public_tree.PublicTree(cfr, HoldemInfoSet(), cfr.num_actions, 2)
+    return PUBLIC_TREES[tree_key]
     
 
 class HoldemInfoSet(base.InfoSet):
@@ -32,9 +53,12 @@ class HoldemInfoSet(base.InfoSet):
     def add_to_pot(self, player, value):
         self.pot[player] += value
     def key(self):
-        return (tuple(self.history), tuple(self.clusters), self.round, tuple(self.pot))
+        return KEY_CODEC.encode(self.history, self.clusters, self.round, self.pot)
     @classmethod
     def from_key(cls, key):
+        # Accepts packed integer keys as well as the tuple keys of older node maps
+        if not isinstance(key, tuple):
+            key = KEY_CODEC.decode(key)
         obj = cls()
         obj.history = list(key[0])
         obj.clusters = list(key[1])
@@ -44,156 +68,400 @@ class HoldemInfoSet(base.InfoSet):
     
     
 class HoldemNode(base.Node):
-    def __init__(self, info_set, num_actions):
-        super().__init__(info_set, num_actions)
-    def is_terminal(self, history: HoldemInfoSet):
+    def __init__(self, info_set, num_actions, store=None, node_id=None):
+        super().__init__(info_set, num_actions, store, node_id)
+    @classmethod
+    def from_row(cls, store, key, node_id):
+        return cls(HoldemInfoSet.from_key(key), store.num_actions, store, node_id)
+    @staticmethod
+    def is_terminal(history: HoldemInfoSet):
         round_history=history.get_history()
         round = history.get_round()
-        return round_history.endswith("f") or (round == 3 and self.round_ended(round_history))          
+        return round_history.endswith("f") or (round == 3 and HoldemNode.round_ended(round_history))
 
-    def is_chance_node(self, history: HoldemInfoSet):
+    @staticmethod
+    def is_chance_node(history: HoldemInfoSet):
         round_history=history.get_history()
         round = history.get_round()
-        return round != 3 and self.round_ended(round_history)
+        return round != 3 and HoldemNode.round_ended(round_history)
 
 
-    def get_terminal_utility(self, history: HoldemInfoSet, cards: List[List[deuces.Card]], board: List[deuces.Card], fixed_player):
+    def get_terminal_utility(self, history: HoldemInfoSet, cards: List[List[deuces.Card]], board: List[deuces.Card], fixed_player, deal: hand_engine.DealEvaluation = None):
         winner = fixed_player
         if history.get_history().endswith("f"):
             if len(history.get_history()) % 2 != fixed_player:
                 winner = 1-fixed_player
             return history.get_pot(winner) if winner == fixed_player else -history.get_pot(winner)
-        evaluator = deuces.Evaluator()
-        player_score = evaluator.evaluate(cards[fixed_player], board)
-        opponent_score = evaluator.evaluate(cards[1-fixed_player], board)
+        if deal is not None:
+            player_score = deal.get_showdown_score(fixed_player)
+            opponent_score = deal.get_showdown_score(1-fixed_player)
+        else:
+            evaluator = hand_engine.FastEvaluator()
+            player_score = evaluator.evaluate(cards[fixed_player], board)
+            opponent_score = evaluator.evaluate(cards[1-fixed_player], board)
         if player_score > opponent_score:
             winner = 1-fixed_player
         return history.get_pot(winner) if winner == fixed_player else -history.get_pot(winner)
     
-    def round_ended(self, round_history: str):
+    @staticmethod
+    def round_ended(round_history: str):
         return round_history.endswith("pp") or round_history.endswith("bp")
     
 
 class HoldemCFR(base.CFR):
-    def __init__(self,  num_actions, clustering, action_map = {0: 'p', 1: 'b', 2: 'f'}, node_map= {}):
-        super().__init__(num_actions, action_map)
+    SAMPLING_MODES = ("chance", "external", "outcome", "vector")
+    BACKENDS = ("python", "numba")
+
+    def __init__(self,  num_actions, clustering, action_map = {0: 'p', 1: 'b', 2: 'f'}, node_map= {}, sampling="chance", exploration=0.6, update_rule=None,
+                 prune_threshold=None, prune_after=1000, prune_revisit=20, backend="python", seed=None):
+        super().__init__(num_actions, action_map, update_rule, seed)
+        if sampling not in self.SAMPLING_MODES:
+            raise ValueError(f"Unknown sampling mode: {sampling}")
         self.num_actions = num_actions
-        self.node_map = node_map
-        self.evaluator = deuces.Evaluator()
+        self.node_map = base.NodeStore.from_node_map(num_actions, node_map)
+        if self.node_map.node_factory is None:
+            # Traversals add rows by key only and leave the node objects to the factory
+            self.node_map.node_factory = HoldemNode.from_row
+        self.evaluator = hand_engine.FastEvaluator()
         self.clustering: evaluator.HandClustering = clustering
+        self.sampling = sampling
+        self.exploration = exploration  # epsilon of the outcome sampling exploration policy
+        # Regret-based pruning (chance and external sampling): after prune_after iterations the traverser
+        # skips actions whose regret is below prune_threshold, except every prune_revisit-th iteration
+        self.prune_threshold = prune_threshold
+        self.prune_after = prune_after
+        self.prune_revisit = prune_revisit
+        self.pruning = False
+        self.tree = get_public_tree(self)
+        # backend="numba" compiles the chance-sampled traversal (numba_cfr), Python otherwise
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown backend: {backend}")
+        if backend == "numba" and sampling != "chance":
+            raise ValueError("The numba backend only runs chance sampling")
+        if backend == "numba" and not numba_cfr.AVAILABLE:
+            warnings.warn("Numba is not installed, using the Python backend")
+            backend = "python"
+        self.backend = backend
+        self.kernel = numba_cfr.TreeKernel(self.tree) if backend == "numba" else None
     def create_node(self, info_set):
-        return HoldemNode(info_set, self.num_actions)
+        return HoldemNode(info_set, self.num_actions, self.node_map)
+    def evaluate_deal(self, cards: List[List[deuces.Card]], flop: List[deuces.Card], turn: deuces.Card, river: deuces.Card):
+        return hand_engine.DealEvaluation(cards, flop, turn, river, self.clustering, self.evaluator)
+    def train_iteration(self):
+        # Deal random cards
+        start = time.perf_counter()
+        if self.sampling == "vector":
+            self.train_board(self.dealer.deal(5), start)
+            return
+        cards = self.dealer.deal(9)
+        deal = self.evaluate_deal([cards[0:2], cards[2:4]], cards[4:7], cards[7], cards[8])
+        codes = self.cluster_codes(deal)
+        start = self.record_phase("deal", start)
+        if self.kernel is not None:
+            node_ids = self.kernel.resolve(self.node_map, codes)
+            scores = np.array([deal.get_showdown_score(0), deal.get_showdown_score(1)], dtype=np.int64)
+        # Run CFR for each player
+        self.begin_iteration()
+        self.pruning = (self.prune_threshold is not None and self.iteration > self.prune_after
+                        and self.iteration % self.prune_revisit != 0)
+        for player in range(2):
+            if self.kernel is not None:
+                self.kernel.cfr(self, node_ids, scores, player)
+            elif self.sampling == "external":
+                self.external_sampling_cfr(deal, codes, 0, player)
+            elif self.sampling == "outcome":
+                self.outcome_sampling_cfr(deal, codes, 0, player, 1.0, 1.0, 1.0)
+            else:
+                self.cfr(deal, codes, 0, player, 1.0, 1.0)
+        start = self.record_phase("traversal", start)
+        self.end_iteration()
+        self.record_phase("update", start)
+    def train_board(self, board: List[deuces.Card], start=None):
+        # Vector CFR: one walk of the public tree per player covers every pair of hands on the board
+        start = time.perf_counter() if start is None else start
+        buckets = hand_engine.BoardEvaluation(board[:3], board[3], board[4], self.clustering, self.evaluator)
+        info_sets = self.board_info_sets(buckets)
+        start = self.record_phase("deal", start)
+        self.begin_iteration()
+        for player in range(2):
+            reach = [np.ones(len(buckets)), np.ones(len(buckets))]
+            self.vector_cfr(buckets, info_sets, 0, player, reach)
+        start = self.record_phase("traversal", start)
+        self.end_iteration()
+        self.record_phase("update", start)
+    def board_info_sets(self, buckets: hand_engine.BoardEvaluation):
+        # Per decision node: the store rows of the info sets of the acting player on this board,
+        # one per distinct prefix of the bucket sequences, and the prefix of every sequence
+        prefixes = []
+        for round in range(4):
+            codes = KEY_CODEC.encode_batch(["", "", "", ""], buckets.sequences[:, :round + 1], 0, [0, 0])
+            codes, inverse = np.unique(codes, return_inverse=True)
+            prefixes.append((codes.tolist(), inverse.ravel()))
+        tree = self.tree
+        info_sets = [None] * len(tree)
+        for tree_node in tree.decision_nodes().tolist():
+            if tree.edges_list[tree_node]:
+                codes, inverse = prefixes[tree.rounds_list[tree_node]]
+                key_base = tree.key_bases_list[tree_node]
+                node_ids = np.array([self.node_map.find_or_add(key_base | code) for code in codes], dtype=np.intp)
+                info_sets[tree_node] = (node_ids, inverse)
+        return info_sets
+    def cluster_codes(self, deal: hand_engine.DealEvaluation):
+        # codes[player][round] | tree.key_bases[node] is the info-set key at a node of that round
+        return [[KEY_CODEC.cluster_code(deal.get_clusters(player, round)) for round in range(4)] for player in range(2)]
+    def node_id(self, deal_codes, tree_node):
+        # Store row of the info set of the acting player at a public tree node
+        tree = self.tree
+        key = tree.key_bases_list[tree_node] | deal_codes[tree.players_list[tree_node]][tree.rounds_list[tree_node]]
+        return self.node_map.find_or_add(key)
+    def prunable(self, node_id, edges, strategy, visits):
+        # Actions of a traverser node skipped this iteration: regret below the threshold and
+        # no probability, so the node's expected value does not change without them.
+        # visits[child] is the cost of walking the child's subtree, counted as saved
+        regret_sum = self.node_map.regret_sum[node_id].tolist()
+        pruned = set()
+        for a, child in edges:
+            if strategy[a] == 0.0 and regret_sum[a] < self.prune_threshold:
+                pruned.add(a)
+                self.pruned_branches += 1
+                self.pruned_visits += visits[child]
+        return pruned
+    def terminal_utility(self, tree_node, fixed_player, deal: hand_engine.DealEvaluation):
+        # Same payoffs as HoldemNode.get_terminal_utility, from the tree's pots and fold mask
+        pot = self.tree.pots_list[tree_node]
+        folded = self.tree.folded_list[tree_node]
+        if folded:
+            won = not folded >> fixed_player & 1
+        else:
+            # Ties go to fixed_player
+            won = deal.get_showdown_score(fixed_player) <= deal.get_showdown_score(1 - fixed_player)
+        return pot[1 - fixed_player] if won else -pot[fixed_player]
+    # Game rules used by public_tree.PublicTree
+    def current_player(self, history: HoldemInfoSet):
+        return len(history.get_history()) % 2
+    def is_terminal(self, history: HoldemInfoSet):
+        return HoldemNode.is_terminal(history)
+    def is_chance_node(self, history: HoldemInfoSet):
+        return HoldemNode.is_chance_node(history)
+    def next_round(self, history: HoldemInfoSet):
+        next_history = HoldemInfoSet.from_key((history.history, [], history.round, history.pot))
+        next_history.increment_round()
+        return next_history
+    def has_folded(self, history: HoldemInfoSet, player):
+        round_history = history.get_history()
+        return round_history.endswith("f") and (len(round_history) - 1) % 2 == player
+    def auto_fold(self, history: HoldemInfoSet, player):
+        raise ValueError("A 2-player hand ends at the first fold")
+    def key_base(self, history: HoldemInfoSet, player):
+        return KEY_CODEC.encode(history.history, [], history.round, history.pot)
+    def legal_actions(self, history: HoldemInfoSet):
+        # Same cap as cfr: nothing is expanded after the second bet/raise of a round
+        if history.get_history().count('b') >= 2:
+            return []
+        return list(range(self.num_actions))
+    def next_info_set(self, history: HoldemInfoSet, current_player, a):
+        next_history = HoldemInfoSet()
+        next_history.history = list(history.history)
+        next_history.round = history.round
+        next_history.pot = list(history.pot)
+        round_history = history.get_history()
+        amount_bet = 0
+        if a==0 and (round_history == "" or round_history == "p"):
+            amount_bet = 0
+        elif a == 0 or (a == 1 and (round_history == "" or round_history == "p")):
+            amount_bet = 1
+        elif a == 1:
+            amount_bet = 2
+        next_history.set_history(round_history + self.action_map[a])
+        next_history.add_to_pot(current_player, amount_bet)
+        return next_history
     def save_node_map(self, filename="node_map.parquet"):
-        rows = []
-        for key, node in self.node_map.items():
-            rows.append({
-                "key": pickle.dumps(key),
-                "regret_sum": node.regret_sum,
-                "strategy_sum": node.strategy_sum,
-            })
-        df = pd.DataFrame(rows)
-        df.to_parquet(filename, index=False)
-
-    def cfr(self, cards: List[List[deuces.Card]], flop: List[deuces.Card], turn: deuces.Card, river: deuces.Card, history: HoldemInfoSet, fixed_player, p0, p1):
-         
-        current_player = len(history.get_history()) % 2
-        round = history.get_round()
-        
-        history.clear_clusters()
-        history.add_cluster(self.clustering.get_preflop_cluster(cards[current_player]))
-        board = []
-        if round >=1: # flop
-            board +=flop
-            evaluation = self.evaluator.evaluate(cards[current_player], flop)
-            history.add_cluster(self.clustering.get_flop_cluster(evaluation))
-        if round >=2: # turn
-            board.append(turn)
-            evaluation = self.evaluator.evaluate(cards[current_player], board)
-            history.add_cluster(self.clustering.get_turn_cluster(evaluation))
-        if round >=3: # river
-            board.append(river)
-            evaluation = self.evaluator.evaluate(cards[current_player], board)
-            history.add_cluster(self.clustering.get_river_cluster(evaluation))
-        
-        info_set = history.key()
+        node_io.save_node_map(self.node_map, filename, KEY_CODEC, clustering_key=getattr(self.clustering, "cache_key", None),
+                              metadata={"iteration": self.iteration})
+    def checkpointer(self, directory, **options):
+        return checkpoint.Checkpointer(self.node_map, directory, KEY_CODEC,
+                                       clustering_key=getattr(self.clustering, "cache_key", None),
+                                       start=self.iteration, **options)
 
-        if info_set not in self.node_map:
-            self.node_map[info_set] = self.create_node(info_set)
-        node : HoldemNode = self.node_map[info_set]
+    def cfr(self, deal: hand_engine.DealEvaluation, codes, tree_node, fixed_player, p0, p1):
+        tree = self.tree
+        node_type = tree.node_types_list[tree_node]
         # Check if we're at a terminal state
-        if node.is_terminal(history):
-            return node.get_terminal_utility(history, cards, board, fixed_player)        
-        
-        if node.is_chance_node(history):
-            history.increment_round()
-            return self.cfr(cards, flop, turn, river, history, fixed_player, p0, p1)
-            
-               
-        
+        if node_type == public_tree.TERMINAL:
+            return self.terminal_utility(tree_node, fixed_player, deal)
+        if node_type == public_tree.CHANCE:
+            return self.cfr(deal, codes, tree.next_nodes_list[tree_node], fixed_player, p0, p1)
+
+        current_player = tree.players_list[tree_node]
+        node_id = self.node_id(codes, tree_node)
+        self.node_visits += 1
         # Get current strategy
-        strategy = node.get_strategy(p0 if current_player == 1 else p1)
-        
-        # Initialize utility arrays
-        util = [0.0, 0.0, 0.0]
+        strategy = self.node_map.update_strategy(node_id, p0 if current_player == 1 else p1).tolist()
+
+        # Recursively calculate utility for each action; nothing is expanded after 2 bets/raises
+        edges = tree.edges_list[tree_node]
+        pruned = ()
+        if self.pruning and current_player == fixed_player:
+            pruned = self.prunable(node_id, edges, strategy, tree.subtree_decisions_list)
+        util = [0.0] * self.num_actions
         node_util = 0.0
-        
-        
-        # Recursively calculate utility for each action
-        for a in range(self.num_actions):
-            if history.get_history().count('b') >= 2: # only 2 bets/raises allowed
+        for a, child in edges:
+            if a in pruned:
                 continue
-            next_history = HoldemInfoSet.from_key(info_set)
-            amount_bet = 0
-            if a==0 and (next_history.get_history() == "" or next_history.get_history() == "p"):
-                amount_bet = 0
-            elif a == 0 or (a == 1 and (next_history.get_history() == "" or next_history.get_history() == "p")):
-                amount_bet = 1
-            elif a == 1:
-                amount_bet = 2
-
-            next_history.set_history(next_history.get_history()+(self.action_map[a]))           
-            next_history.add_to_pot(current_player, amount_bet)
             # Update probabilities based on current player
             if current_player == 0:
-                util[a] = self.cfr(cards, flop, turn, river, next_history, fixed_player, p0 * strategy[a], p1)
+                util[a] = self.cfr(deal, codes, child, fixed_player, p0 * strategy[a], p1)
             else:
-                util[a] = self.cfr(cards, flop, turn, river, next_history, fixed_player, p0, p1 * strategy[a])
-            
+                util[a] = self.cfr(deal, codes, child, fixed_player, p0, p1 * strategy[a])
             node_util += strategy[a] * util[a]
-        
-        # Update regrets only if this is the fixed player's decision point
+
+        # Update regrets only if this is the fixed player's decision point,
+        # multiplied by the opponent's probability
         if current_player == fixed_player:
+            regret_sum = self.node_map.regret_sum[node_id]
+            opponent_prob = p1 if fixed_player == 0 else p0
             for a in range(self.num_actions):
-                regret = util[a] - node_util
-                
-                # Multiply by the opponent's probability
-                if fixed_player == 0:
-                    node.regret_sum[a] += p1 * regret
+                if a not in pruned:
+                    regret_sum[a] += opponent_prob * (util[a] - node_util)
+
+        return node_util
+
+    def external_sampling_cfr(self, deal: hand_engine.DealEvaluation, codes, tree_node, traverser):
+        tree = self.tree
+        node_type = tree.node_types_list[tree_node]
+        if node_type == public_tree.TERMINAL:
+            return self.terminal_utility(tree_node, traverser, deal)
+        if node_type == public_tree.CHANCE:
+            return self.external_sampling_cfr(deal, codes, tree.next_nodes_list[tree_node], traverser)
+
+        edges = tree.edges_list[tree_node]
+        if not edges:
+            return 0.0
+        current_player = tree.players_list[tree_node]
+        node_id = self.node_id(codes, tree_node)
+        self.node_visits += 1
+
+        if current_player != traverser:
+            # Opponent node: accumulate the average strategy and sample a single action
+            strategy = self.node_map.update_strategy(node_id, 1.0)
+            _, child = self.random.choices(edges, weights=[strategy[a] for a, _ in edges])[0]
+            return self.external_sampling_cfr(deal, codes, child, traverser)
+
+        # Traverser node: walk every action, regrets use the sampled counterfactual values
+        strategy = self.node_map.update_strategy(node_id, 0.0).tolist()
+        pruned = ()
+        if self.pruning:
+            pruned = self.prunable(node_id, edges, strategy, tree.sampled_decisions_list[traverser])
+        util = [0.0] * self.num_actions
+        node_util = 0.0
+        for a, child in edges:
+            if a not in pruned:
+                util[a] = self.external_sampling_cfr(deal, codes, child, traverser)
+                node_util += strategy[a] * util[a]
+        regret_sum = self.node_map.regret_sum[node_id]
+        for a, _ in edges:
+            if a not in pruned:
+                regret_sum[a] += util[a] - node_util
+        return node_util
+
+    def outcome_sampling_cfr(self, deal: hand_engine.DealEvaluation, codes, tree_node, traverser, pi_traverser, pi_opponent, sample_prob):
+        # Returns the importance-weighted utility of the sampled terminal and the
+        # probability of reaching it from this node under the current strategy
+        tree = self.tree
+        node_type = tree.node_types_list[tree_node]
+        if node_type == public_tree.TERMINAL:
+            return self.terminal_utility(tree_node, traverser, deal) / sample_prob, 1.0
+        if node_type == public_tree.CHANCE:
+            return self.outcome_sampling_cfr(deal, codes, tree.next_nodes_list[tree_node], traverser, pi_traverser, pi_opponent, sample_prob)
+
+        edges = tree.edges_list[tree_node]
+        if not edges:
+            return 0.0, 1.0
+        current_player = tree.players_list[tree_node]
+        node_id = self.node_id(codes, tree_node)
+        self.node_visits += 1
+
+        strategy = self.node_map.update_strategy(node_id, 0.0)
+        if current_player == traverser:
+            # Epsilon-on-policy exploration keeps every action of the traverser sampled
+            probs = [self.exploration / len(edges) + (1 - self.exploration) * strategy[a] for a, _ in edges]
+        else:
+            probs = [strategy[a] for a, _ in edges]
+        i = self.random.choices(range(len(edges)), weights=probs)[0]
+        a, child = edges[i]
+
+        if current_player == traverser:
+            util, tail = self.outcome_sampling_cfr(deal, codes, child, traverser, pi_traverser * strategy[a], pi_opponent, sample_prob * probs[i])
+            w = util * pi_opponent
+            regret_sum = self.node_map.regret_sum[node_id]
+            for b, _ in edges:
+                if b == a:
+                    regret_sum[b] += w * tail * (1 - strategy[a])
                 else:
-                    node.regret_sum[a] += p0 * regret
-        
+                    regret_sum[b] -= w * tail * strategy[a]
+        else:
+            util, tail = self.outcome_sampling_cfr(deal, codes, child, traverser, pi_traverser, pi_opponent * strategy[a], sample_prob * probs[i])
+            # Stochastically-weighted averaging of the opponent's strategy
+            self.node_map.strategy_sum[node_id] += (self.node_map.strategy_weight * pi_opponent / sample_prob) * strategy
+        return util, tail * strategy[a]
+
+    def vector_cfr(self, buckets: hand_engine.BoardEvaluation, info_sets, tree_node, fixed_player, reach):
+        # Counterfactual values of fixed_player for every bucket sequence; reach[p] holds the
+        # probability of player p playing to this node with each sequence
+        tree = self.tree
+        node_type = tree.node_types_list[tree_node]
+        if node_type == public_tree.TERMINAL:
+            # Bucket-vs-bucket payoffs, summed over the opponent's sequences
+            pot = tree.pots_list[tree_node]
+            folded = tree.folded_list[tree_node]
+            joint = buckets.joint @ reach[1 - fixed_player]
+            if folded:
+                won = not folded >> fixed_player & 1
+                return (pot[1 - fixed_player] if won else -pot[fixed_player]) * joint
+            wins = buckets.wins @ reach[1 - fixed_player]
+            return pot[1 - fixed_player] * wins - pot[fixed_player] * (joint - wins)
+        if node_type == public_tree.CHANCE:
+            return self.vector_cfr(buckets, info_sets, tree.next_nodes_list[tree_node], fixed_player, reach)
+
+        edges = tree.edges_list[tree_node]
+        if not edges:
+            return np.zeros(len(buckets))
+        current_player = tree.players_list[tree_node]
+        node_ids, inverse = info_sets[tree_node]
+        self.node_visits += len(node_ids)
+        strategy = self.node_map.regret_matching(node_ids)
+        sequence_strategy = strategy[inverse]
+
+        if current_player != fixed_player:
+            node_util = np.zeros(len(buckets))
+            for a, child in edges:
+                child_reach = list(reach)
+                child_reach[current_player] = reach[current_player] * sequence_strategy[:, a]
+                node_util += self.vector_cfr(buckets, info_sets, child, fixed_player, child_reach)
+            return node_util
+
+        util = np.zeros((len(buckets), self.num_actions))
+        for a, child in edges:
+            child_reach = list(reach)
+            child_reach[current_player] = reach[current_player] * sequence_strategy[:, a]
+            util[:, a] = self.vector_cfr(buckets, info_sets, child, fixed_player, child_reach)
+        node_util = (sequence_strategy * util).sum(axis=1)
+        # Regrets and average strategy of every info set, summed over its sequences
+        regret = np.zeros((len(node_ids), self.num_actions))
+        np.add.at(regret, inverse, util - node_util[:, None])
+        self.node_map.regret_sum[node_ids] += regret
+        reach_probs = np.bincount(inverse, weights=reach[current_player] * buckets.hand_probs, minlength=len(node_ids))
+        self.node_map.strategy_sum[node_ids] += (self.node_map.strategy_weight * reach_probs)[:, None] * strategy
         return node_util
 
-    def cfr_with_fixed_player(self, cards: List[List[deuces.Card]], flop: List[deuces.Card], turn: deuces.Card, river: deuces.Card, history: HoldemInfoSet, fixed_player, opponent_model, p0, p1):
-         
+    def cfr_with_fixed_player(self, cards: List[List[deuces.Card]], flop: List[deuces.Card], turn: deuces.Card, river: deuces.Card, history: HoldemInfoSet, fixed_player, opponent_model, p0, p1, deal: hand_engine.DealEvaluation = None):
+        if deal is None:
+            deal = self.evaluate_deal(cards, flop, turn, river)
         current_player = len(history.get_history()) % 2
         round = history.get_round()
         
-        history.clear_clusters()
-        history.add_cluster(self.clustering.get_preflop_cluster(cards[current_player]))
-        board = []
-        if round >=1: # flop
-            board +=flop
-            evaluation = self.evaluator.evaluate(cards[current_player], flop)
-            history.add_cluster(self.clustering.get_flop_cluster(evaluation))
-        if round >=2: # turn
-            board.append(turn)
-            evaluation = self.evaluator.evaluate(cards[current_player], board)
-            history.add_cluster(self.clustering.get_turn_cluster(evaluation))
-        if round >=3: # river
-            board.append(river)
-            evaluation = self.evaluator.evaluate(cards[current_player], board)
-            history.add_cluster(self.clustering.get_river_cluster(evaluation))
+        history.clusters = deal.get_clusters(current_player, round)
+        board = deal.get_board(round)
         
         info_set = history.key()
 
@@ -201,6 +469,7 @@ class HoldemCFR(base.CFR):
             if info_set not in self.node_map:
                 self.node_map[info_set] = self.create_node(info_set)
             node : HoldemNode = self.node_map[info_set]
+            self.node_visits += 1
         else:
             if(isinstance(opponent_model, RuleBasedModel)):
                 node = RuleBasedNode(info_set, opponent_model.strategy)
@@ -208,11 +477,11 @@ class HoldemCFR(base.CFR):
        
         # Check if we're at a terminal state
         if node.is_terminal(history):
-            return node.get_terminal_utility(history, cards, board, fixed_player)        
+            return node.get_terminal_utility(history, cards, board, fixed_player, deal)
         
         if node.is_chance_node(history):
             history.increment_round()
-            return self.cfr_with_fixed_player(cards, flop, turn, river, history, fixed_player, opponent_model, p0, p1)
+            return self.cfr_with_fixed_player(cards, flop, turn, river, history, fixed_player, opponent_model, p0, p1, deal)
             
                
         
@@ -228,22 +497,12 @@ class HoldemCFR(base.CFR):
         for a in range(self.num_actions):
             if history.get_history().count('b') >= 2: # only 2 bets/raises allowed
                 continue
-            next_history = HoldemInfoSet.from_key(info_set)
-            amount_bet = 0
-            if a==0 and (next_history.get_history() == "" or next_history.get_history() == "p"):
-                amount_bet = 0
-            elif a == 0 or (a == 1 and (next_history.get_history() == "" or next_history.get_history() == "p")):
-                amount_bet = 1
-            elif a == 1:
-                amount_bet = 2
-
-            next_history.set_history(next_history.get_history()+(self.action_map[a]))           
-            next_history.add_to_pot(current_player, amount_bet)
+            next_history = self.next_info_set(history, current_player, a)
             # Update probabilities based on current player
             if current_player == 0:
-                util[a] = self.cfr_with_fixed_player(cards, flop, turn, river, next_history, fixed_player, opponent_model, p0 * strategy[a], p1)
+                util[a] = self.cfr_with_fixed_player(cards, flop, turn, river, next_history, fixed_player, opponent_model, p0 * strategy[a], p1, deal)
             else:
-                util[a] = self.cfr_with_fixed_player(cards, flop, turn, river, next_history, fixed_player, opponent_model, p0, p1 * strategy[a])
+                util[a] = self.cfr_with_fixed_player(cards, flop, turn, river, next_history, fixed_player, opponent_model, p0, p1 * strategy[a], deal)
             
             node_util += strategy[a] * util[a]
         
@@ -272,124 +531,101 @@ class RuleBasedNode(HoldemNode):
     """Node that always returns a fixed strategy."""
     def __init__(self, info_set_key, strategy):
         self.info_set_key = info_set_key
-        self.strategy = strategy
+        self.fixed_strategy = strategy
     
     def get_average_strategy(self):
         """Return the fixed strategy."""
-        return self.strategy
+        return self.fixed_strategy
     
     def get_strategy(self, realization_weight):
-        return self.strategy
-
-def load_node_map(filename, num_actions):
-    df = pd.read_parquet(filename)
-    node_map = {}
-    for _, row in df.iterrows():
-        key = pickle.loads(row["key"])
-        info_set = HoldemInfoSet.from_key(key)
-        node = HoldemNode(info_set, num_actions)
-        node.regret_sum = list(row["regret_sum"])
-        node.strategy_sum = list(row["strategy_sum"])
-        node_map[key] = node
-    return node_map
-
-def train(iterations, num_clusters, filename):
-    hc = evaluator.HandClustering()
-    print("Building lookup tables...")
-    hc.build_preflop_table(20000, num_clusters)
-    print("Building preflop table finished.")
-    hc.build_flop_table(20000, num_clusters)
-    print("Building flop table finished.")
-    hc.build_turn_table(20000, num_clusters)
-    print("Building turn table finished.")
-    hc.build_river_table(20000, num_clusters)
-    print("Building river table finished.")
-    cfr = HoldemCFR(3, hc, action_map = {0: 'p', 1: 'b', 2:'f'})
+        return self.fixed_strategy
+
+def migrate_key(key):
+    # Older maps store pickled tuple keys: migrate them to packed keys
+    return HoldemInfoSet.from_key(key).key()
+
+def load_node_map(filename, num_actions, clustering_key=None):
+    return node_io.load_node_map(filename, num_actions, KEY_CODEC, HoldemNode.from_row, migrate_key, clustering_key)
+
+def iter_node_map(filename, num_actions, **options):
+    # Streamed (keys, regret_sum, strategy_sum) batches, see node_io.iter_node_rows
+    return node_io.iter_node_rows(filename, num_actions, KEY_CODEC, migrate_key, **options)
+
+def train(iterations, num_clusters, filename, workers=1, merge_every=100, sampling="chance", update_rule="vanilla",
+          checkpoint_dir="checkpoints", checkpoint_every=1000, checkpoint_seconds=None, keep_checkpoints=3,
+          keep_every=10000, metrics_file=None, profile_iterations=0, checkpoint_full_every=1, prune_threshold=None,
+          prune_after=1000, prune_revisit=20, backend="python", seed=None):
+    hc = clustering_cache.load_or_build(num_clusters)
+    cfr = HoldemCFR(3, hc, action_map = {0: 'p', 1: 'b', 2:'f'}, sampling=sampling, update_rule=update_rule,
+                    prune_threshold=prune_threshold, prune_after=prune_after, prune_revisit=prune_revisit,
+                    backend=backend, seed=seed)
     print("Training...")
-    for i in range(iterations):
-        # Deal random cards
-        deck = deuces.Deck()
-        player1_cards = deck.draw(2)
-        player2_cards = deck.draw(2)
-        cards = [player1_cards, player2_cards]
-        flop = deck.draw(3)
-        [turn, river] = deck.draw(2)
-        info_set1 = HoldemInfoSet()
-        info_set2 = HoldemInfoSet()
-        # # Run CFR for each player
-        cfr.cfr(cards, flop,turn, river, info_set1, 0, 1.0, 1.0)  # For player 0
-        cfr.cfr(cards,flop,turn, river, info_set2, 1, 1.0, 1.0)  # For player 1
-        if (i+1) % 10 == 0 or i == 0:
-            print(f"Completed {i+1} iterations")
-        if i == 1000:
-            cfr.save_node_map("bucket_5_1k_2.parquet")
-        if i == 10000:
-            cfr.save_node_map("bucket_5_10k_2.parquet")
-        if i == 20000:
-            cfr.save_node_map("bucket_5_20k_2.parquet")
+    monitor = metrics.TrainingMonitor(cfr, metrics_file, profile_iterations=profile_iterations)
+    checkpointer = None
+    if checkpoint_dir is not None:
+        checkpointer = cfr.checkpointer(checkpoint_dir, every_iterations=checkpoint_every, every_seconds=checkpoint_seconds,
+                                        keep_last=keep_checkpoints, keep_every=keep_every, full_every=checkpoint_full_every)
+    parallel.run_training(cfr, iterations, workers, merge_every, monitor=monitor, checkpointer=checkpointer)
     print("Training completed.")
     cfr.save_node_map(filename)
 
-def continue_training(iterations, num_clusters, filename):
-    hc = evaluator.HandClustering()
-    print("Building lookup tables...")
-    hc.build_preflop_table(20000, num_clusters)
-    print("Building preflop table finished.")
-    hc.build_flop_table(20000, num_clusters)
-    print("Building flop table finished.")
-    hc.build_turn_table(20000, num_clusters)
-    print("Building turn table finished.")
-    hc.build_river_table(20000, num_clusters)
-    print("Building river table finished.")
-    print("Continuing training...")
-    loaded_map = load_node_map(filename, 3)
-    cfr = HoldemCFR(3, hc, action_map = {0: 'p', 1: 'b', 2:'f'}, node_map=loaded_map)
-    for i in range(iterations):
-        # Deal random cards
-        deck = deuces.Deck()
-        player1_cards = deck.draw(2)
-        player2_cards = deck.draw(2)
-        cards = [player1_cards, player2_cards]
-        flop = deck.draw(3)
-        [turn, river] = deck.draw(2)
-        info_set1 = HoldemInfoSet()
-        info_set2 = HoldemInfoSet()
-        # # Run CFR for each player
-        cfr.cfr(cards, flop,turn, river, info_set1, 0, 1.0, 1.0)  # For player 0
-        cfr.cfr(cards,flop,turn, river, info_set2, 1, 1.0, 1.0)  # For player 1
-        if (i+1) % 10 == 0 or i == 0:
-            print(f"Completed {i+1} iterations")
+def continue_training(iterations, num_clusters, filename, workers=1, merge_every=100, sampling="chance", update_rule="vanilla",
+                      checkpoint_dir="checkpoints", checkpoint_every=1000, checkpoint_seconds=None, keep_checkpoints=3,
+                      keep_every=10000, metrics_file=None, profile_iterations=0, checkpoint_full_every=1,
+                      prune_threshold=None, prune_after=1000, prune_revisit=20, backend="python", seed=None):
+    """Trains `iterations` more iterations, starting from whichever is newer of
+    filename and the latest valid checkpoint in checkpoint_dir."""
+    hc = clustering_cache.load_or_build(num_clusters)
+    start = latest = None
+    if os.path.exists(filename):
+        start = int(node_io.read_metadata(filename).get("iteration", 0))
+    if checkpoint_dir is not None:
+        latest = checkpoint.latest_checkpoint(checkpoint_dir)
+    if start is None and latest is None:
+        raise FileNotFoundError(f"No node map at {filename} and no checkpoint in {checkpoint_dir}")
+    if latest is not None and (start is None or latest > start):
+        start = latest
+        print(f"Continuing training from the checkpoint of {checkpoint_dir} at iteration {start}...")
+        loaded_map = checkpoint.load_checkpoint(checkpoint_dir, 3, KEY_CODEC, HoldemNode.from_row, start,
+                                                 clustering_key=hc.cache_key)
+    else:
+        print(f"Continuing training from {filename} at iteration {start}...")
+        loaded_map = load_node_map(filename, 3, hc.cache_key)
+    cfr = HoldemCFR(3, hc, action_map = {0: 'p', 1: 'b', 2:'f'}, node_map=loaded_map, sampling=sampling, update_rule=update_rule,
+                    prune_threshold=prune_threshold, prune_after=prune_after, prune_revisit=prune_revisit,
+                    backend=backend, seed=seed)
+    cfr.iteration = start
+    monitor = metrics.TrainingMonitor(cfr, metrics_file, start=start, profile_iterations=profile_iterations,
+                                      profile_start=start + 1)
+    checkpointer = None
+    if checkpoint_dir is not None:
+        checkpointer = cfr.checkpointer(checkpoint_dir, every_iterations=checkpoint_every, every_seconds=checkpoint_seconds,
+                                        keep_last=keep_checkpoints, keep_every=keep_every, full_every=checkpoint_full_every)
+    parallel.run_training(cfr, iterations, workers, merge_every, start, monitor, checkpointer)
     print("Training completed.")
     cfr.save_node_map(filename)
 
-def train_with_fixed_player(iterations, num_clusters, opponent, filename):
-    hc = evaluator.HandClustering()
-    print("Building lookup tables...")
-    hc.build_preflop_table(20000, num_clusters)
-    print("Building preflop table finished.")
-    hc.build_flop_table(20000, num_clusters)
-    print("Building flop table finished.")
-    hc.build_turn_table(20000, num_clusters)
-    print("Building turn table finished.")
-    hc.build_river_table(20000, num_clusters)
-    print("Building river table finished.")
-    cfr = HoldemCFR(3, hc, action_map = {0: 'p', 1: 'b', 2:'f'})
+def train_with_fixed_player(iterations, num_clusters, opponent, filename, update_rule="vanilla", seed=None):
+    hc = clustering_cache.load_or_build(num_clusters)
+    cfr = HoldemCFR(3, hc, action_map = {0: 'p', 1: 'b', 2:'f'}, update_rule=update_rule, seed=seed)
     print("Training...")
+    monitor = metrics.TrainingMonitor(cfr)
     for i in range(iterations):
         # Deal random cards
-        deck = deuces.Deck()
-        player1_cards = deck.draw(2)
-        player2_cards = deck.draw(2)
-        cards = [player1_cards, player2_cards]
-        flop = deck.draw(3)
-        [turn, river] = deck.draw(2)
+        dealt = cfr.dealer.deal(9)
+        cards = [dealt[0:2], dealt[2:4]]
+        flop = dealt[4:7]
+        [turn, river] = dealt[7:9]
         info_set1 = HoldemInfoSet()
         info_set2 = HoldemInfoSet()
+        deal = cfr.evaluate_deal(cards, flop, turn, river)
         # # Run CFR for each player
-        cfr.cfr_with_fixed_player(cards, flop, turn, river, info_set1, 0, opponent, 1.0, 1.0)  # For player 0
-        cfr.cfr_with_fixed_player(cards, flop, turn, river, info_set2, 1, opponent, 1.0, 1.0)  # For player 1
-        if (i+1) % 10 == 0 or i == 0:
-            print(f"Completed {i+1} iterations")
+        cfr.begin_iteration()
+        cfr.cfr_with_fixed_player(cards, flop, turn, river, info_set1, 0, opponent, 1.0, 1.0, deal)  # For player 0
+        cfr.cfr_with_fixed_player(cards, flop, turn, river, info_set2, 1, opponent, 1.0, 1.0, deal)  # For player 1
+        cfr.end_iteration()
+        monitor.step(i + 1)
+    monitor.close(iterations)
     print("Training completed.")
     cfr.save_node_map(filename)
 
@@ -397,9 +633,38 @@ always_call_model = RuleBasedModel(
     action_map={0: 'p', 1: 'b', 2: 'f'},
     strategy=[1.0, 0.0, 0.0]  
 )
-#train_with_fixed_player(10000, 5, always_call_model, "anti_calling station.parquet")    
 
-#train(30000, 5, "bucket_5_30k.parquet")
-train(30000, 5, "bucket_5_30k_2.parquet")
-#train_with_fixed_player(50000, 5, always_call_model, "against_calling_machine_50k.parquet")
-# continue_training(10000, 6,  "with_antes_6.parquet")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train a 2-player fixed-limit Hold'em CFR strategy.")
+    parser.add_argument("--iterations", type=int, default=30000)
+    parser.add_argument("--clusters", type=int, default=5)
+    parser.add_argument("--output", default="bucket_5_30k_2.parquet")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes")
+    parser.add_argument("--merge-every", type=int, default=100, help="Iterations per worker between merges")
+    parser.add_argument("--sampling", choices=HoldemCFR.SAMPLING_MODES, default="chance", help="CFR traversal: chance-sampled, external or outcome sampling MCCFR, or vector CFR over all hands of a sampled board")
+    parser.add_argument("--update-rule", choices=sorted(base.UPDATE_RULES), default="vanilla", help="Regret and average strategy update rule")
+    parser.add_argument("--resume", action="store_true", help="Continue from the output file or the latest checkpoint")
+    parser.add_argument("--checkpoint-dir", default="checkpoints", help="Directory of background checkpoints")
+    parser.add_argument("--checkpoint-every", type=int, default=1000, help="Iterations between checkpoints")
+    parser.add_argument("--checkpoint-seconds", type=float, default=None, help="Seconds between checkpoints")
+    parser.add_argument("--keep-checkpoints", type=int, default=3, help="Number of newest checkpoints kept")
+    parser.add_argument("--keep-every", type=int, default=10000, help="Also keep checkpoints at multiples of this iteration")
+    parser.add_argument("--checkpoint-full-every", type=int, default=1, help="Write a full checkpoint every N snapshots, deltas in between")
+    parser.add_argument("--backend", choices=HoldemCFR.BACKENDS, default="python", help="Traversal backend; numba compiles chance-sampled CFR")
+    parser.add_argument("--prune-threshold", type=float, default=None, help="Skip traverser actions with regret below this (chance and external sampling)")
+    parser.add_argument("--prune-after", type=int, default=1000, help="Iterations before regret-based pruning starts")
+    parser.add_argument("--prune-revisit", type=int, default=20, help="Every N-th iteration explores pruned actions again")
+    parser.add_argument("--metrics", default=None, help="Metrics file, JSON lines or .csv")
+    parser.add_argument("--profile-iterations", type=int, default=0, help="Profile this many iterations into training.prof")
+    parser.add_argument("--seed", type=int, default=None, help="Root seed of the dealing and sampling streams")
+    args = parser.parse_args()
+    #train_with_fixed_player(10000, 5, always_call_model, "anti_calling station.parquet")    
+
+    #train(30000, 5, "bucket_5_30k.parquet")
+    run = continue_training if args.resume else train
+    run(args.iterations, args.clusters, args.output, args.workers, args.merge_every, args.sampling, args.update_rule,
+        args.checkpoint_dir, args.checkpoint_every, args.checkpoint_seconds, args.keep_checkpoints, args.keep_every,
+        args.metrics, args.profile_iterations, args.checkpoint_full_every, args.prune_threshold, args.prune_after,
+        args.prune_revisit, args.backend, args.seed)
+    #train_with_fixed_player(50000, 5, always_call_model, "against_calling_machine_50k.parquet")
+    # continue_training(10000, 6,  "with_antes_6.parquet")
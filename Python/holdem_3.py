@@ -1,9 +1,34 @@
+import argparse
+import checkpoint
+import clustering_cache
 import base
 import deuces
 import evaluator
+import hand_engine
+import key_codec
+import metrics
+import node_io
 from typing import List
-import pandas as pd
-import pickle
+import parallel
+import public_tree
+import time
+
+KEY_CODECS = {}
+PUBLIC_TREES = {}
+
+def get_key_codec(num_players):
+    # Up to 8 actions per round and 5-bit pots leave room for auto-folds and raises
+    if num_players not in KEY_CODECS:
+        KEY_CODECS[num_players] = key_codec.KeyCodec(num_players, max_actions=8, pot_bits=5)
+    return KEY_CODECS[num_players]
+
+def get_public_tree(cfr):
+    # The betting tree only depends on the players and actions, so it is built once per process
+    tree_key = (cfr.num_players, cfr.num_actions, tuple(cfr.action_map.items()))
+    if tree_key not in PUBLIC_TREES:
+        PUBLIC_TREES[tree_key] = public_tree.PublicTree(cfr, HoldemInfoSet(cfr.num_players), cfr.num_actions,
+                                                        cfr.num_players)
+    return PUBLIC_TREES[tree_key]
 
 class HoldemInfoSet(base.InfoSet):
     def __init__(self, num_players=2):
@@ -48,11 +73,23 @@ class HoldemInfoSet(base.InfoSet):
         return self.player_id
     
     def key(self):
-        return (tuple(self.history), tuple(self.clusters), self.round, 
-                tuple(self.pot), self.player_id, self.num_players)
+        return get_key_codec(self.num_players).encode(self.history, self.clusters, self.round,
+                                                      self.pot, self.player_id)
+    
+    def copy(self):
+        obj = HoldemInfoSet(self.num_players)
+        obj.history = list(self.history)
+        obj.clusters = list(self.clusters)
+        obj.round = self.round
+        obj.pot = list(self.pot)
+        obj.player_id = self.player_id
+        return obj
     
     @classmethod
-    def from_key(cls, key):
+    def from_key(cls, key, num_players=2):
+        # Accepts packed integer keys as well as the tuple keys of older node maps
+        if not isinstance(key, tuple):
+            key = get_key_codec(num_players).decode(key) + (num_players,)
         num_players = key[5] if len(key) > 5 else 2
         obj = cls(num_players)
         obj.history = list(key[0])
@@ -64,8 +101,8 @@ class HoldemInfoSet(base.InfoSet):
     
     
 class HoldemNode(base.Node):
-    def __init__(self, info_set, num_actions):
-        super().__init__(info_set, num_actions)
+    def __init__(self, info_set, num_actions, store=None, node_id=None):
+        super().__init__(info_set, num_actions, store, node_id)
     @staticmethod    
     def is_terminal(history: HoldemInfoSet):
         round_history = history.get_history()
@@ -90,7 +127,8 @@ class HoldemNode(base.Node):
         return round != 3 and HoldemNode.round_ended(round_history, history.num_players)
     @staticmethod
     def get_terminal_utility(history: HoldemInfoSet, cards: List[List[deuces.Card]], 
-                           board: List[deuces.Card], fixed_player):
+                           board: List[deuces.Card], fixed_player,
+                           deal: hand_engine.DealEvaluation = None):
         # Count active players across all rounds
         all_history = ''.join(history.history)
         active_players = []
@@ -108,10 +146,13 @@ class HoldemNode(base.Node):
             return history.get_pot(fixed_player)
         
         # Showdown - evaluate all hands
-        evaluator_obj = deuces.Evaluator()
+        evaluator_obj = hand_engine.FastEvaluator()
         scores = []
         for i in active_players:
-            score = evaluator_obj.evaluate(cards[i], board)
+            if deal is not None:
+                score = deal.get_showdown_score(i)
+            else:
+                score = evaluator_obj.evaluate(cards[i], board)
             scores.append((score, i))
         
         # Find winner(s) - lower score is better in deuces
@@ -152,144 +193,189 @@ class HoldemNode(base.Node):
 
 class HoldemCFR(base.CFR):
     def __init__(self, num_actions, clustering, num_players=2, 
-                 action_map={0: 'p', 1: 'b', 2: 'f'}, node_map={}):
-        super().__init__(num_actions, action_map)
+                 action_map={0: 'p', 1: 'b', 2: 'f'}, node_map={}, update_rule=None, seed=None):
+        super().__init__(num_actions, action_map, update_rule, seed)
         self.num_actions = num_actions
         self.num_players = num_players
-        self.node_map = node_map
-        self.evaluator = deuces.Evaluator()
+        self.node_map = base.NodeStore.from_node_map(num_actions, node_map)
+        if self.node_map.node_factory is None:
+            # Traversals add rows by key only and leave the node objects to the factory
+            self.node_map.node_factory = self.node_from_row
+        self.evaluator = hand_engine.FastEvaluator()
         self.clustering: evaluator.HandClustering = clustering
+        self.tree = get_public_tree(self)
         
     def create_node(self, info_set):
-        return HoldemNode(info_set, self.num_actions)
+        return HoldemNode(info_set, self.num_actions, self.node_map)
+
+    def node_from_row(self, store, key, node_id):
+        # As holdem.HoldemNode.from_row: node.info_set is the decoded HoldemInfoSet
+        return HoldemNode(HoldemInfoSet.from_key(key, self.num_players), self.num_actions, store, node_id)
     
-    def save_node_map(self, filename="node_map.parquet"):
-        rows = []
-        for key, node in self.node_map.items():
-            rows.append({
-                "key": pickle.dumps(key),
-                "regret_sum": node.regret_sum,
-                "strategy_sum": node.strategy_sum,
-            })
-        df = pd.DataFrame(rows)
-        df.to_parquet(filename, index=False)
+    def evaluate_deal(self, cards: List[List[deuces.Card]], flop: List[deuces.Card],
+                      turn: deuces.Card, river: deuces.Card):
+        return hand_engine.DealEvaluation(cards, flop, turn, river, self.clustering, self.evaluator)
 
-    def cfr(self, cards: List[List[deuces.Card]], flop: List[deuces.Card], 
-            turn: deuces.Card, river: deuces.Card, history: HoldemInfoSet, 
-            fixed_player, reach_probs: List[float]):
+    def train_iteration(self):
+        # Deal random cards
+        start = time.perf_counter()
+        dealt = self.dealer.deal(2 * self.num_players + 5)
+        cards = [dealt[2 * i:2 * i + 2] for i in range(self.num_players)]
+        flop = dealt[-5:-2]
+        [turn, river] = dealt[-2:]
         
-        # Calculate current player based on action count
-        current_player = len(history.get_history()) % self.num_players
-        round = history.get_round()
+        # Run CFR for each player perspective
+        deal = self.evaluate_deal(cards, flop, turn, river)
+        codes = self.cluster_codes(deal)
+        start = self.record_phase("deal", start)
+        self.begin_iteration()
+        for player in range(self.num_players):
+            reach_probs = [1.0] * self.num_players
+            self.cfr(deal, codes, 0, player, reach_probs)
+        start = self.record_phase("traversal", start)
+        self.end_iteration()
+        self.record_phase("update", start)
 
-        # Set the perspective for this info set
-        history.set_player_id(current_player)
-        
-        # Build clusters for current player's perspective
-        history.clear_clusters()
-        history.add_cluster(self.clustering.get_preflop_cluster(cards[current_player]))
-        board = []
-        
-        if round >= 1:  # flop
-            board += flop
-            evaluation = self.evaluator.evaluate(cards[current_player], flop)
-            history.add_cluster(self.clustering.get_flop_cluster(evaluation))
-        if round >= 2:  # turn
-            board.append(turn)
-            evaluation = self.evaluator.evaluate(cards[current_player], board)
-            history.add_cluster(self.clustering.get_turn_cluster(evaluation))
-        if round >= 3:  # river
-            board.append(river)
-            evaluation = self.evaluator.evaluate(cards[current_player], board)
-            history.add_cluster(self.clustering.get_river_cluster(evaluation))
+    def cluster_codes(self, deal: hand_engine.DealEvaluation):
+        # codes[player][round] | tree.key_bases[node] is the info-set key at a node of that round
+        codec = get_key_codec(self.num_players)
+        return [[codec.cluster_code(deal.get_clusters(player, round)) for round in range(4)]
+                for player in range(self.num_players)]
+
+    def terminal_utility(self, tree_node, fixed_player, deal: hand_engine.DealEvaluation):
+        # Same payoffs as HoldemNode.get_terminal_utility, from the tree's pots and fold mask
+        pot = self.tree.pots_list[tree_node]
+        folded = self.tree.folded_list[tree_node]
+        if folded >> fixed_player & 1:
+            return -pot[fixed_player]
+        active_players = [i for i in range(self.num_players) if not folded >> i & 1]
+        if len(active_players) == 1:
+            return sum(pot) - pot[fixed_player]
+        # Showdown, lower score is better in deuces; the winners split the pot
+        scores = {i: deal.get_showdown_score(i) for i in active_players}
+        best_score = min(scores.values())
+        if scores[fixed_player] != best_score:
+            return -pot[fixed_player]
+        winners = sum(1 for score in scores.values() if score == best_score)
+        return sum(pot) / winners - pot[fixed_player]
+
+    # Game rules used by public_tree.PublicTree
+    def current_player(self, history: HoldemInfoSet):
+        return len(history.get_history()) % self.num_players
+
+    def is_terminal(self, history: HoldemInfoSet):
+        return HoldemNode.is_terminal(history)
+
+    def is_chance_node(self, history: HoldemInfoSet):
+        return HoldemNode.is_chance_node(history)
+
+    def next_round(self, history: HoldemInfoSet):
+        next_history = history.copy()
+        next_history.increment_round()
+        return next_history
 
+    def has_folded(self, history: HoldemInfoSet, player):
+        # Fold check across all rounds
+        return 'f' in ''.join(history.history)[player::self.num_players]
+
+    def auto_fold(self, history: HoldemInfoSet, player):
+        # A player who already folded folds again on each turn, without betting
+        next_history = history.copy()
+        next_history.set_history(next_history.get_history() + 'f')
+        return next_history
+
+    def legal_actions(self, history: HoldemInfoSet):
+        if history.get_history().count('b') >= 2:  # betting limit
+            return []
+        return list(range(self.num_actions))
+
+    def next_info_set(self, history: HoldemInfoSet, current_player, a):
+        next_history = history.copy()
+        amount_bet = 0
+        current_round_history = next_history.get_history()
+
+        # Calculate current bet level and this player's contribution so far this round
+        current_bet_level = 0
+        player_contribution = [0] * self.num_players
+        
+        for i, action in enumerate(current_round_history):
+                player = i % self.num_players
+                if action == 'b':
+                    if current_bet_level > 0:
+                        # Raising: call current bet + raise by 1
+                        amount_to_add = current_bet_level - player_contribution[player] + 1
+                        player_contribution[player] += amount_to_add
+                        current_bet_level += 1
+                    else:
+                        # Initial bet
+                        player_contribution[player] += 1
+                        current_bet_level = 1
+                elif action == 'p' and current_bet_level > 0:
+                    # Calling
+                    amount_to_call = current_bet_level - player_contribution[player]
+                    player_contribution[player] += amount_to_call
+            
+        # Now determine amount for current action
+        if a == 0:  # Pass (check or call)
+            if current_bet_level > 0:
+                amount_bet = current_bet_level - player_contribution[current_player]  # Call
+            else:
+                amount_bet = 0  # Check
+        elif a == 1:  # Bet or raise
+            if current_bet_level > 0:
+                # Raising: need to call current bet + add 1 more
+                current_bet_level += 1
+                amount_bet = current_bet_level - player_contribution[current_player]
+            else:
+                # Initial bet
+                current_bet_level = 1
+                amount_bet = 1
+            
+        next_history.set_history(next_history.get_history() + self.action_map[a])
+        next_history.add_to_pot(current_player, amount_bet)
+        return next_history
+
+    def key_base(self, history: HoldemInfoSet, player):
+        return get_key_codec(self.num_players).encode(history.history, [], history.round, history.pot, player)
+
+    def save_node_map(self, filename="node_map.parquet"):
+        node_io.save_node_map(self.node_map, filename, get_key_codec(self.num_players),
+                              clustering_key=getattr(self.clustering, "cache_key", None),
+                              metadata={"iteration": self.iteration})
+
+    def checkpointer(self, directory, **options):
+        return checkpoint.Checkpointer(self.node_map, directory, get_key_codec(self.num_players),
+                                       clustering_key=getattr(self.clustering, "cache_key", None),
+                                       start=self.iteration, **options)
+
+    def cfr(self, deal: hand_engine.DealEvaluation, codes, tree_node, fixed_player, reach_probs: List[float]):
+        tree = self.tree
+        node_type = tree.node_types_list[tree_node]
         # Check terminal state
-        if HoldemNode.is_terminal(history):
-            return HoldemNode.get_terminal_utility(history, cards, board, fixed_player)
+        if node_type == public_tree.TERMINAL:
+            return self.terminal_utility(tree_node, fixed_player, deal)
         
-        # Handle chance node (deal next cards)
-        if HoldemNode.is_chance_node(history):
-            history.increment_round()
-            return self.cfr(cards, flop, turn, river, history, fixed_player, reach_probs)
-        
-        # Check if current player has already folded (across all rounds)
-        all_history = ''.join(history.history)
-        player_actions = all_history[current_player::self.num_players]
-        if 'f' in player_actions:
-            # Player already folded, they auto-fold again
-            next_history = HoldemInfoSet.from_key(history.key())
-            next_history.set_history(next_history.get_history() + 'f')
-            return self.cfr(cards, flop, turn, river, next_history, fixed_player, reach_probs)
-        
-        info_set = history.key()
-        
-        if info_set not in self.node_map:
-            self.node_map[info_set] = self.create_node(info_set)
-        node: HoldemNode = self.node_map[info_set]
+        # Chance node (deal next cards), or a player who already folded and auto-folds again
+        if node_type == public_tree.CHANCE or node_type == public_tree.FOLDED:
+            return self.cfr(deal, codes, tree.next_nodes_list[tree_node], fixed_player, reach_probs)
         
+        current_player = tree.players_list[tree_node]
+        key = tree.key_bases_list[tree_node] | codes[current_player][tree.rounds_list[tree_node]]
+        node_id = self.node_map.find_or_add(key)
+        self.node_visits += 1
         
         # Get current strategy
-        strategy = node.get_strategy(reach_probs[current_player])
+        strategy = self.node_map.update_strategy(node_id, reach_probs[current_player]).tolist()
         
-        # Initialize utility arrays
+        # Recursively calculate utility for each action; nothing is expanded past the betting limit
         util = [0.0] * self.num_actions
         node_util = 0.0
-        
-        # Recursively calculate utility for each action
-        for a in range(self.num_actions):
-            if history.get_history().count('b') >= 2:  # betting limit
-                continue
-                
-            next_history = HoldemInfoSet.from_key(info_set)
-            amount_bet = 0
-            current_round_history = next_history.get_history()
-
-            # Calculate current bet level and this player's contribution so far this round
-            current_bet_level = 0
-            player_contribution = [0] * self.num_players
-            
-            for i, action in enumerate(current_round_history):
-                    player = i % self.num_players
-                    if action == 'b':
-                        if current_bet_level > 0:
-                            # Raising: call current bet + raise by 1
-                            amount_to_add = current_bet_level - player_contribution[player] + 1
-                            player_contribution[player] += amount_to_add
-                            current_bet_level += 1
-                        else:
-                            # Initial bet
-                            player_contribution[player] += 1
-                            current_bet_level = 1
-                    elif action == 'p' and current_bet_level > 0:
-                        # Calling
-                        amount_to_call = current_bet_level - player_contribution[player]
-                        player_contribution[player] += amount_to_call
-                
-            # Now determine amount for current action
-            if a == 0:  # Pass (check or call)
-                if current_bet_level > 0:
-                    amount_bet = current_bet_level - player_contribution[current_player]  # Call
-                else:
-                    amount_bet = 0  # Check
-            elif a == 1:  # Bet or raise
-                if current_bet_level > 0:
-                    # Raising: need to call current bet + add 1 more
-                    current_bet_level += 1
-                    amount_bet = current_bet_level - player_contribution[current_player]
-                else:
-                    # Initial bet
-                    current_bet_level = 1
-                    amount_bet = 1
-                
-            next_history.set_history(next_history.get_history() + self.action_map[a])
-            next_history.add_to_pot(current_player, amount_bet)
-            
+        for a, child in tree.edges_list[tree_node]:
             # Update reach probabilities
             next_reach_probs = reach_probs.copy()
             next_reach_probs[current_player] *= strategy[a]
             
-            util[a] = self.cfr(cards, flop, turn, river, next_history, 
-                             fixed_player, next_reach_probs)
+            util[a] = self.cfr(deal, codes, child, fixed_player, next_reach_probs)
             node_util += strategy[a] * util[a]
         
         # Update regrets only for the fixed player
@@ -300,51 +386,51 @@ class HoldemCFR(base.CFR):
                 if i != fixed_player:
                     cf_reach *= reach_probs[i]
             
+            regret_sum = self.node_map.regret_sum[node_id]
             for a in range(self.num_actions):
-                regret = util[a] - node_util
-                node.regret_sum[a] += cf_reach * regret
+                regret_sum[a] += cf_reach * (util[a] - node_util)
         
         return node_util
 
-
-def train(iterations, num_clusters, num_players, filename):
-    hc = evaluator.HandClustering()
-    print("Building lookup tables...")
-    hc.build_preflop_table(20000, num_clusters)
-    print("Building preflop table finished.")
-    hc.build_flop_table(20000, num_clusters)
-    print("Building flop table finished.")
-    hc.build_turn_table(20000, num_clusters)
-    print("Building turn table finished.")
-    hc.build_river_table(20000, num_clusters)
-    print("Building river table finished.")
+def train(iterations, num_clusters, num_players, filename, workers=1, merge_every=100, update_rule="vanilla",
+          checkpoint_dir="checkpoints_3", checkpoint_every=1000, checkpoint_seconds=None, keep_checkpoints=3,
+          keep_every=5000, metrics_file=None, profile_iterations=0, checkpoint_full_every=1, seed=None):
+    hc = clustering_cache.load_or_build(num_clusters)
     
     cfr = HoldemCFR(3, hc, num_players=num_players, 
-                    action_map={0: 'p', 1: 'b', 2: 'f'})
+                    action_map={0: 'p', 1: 'b', 2: 'f'}, update_rule=update_rule, seed=seed)
     print(f"Training with {num_players} players...")
-    
-    for i in range(iterations):
-        # Deal random cards
-        deck = deuces.Deck()
-        cards = [deck.draw(2) for _ in range(num_players)]
-        flop = deck.draw(3)
-        [turn, river] = deck.draw(2)
-        
-        # Run CFR for each player perspective
-        for player in range(num_players):
-            info_set = HoldemInfoSet(num_players)
-            reach_probs = [1.0] * num_players
-            cfr.cfr(cards, flop, turn, river, info_set, player, reach_probs)
-        
-        if (i + 1) % 10 == 0 or i == 0:
-            print(f"Completed {i + 1} iterations")
-
-        if(i == 2000):
-            cfr.save_node_map("3_players_2k.parquet")
-        if(i == 5000):
-            cfr.save_node_map("3_players_5k.parquet")
+    monitor = metrics.TrainingMonitor(cfr, metrics_file, profile_iterations=profile_iterations)
+    checkpointer = None
+    if checkpoint_dir is not None:
+        checkpointer = cfr.checkpointer(checkpoint_dir, prefix=f"{num_players}_players",
+                                        every_iterations=checkpoint_every, every_seconds=checkpoint_seconds,
+                                        keep_last=keep_checkpoints, keep_every=keep_every,
+                                        full_every=checkpoint_full_every)
+    parallel.run_training(cfr, iterations, workers, merge_every, monitor=monitor, checkpointer=checkpointer)
     
     print("Training completed.")
     cfr.save_node_map(filename)
 
-train(10000, 5, 3, "3_players_10k.parquet")
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train an N-player fixed-limit Hold'em CFR strategy.")
+    parser.add_argument("--iterations", type=int, default=10000)
+    parser.add_argument("--clusters", type=int, default=5)
+    parser.add_argument("--players", type=int, default=3)
+    parser.add_argument("--output", default="3_players_10k.parquet")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes")
+    parser.add_argument("--merge-every", type=int, default=100, help="Iterations per worker between merges")
+    parser.add_argument("--update-rule", choices=sorted(base.UPDATE_RULES), default="vanilla", help="Regret and average strategy update rule")
+    parser.add_argument("--checkpoint-dir", default="checkpoints_3", help="Directory of background checkpoints")
+    parser.add_argument("--checkpoint-every", type=int, default=1000, help="Iterations between checkpoints")
+    parser.add_argument("--checkpoint-seconds", type=float, default=None, help="Seconds between checkpoints")
+    parser.add_argument("--keep-checkpoints", type=int, default=3, help="Number of newest checkpoints kept")
+    parser.add_argument("--keep-every", type=int, default=5000, help="Also keep checkpoints at multiples of this iteration")
+    parser.add_argument("--checkpoint-full-every", type=int, default=1, help="Write a full checkpoint every N snapshots, deltas in between")
+    parser.add_argument("--metrics", default=None, help="Metrics file, JSON lines or .csv")
+    parser.add_argument("--profile-iterations", type=int, default=0, help="Profile this many iterations into training.prof")
+    parser.add_argument("--seed", type=int, default=None, help="Root seed of the dealing streams")
+    args = parser.parse_args()
+    train(args.iterations, args.clusters, args.players, args.output, args.workers, args.merge_every, args.update_rule,
+          args.checkpoint_dir, args.checkpoint_every, args.checkpoint_seconds, args.keep_checkpoints, args.keep_every,
+          args.metrics, args.profile_iterations, args.checkpoint_full_every, args.seed)
@@ -0,0 +1,162 @@
+import numpy as np
+
+ACTION_DIGITS = {'p': 1, 'b': 2, 'f': 3}
+DIGIT_ACTIONS = {digit: action for action, digit in ACTION_DIGITS.items()}
+NUM_ROUNDS = 4
+
+class KeyCodec:
+    """Packs a Hold'em info set into a single integer and back.
+
+    Fields, from the most to the least significant bits: the action history
+    of each of the 4 rounds (2 bits per action), one bucket per round (stored
+    as cluster + 1 so that 0 marks a round not reached yet and the all-ones
+    value marks a None cluster, i.e. a rank missing from the table), the
+    round, the pot contribution of every player and the acting player id.
+    With the default widths a 2-player key fits in 63 bits, i.e. an int64.
+    """
+    def __init__(self, num_players=2, max_actions=4, cluster_bits=5, pot_bits=4):
+        self.num_players = num_players
+        self.max_actions = max_actions
+        self.cluster_bits = cluster_bits
+        self.pot_bits = pot_bits
+        self.history_bits = 2 * max_actions
+        self.player_bits = (num_players - 1).bit_length()
+        self.bit_width = (NUM_ROUNDS * (self.history_bits + cluster_bits) + 2
+                          + num_players * pot_bits + self.player_bits)
+        self.byte_width = (self.bit_width + 7) // 8
+        self._history_codes = {}
+
+    def fits_int64(self):
+        return self.bit_width <= 63
+
+    def _history_code(self, round_history):
+        code = self._history_codes.get(round_history)
+        if code is None:
+            if len(round_history) > self.max_actions:
+                raise ValueError(f"Round history {round_history!r} longer than {self.max_actions} actions")
+            code = 0
+            for i, action in enumerate(round_history):
+                code |= ACTION_DIGITS[action] << (2 * i)
+            self._history_codes[round_history] = code
+        return code
+
+    def encode(self, history, clusters, round, pot, player_id=0):
+        code = 0
+        for round_history in history:
+            code = (code << self.history_bits) | self._history_code(round_history)
+        code = (code << (NUM_ROUNDS * self.cluster_bits)) | self._cluster_fields(clusters)
+        code = (code << 2) | round
+        pot_limit = 1 << self.pot_bits
+        for contribution in pot:
+            if not 0 <= contribution < pot_limit:
+                raise ValueError(f"Pot contribution {contribution!r} does not fit in {self.pot_bits} bits")
+            code = (code << self.pot_bits) | int(contribution)
+        return (code << self.player_bits) | player_id
+
+    def _cluster_fields(self, clusters):
+        missing = (1 << self.cluster_bits) - 1
+        code = 0
+        for i in range(NUM_ROUNDS):
+            value = 0
+            if i < len(clusters):
+                if clusters[i] is None:
+                    value = missing
+                elif 0 <= clusters[i] < missing - 1:
+                    value = int(clusters[i]) + 1
+                else:
+                    raise ValueError(f"Cluster {clusters[i]!r} does not fit in {self.cluster_bits} bits")
+            code = (code << self.cluster_bits) | value
+        return code
+
+    def cluster_code(self, clusters):
+        # encode(history, clusters, ...) == encode(history, [], ...) | cluster_code(clusters)
+        return self._cluster_fields(clusters) << (2 + self.num_players * self.pot_bits + self.player_bits)
+
+    def history_range(self, rounds):
+        # [low, high) of the keys whose first len(rounds) round histories are exactly rounds
+        code = 0
+        for round_history in rounds:
+            code = (code << self.history_bits) | self._history_code(round_history)
+        shift = self.bit_width - len(rounds) * self.history_bits
+        return code << shift, (code + 1) << shift
+
+    def round_of(self, keys):
+        # Betting round of each key of an int64 (or object) array
+        return (keys >> (self.num_players * self.pot_bits + self.player_bits)) & 3
+
+    def matches_history(self, keys, history_prefix):
+        """Mask of the keys of an array whose action history starts with
+        history_prefix, a sequence of round histories of which the last may
+        be partial: ("bb", "p") matches "bb" then "p", "pb", "pbb", ..."""
+        if not history_prefix:
+            return np.ones(len(keys), dtype=bool)
+        low, high = self.history_range(history_prefix[:-1])
+        mask = (keys >= low) & (keys < high)
+        partial = history_prefix[-1]
+        if partial:
+            # Actions are stored from the low bits of the round field up
+            shift = self.bit_width - len(history_prefix) * self.history_bits
+            field = (keys >> shift) & ((1 << (2 * len(partial))) - 1)
+            mask &= field == self._history_code(partial)
+        return mask
+
+    def encode_batch(self, history, clusters, round, pot, player_id=0):
+        """Keys of one betting state for many bucket sequences at once.
+        clusters is an (n, k) integer array with -1 for None; requires
+        fits_int64()."""
+        clusters = np.asarray(clusters, dtype=np.int64)
+        missing = (1 << self.cluster_bits) - 1
+        if clusters.size and clusters.max() >= missing - 1:
+            raise ValueError(f"Clusters do not fit in {self.cluster_bits} bits")
+        codes = np.full(len(clusters), self.encode(history, [], round, pot, player_id), dtype=np.int64)
+        low_bits = 2 + self.num_players * self.pot_bits + self.player_bits
+        for i in range(clusters.shape[1]):
+            values = np.where(clusters[:, i] < 0, missing, clusters[:, i] + 1)
+            codes |= values << (low_bits + (NUM_ROUNDS - 1 - i) * self.cluster_bits)
+        return codes
+
+    def decode(self, code):
+        # Returns (history, clusters, round, pot, player_id)
+        player_id = code & ((1 << self.player_bits) - 1)
+        code >>= self.player_bits
+        pot = []
+        for _ in range(self.num_players):
+            pot.append(code & ((1 << self.pot_bits) - 1))
+            code >>= self.pot_bits
+        pot.reverse()
+        round = code & 3
+        code >>= 2
+        clusters = []
+        for _ in range(NUM_ROUNDS):
+            clusters.append(code & ((1 << self.cluster_bits) - 1))
+            code >>= self.cluster_bits
+        missing = (1 << self.cluster_bits) - 1
+        clusters = [None if value == missing else value - 1 for value in reversed(clusters) if value]
+        history = []
+        for _ in range(NUM_ROUNDS):
+            round_code = code & ((1 << self.history_bits) - 1)
+            code >>= self.history_bits
+            actions = []
+            while round_code:
+                actions.append(DIGIT_ACTIONS[round_code & 3])
+                round_code >>= 2
+            history.append("".join(actions))
+        history.reverse()
+        return tuple(history), tuple(clusters), round, tuple(pot), player_id
+
+    def to_bytes(self, code):
+        return code.to_bytes(self.byte_width, "big")
+
+    def from_bytes(self, value):
+        return int.from_bytes(value, "big")
+
+    def encode_column(self, keys):
+        # int64 values when the key fits, fixed-width big-endian bytes otherwise
+        if self.fits_int64():
+            return list(keys)
+        return [self.to_bytes(key) for key in keys]
+
+    def decode_column(self, values):
+        if self.fits_int64():
+            return [int(value) for value in values]
+        return [self.from_bytes(value) for value in values]
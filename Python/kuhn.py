@@ -1,9 +1,11 @@
-import random
+import time
 import base
+import kuhn_exploitability
+import metrics
 
 class KuhnNode(base.Node):
-    def __init__(self, info_set, num_actions):
-        super().__init__(info_set, num_actions)
+    def __init__(self, info_set, num_actions, store=None):
+        super().__init__(info_set, num_actions, store)
         self.card_rank = {'J': 1, 'Q': 2, 'K': 3}
     def is_terminal(self, history):
         # Terminal states: pp (showdown), bp (fold), bb (call), pbp (fold), pbb (call)
@@ -24,31 +26,41 @@ class KuhnNode(base.Node):
             return 2 if self.card_rank[cards[fixed_player]] > self.card_rank[cards[1-fixed_player]] else -2
         
 class KuhnCFR(base.CFR):
-    def __init__(self, num_actions, action_map = {0: 'p', 1: 'b', 2: 'f'}):
-        super().__init__(num_actions, action_map)
+    def __init__(self, num_actions, action_map = {0: 'p', 1: 'b', 2: 'f'}, update_rule=None, seed=None):
+        super().__init__(num_actions, action_map, update_rule, seed)
     def create_node(self, info_set):
-        return KuhnNode(info_set, self.num_actions)
-        
-
-def train(iterations):
-    cards = ['J', 'Q', 'K']
-    cfr = KuhnCFR(2, action_map = {0: 'p', 1: 'b'})
-    for i in range(iterations):
+        return KuhnNode(info_set, self.num_actions, self.node_map)
+    def train_iteration(self):
         # Deal random cards
-        random.shuffle(cards)
+        start = time.perf_counter()
+        cards = ['J', 'Q', 'K']
+        self.random.shuffle(cards)
         player_cards = cards[:2]
-        
+        start = self.record_phase("deal", start)
+
         # # Run CFR for each player
-        cfr.cfr(player_cards, "", 0, 1.0, 1.0)  # For player 0
-        cfr.cfr(player_cards, "", 1, 1.0, 1.0)  # For player 1
-        if (i+1) % 10000 == 0:
-            print(f"Completed {i+1} iterations")
+        self.begin_iteration()
+        self.cfr(player_cards, "", 0, 1.0, 1.0)  # For player 0
+        self.cfr(player_cards, "", 1, 1.0, 1.0)  # For player 1
+        start = self.record_phase("traversal", start)
+        self.end_iteration()
+        self.record_phase("update", start)
+        
+
+def train(iterations, update_rule="vanilla", metrics_file=None, seed=None):
+    cfr = KuhnCFR(2, action_map = {0: 'p', 1: 'b'}, update_rule=update_rule, seed=seed)
+    monitor = metrics.TrainingMonitor(cfr, metrics_file, every=10000)
+    for i in range(iterations):
+        cfr.train_iteration()
+        monitor.step(i + 1)
+    monitor.close(iterations)
     
     # Print final strategies
     print("\nFinal strategies:")
     for key in sorted(cfr.node_map):
         strategy = cfr.node_map[key].get_average_strategy()
         print(f"{key}: {strategy}")
+    print(f"\nExploitability: {kuhn_exploitability.kuhn_nash_conv(cfr.node_map)['exploitability']:.6f}")
     print("\n=== Nash Equilibrium Analysis ===")
     
     # Player 1 strategies
@@ -1,4 +1,5 @@
 import random
+import kuhn_exploitability
 
 class Node:
     def __init__(self, info_set):
@@ -218,6 +219,8 @@ def analyze_nash_equilibrium():
     print(f"Queen after bet:    Fold: {1-p2_q_call:.4f}, Call: {p2_q_call:.4f}")
     print(f"King after bet:     Fold: {1-p2_k_call:.4f}, Call: {p2_k_call:.4f}")
     
+    print(f"\nExploitability: {kuhn_exploitability.kuhn_nash_conv(node_map)['exploitability']:.6f}")
+
     # Estimate alpha parameter
     if isinstance(p2_j_bet, float):
         alpha_estimate = p2_j_bet
@@ -0,0 +1,45 @@
+from itertools import permutations
+import numpy as np
+
+KUHN_CARDS = {'J': 1, 'Q': 2, 'K': 3}
+KUHN_DEALS = list(permutations(KUHN_CARDS, 2))
+KUHN_TERMINALS = ("pp", "bp", "bb", "pbp", "pbb")
+
+def kuhn_utility(history, cards):
+    # Utility of player 0 at a terminal history, as in kuhn.KuhnNode
+    if history in ("bp", "pbp"):
+        return 1 if history == "bp" else -1
+    stake = 1 if history == "pp" else 2
+    return stake if KUHN_CARDS[cards[0]] > KUHN_CARDS[cards[1]] else -stake
+
+def kuhn_best_response(node_map, player, history="", reach=None):
+    """Values of `player` best responding in Kuhn poker to the average
+    strategy of `node_map` (keys: card + history, as in kuhn.py and
+    kuhn3.py), per deal of KUHN_DEALS."""
+    if reach is None:
+        reach = np.full(len(KUHN_DEALS), 1.0 / len(KUHN_DEALS))
+    if history in KUHN_TERMINALS:
+        sign = 1 if player == 0 else -1
+        return sign * reach * np.array([kuhn_utility(history, cards) for cards in KUHN_DEALS])
+    current_player = len(history) % 2
+    if current_player != player:
+        strategy = np.array([node_map[cards[current_player] + history].get_average_strategy()
+                             if cards[current_player] + history in node_map else [0.5, 0.5]
+                             for cards in KUHN_DEALS])
+        return sum(kuhn_best_response(node_map, player, history + action, reach * strategy[:, a])
+                   for a, action in enumerate("pb"))
+    action_values = [kuhn_best_response(node_map, player, history + action, reach) for action in "pb"]
+    values = np.empty(len(KUHN_DEALS))
+    for card in KUHN_CARDS:
+        # The responder only knows its own card
+        deals = np.array([cards[player] == card for cards in KUHN_DEALS])
+        best = max(action_values, key=lambda v: v[deals].sum())
+        values[deals] = best[deals]
+    return values
+
+def kuhn_nash_conv(node_map):
+    """Exact distance from a Nash equilibrium of a Kuhn poker strategy:
+    NashConv, the sum of both players' best-response values (0 exactly at
+    equilibrium), and exploitability = NashConv / 2."""
+    nash_conv = kuhn_best_response(node_map, 0).sum() + kuhn_best_response(node_map, 1).sum()
+    return {"nash_conv": nash_conv, "exploitability": nash_conv / 2}
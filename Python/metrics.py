@@ -0,0 +1,136 @@
+import cProfile
+import csv
+import json
+import os
+import resource
+import time
+import numpy as np
+
+def resident_memory():
+    # Current resident set size in bytes, the peak size where /proc is missing
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def average_regret(store, iterations):
+    # Mean over info sets of the largest positive cumulative regret, per iteration
+    if store.size == 0 or iterations == 0:
+        return 0.0
+    regret_sum = store.regret_sum[:store.size]
+    return float(np.maximum(regret_sum.max(axis=1), 0.0).mean()) / iterations
+
+class TrainingMonitor:
+    """Throughput metrics of a CFR training run.
+
+    The engines keep cheap counters: cfr.node_visits (decision nodes
+    touched), cfr.pruned_visits (visits skipped by regret-based pruning),
+    cfr.phase_times (seconds per phase of train_iteration) and
+    node_map.grow_time (time spent growing the node arrays). `step(iteration)`
+    is called after every iteration; once `every` iterations have passed
+    since the last record it prints a progress line and appends a record to
+    `filename` (JSON lines, or CSV for a .csv name) with the iteration and
+    node visit rates, the share of visits pruned, node map size and growth,
+    resident memory, the share of time per phase and the average regret. Rates cover the interval since
+    the previous record.
+
+    With profile_iterations, iterations profile_start to profile_start +
+    profile_iterations - 1 run under profiler_factory(), which needs the
+    enable/disable/dump_stats interface of cProfile.Profile (the default);
+    the profile is written to profile_output.
+    """
+    def __init__(self, cfr, filename=None, every=10, start=0, profile_iterations=0, profile_start=1,
+                 profile_output="training.prof", profiler_factory=cProfile.Profile, quiet=False):
+        self.cfr = cfr
+        self.every = every
+        self.quiet = quiet
+        self.profile_iterations = profile_iterations
+        self.profile_start = profile_start
+        self.profile_output = profile_output
+        self.profiler_factory = profiler_factory
+        self.profiler = None
+        self.file = None
+        self.writer = None
+        if filename is not None:
+            self.file = open(filename, "a", newline="")
+            self.csv = filename.endswith(".csv")
+        self.start_time = time.perf_counter()
+        self.last = self._counters(start)
+        self._update_profiler(start)
+
+    def _counters(self, iteration):
+        store = self.cfr.node_map
+        phases = dict(self.cfr.phase_times)
+        phases["allocation"] = store.grow_time
+        return {"iteration": iteration, "time": time.perf_counter(), "node_visits": self.cfr.node_visits,
+                "pruned_visits": self.cfr.pruned_visits, "nodes": len(store), "phases": phases}
+
+    def step(self, iteration):
+        if iteration - self.last["iteration"] >= self.every:
+            self.record(iteration)
+        self._update_profiler(iteration)
+
+    def record(self, iteration):
+        current = self._counters(iteration)
+        elapsed = max(current["time"] - self.last["time"], 1e-12)
+        pruned = current["pruned_visits"] - self.last["pruned_visits"]
+        record = {
+            "iteration": iteration,
+            "elapsed": round(current["time"] - self.start_time, 3),
+            "iterations_per_second": (iteration - self.last["iteration"]) / elapsed,
+            "node_visits_per_second": (current["node_visits"] - self.last["node_visits"]) / elapsed,
+            "pruned_share": pruned / max(pruned + current["node_visits"] - self.last["node_visits"], 1),
+            "nodes": current["nodes"],
+            "nodes_per_second": (current["nodes"] - self.last["nodes"]) / elapsed,
+            "resident_mb": resident_memory() / 2 ** 20,
+            "average_regret": average_regret(self.cfr.node_map, self.cfr.iteration),
+        }
+        for phase, seconds in current["phases"].items():
+            record[f"{phase}_share"] = (seconds - self.last["phases"].get(phase, 0.0)) / elapsed
+        self.last = current
+        if not self.quiet:
+            print(f"Completed {iteration} iterations: {record['iterations_per_second']:,.1f} it/s, "
+                  f"{record['node_visits_per_second']:,.0f} visits/s ({record['pruned_share']:.0%} pruned), "
+                  f"{record['nodes']:,} nodes, {record['resident_mb']:,.0f} MB, "
+                  f"average regret {record['average_regret']:.5f}")
+        if self.file is not None:
+            if not self.csv:
+                self.file.write(json.dumps(record) + "\n")
+            else:
+                if self.writer is None:
+                    self.writer = csv.DictWriter(self.file, fieldnames=list(record))
+                    if self.file.tell() == 0:
+                        self.writer.writeheader()
+                self.writer.writerow(record)
+            self.file.flush()
+        return record
+
+    def _update_profiler(self, iteration):
+        if not self.profile_iterations:
+            return
+        if iteration == self.profile_start - 1:
+            self.profiler = self.profiler_factory()
+            self.profiler.enable()
+        elif self.profiler is not None and iteration == self.profile_start + self.profile_iterations - 1:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_output)
+            self.profiler = None
+
+    def close(self, iteration=None):
+        # Records the iterations since the last record, if the final iteration is given
+        if iteration is not None and iteration > self.last["iteration"]:
+            self.record(iteration)
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_output)
+            self.profiler = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,171 @@
+import os
+import pickle
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import base
+
+def key_type(codec):
+    return pa.int64() if codec.fits_int64() else pa.binary(codec.byte_width)
+
+def save_node_map(node_map, filename, codec, batch_size=16384, clustering_key=None, metadata=None):
+    """Writes a NodeStore as Parquet: a key_code column plus regret_sum and
+    strategy_sum as fixed-size lists of num_actions float64, sorted by key
+    in row groups of batch_size rows. clustering_key and the metadata dict
+    (str -> str) are stored in the file metadata."""
+    keys = list(node_map.index.keys())
+    node_ids = np.fromiter(node_map.index.values(), dtype=np.intp, count=len(keys))
+    write_node_rows(filename, keys, node_ids, node_map.regret_sum, node_map.strategy_sum, codec, batch_size,
+                    clustering_key, metadata)
+
+def write_node_rows(filename, keys, node_ids, regret_sum, strategy_sum, codec, batch_size=16384,
+                    clustering_key=None, metadata=None):
+    # Rows node_ids of the matrices, keyed by keys, in the format of save_node_map
+    num_actions = regret_sum.shape[1]
+    # Keys sort by action history first, so sorted row groups let iter_node_rows skip whole groups
+    if codec.fits_int64():
+        order = np.argsort(np.array(keys, dtype=np.int64), kind="stable")
+    else:
+        order = np.array(sorted(range(len(keys)), key=keys.__getitem__), dtype=np.intp)
+    keys = [keys[i] for i in order.tolist()]
+    node_ids = np.asarray(node_ids)[order]
+    value_type = pa.list_(pa.float64(), num_actions)
+    metadata = {key.encode(): str(value).encode() for key, value in (metadata or {}).items()}
+    if clustering_key is not None:
+        metadata[b"clustering_key"] = clustering_key.encode()
+    schema = pa.schema([("key_code", key_type(codec)),
+                        ("regret_sum", value_type),
+                        ("strategy_sum", value_type)], metadata=metadata)
+    # Keys are unique and sums rarely repeat, so dictionary encoding only costs time
+    with pq.ParquetWriter(filename, schema, use_dictionary=False) as writer:
+        for start in range(0, len(keys), batch_size):
+            batch_ids = node_ids[start:start + batch_size]
+            batch_keys = codec.encode_column(keys[start:start + batch_size])
+            columns = [pa.array(batch_keys, type=schema.field("key_code").type)]
+            for matrix in (regret_sum, strategy_sum):
+                values = pa.array(matrix[batch_ids].ravel())
+                columns.append(pa.FixedSizeListArray.from_arrays(values, num_actions))
+            writer.write_batch(pa.record_batch(columns, schema=schema))
+
+def list_column_to_matrix(column, num_actions):
+    # Fixed-size and variable-size list columns flatten to one float buffer
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    values = column.flatten().to_numpy(zero_copy_only=False)
+    return values.reshape(len(column), num_actions)
+
+def read_metadata(filename):
+    # File metadata of a node map as a str -> str dict
+    metadata = pq.read_schema(filename).metadata or {}
+    return {key.decode(): value.decode() for key, value in metadata.items()}
+
+def read_clustering_key(filename):
+    # Key of the clustering tables a node map was trained with, None if not recorded
+    return read_metadata(filename).get("clustering_key")
+
+def allow_unkeyed_maps():
+    # Set POKER_ALLOW_UNKEYED_MAPS=1 to load maps that record no clustering tables
+    return os.environ.get("POKER_ALLOW_UNKEYED_MAPS", "0") == "1"
+
+def check_clustering_key(filename, clustering_key):
+    """Raises a ValueError if filename records clustering tables other than
+    clustering_key. Maps that record none predate the key and were trained
+    on other preflop buckets: before the preflop matrix, broadway hands had
+    no preflop bucket, so their info sets in those maps are never looked up
+    again. They are refused as well unless allow_unkeyed_maps(), and then
+    load with a warning; retrain them to migrate."""
+    if clustering_key is None:
+        return
+    saved_key = read_clustering_key(filename)
+    if saved_key is None:
+        if not allow_unkeyed_maps():
+            raise ValueError(f"{filename} records no clustering tables and predates the current preflop buckets; "
+                             f"retrain it, or set POKER_ALLOW_UNKEYED_MAPS=1 to load it anyway")
+        print(f"Warning: {filename} records no clustering tables; it may predate the current preflop "
+              f"buckets and miss lookups of hands whose bucket changed")
+    elif saved_key != clustering_key:
+        raise ValueError(f"{filename} was trained with clustering tables {saved_key}, not {clustering_key}")
+
+def read_node_rows(filename, num_actions, codec, migrate_key=None):
+    """Keys, regret_sum and strategy_sum of a file written by save_node_map;
+    the matrices have one row per key."""
+    table = pq.read_table(filename)
+    if "key_code" in table.column_names:
+        column = table.column("key_code")
+        if codec.fits_int64():
+            keys = column.to_numpy().tolist()
+        else:
+            keys = codec.decode_column(column.to_pylist())
+    else:
+        keys = [migrate_key(pickle.loads(value)) for value in table.column("key").to_pylist()]
+    regret_sum = list_column_to_matrix(table.column("regret_sum"), num_actions)
+    strategy_sum = list_column_to_matrix(table.column("strategy_sum"), num_actions)
+    return keys, regret_sum, strategy_sum
+
+def iter_node_rows(filename, num_actions, codec, migrate_key=None, round=None, history_prefix=None,
+                   columns=("regret_sum", "strategy_sum"), batch_size=65536):
+    """Streams a file written by save_node_map as (keys, regret_sum,
+    strategy_sum) batches of at most batch_size rows, so memory stays flat
+    whatever the size of the map. keys is an int64 array (object for codecs
+    wider than int64) and the matrices have one row per key; fields left out
+    of columns come back as None.
+
+    round keeps the info sets of one betting round and history_prefix those
+    whose action history starts with it (see KeyCodec.matches_history).
+    Row groups whose key_code range cannot match history_prefix are skipped
+    without being read. Files with pickled keys are read through migrate_key
+    and filtered row by row."""
+    parquet = pq.ParquetFile(filename)
+    packed = "key_code" in parquet.schema_arrow.names
+    row_groups = list(range(parquet.num_row_groups))
+    if packed and history_prefix:
+        low, high = codec.history_range(history_prefix[:-1])
+        row_groups = [i for i in row_groups if _key_range_overlaps(parquet.metadata.row_group(i), codec, low, high)]
+    columns = list(columns)
+    for batch in parquet.iter_batches(batch_size, row_groups=row_groups,
+                                      columns=["key_code" if packed else "key"] + columns):
+        column = batch.column(0)
+        if not packed:
+            keys = [migrate_key(pickle.loads(value)) for value in column.to_pylist()]
+            keys = np.array(keys, dtype=np.int64 if codec.fits_int64() else object)
+        elif codec.fits_int64():
+            keys = column.to_numpy()
+        else:
+            keys = np.array(codec.decode_column(column.to_pylist()), dtype=object)
+        mask = None
+        if round is not None:
+            mask = codec.round_of(keys) == round
+        if history_prefix:
+            matches = codec.matches_history(keys, history_prefix)
+            mask = matches if mask is None else mask & matches
+        fields = {name: list_column_to_matrix(batch.column(i + 1), num_actions) for i, name in enumerate(columns)}
+        if mask is not None:
+            if not mask.any():
+                continue
+            keys = keys[mask]
+            fields = {name: matrix[mask] for name, matrix in fields.items()}
+        yield keys, fields.get("regret_sum"), fields.get("strategy_sum")
+
+def _key_range_overlaps(row_group, codec, low, high):
+    # False only when the row group's key_code statistics lie outside [low, high)
+    for i in range(row_group.num_columns):
+        column = row_group.column(i)
+        if column.path_in_schema == "key_code":
+            statistics = column.statistics
+            if statistics is None or not statistics.has_min_max:
+                return True
+            smallest, largest = statistics.min, statistics.max
+            if not codec.fits_int64():
+                smallest, largest = codec.from_bytes(smallest), codec.from_bytes(largest)
+            return smallest < high and largest >= low
+    return True
+
+def load_node_map(filename, num_actions, codec, node_factory, migrate_key=None, clustering_key=None):
+    """Reads a node map saved by save_node_map into a NodeStore without
+    building a node per row. Files with a pickled "key" column (the format
+    before packed keys) are read through migrate_key(tuple_key) -> code.
+
+    If clustering_key is given it is checked with check_clustering_key."""
+    check_clustering_key(filename, clustering_key)
+    keys, regret_sum, strategy_sum = read_node_rows(filename, num_actions, codec, migrate_key)
+    return base.NodeStore.from_arrays(num_actions, keys, regret_sum, strategy_sum, node_factory)
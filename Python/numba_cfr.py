@@ -0,0 +1,126 @@
+import numpy as np
+import public_tree
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+AVAILABLE = numba is not None
+
+def _jit(function):
+    # Compiled when Numba is installed (HoldemCFR only calls the kernels then), on first call in each
+    # process: loading a cached recursive function crashes Numba
+    return numba.njit(function) if AVAILABLE else function
+
+@_jit
+def chance_cfr(node, fixed_player, p0, p1, node_types, players, children, next_nodes, pots, folded,
+               subtree_decisions, node_ids, scores, regret_sum, strategy, strategy_sum, strategy_weight, prune,
+               prune_threshold, counters):
+    # holdem.HoldemCFR.cfr over the flat tree arrays; node_ids[i] is the store row of decision node i
+    # for this deal and counters holds node_visits, pruned_branches and pruned_visits
+    node_type = node_types[node]
+    if node_type == public_tree.TERMINAL:
+        if folded[node] != 0:
+            won = ((folded[node] >> fixed_player) & 1) == 0
+        else:
+            # Ties go to fixed_player
+            won = scores[fixed_player] <= scores[1 - fixed_player]
+        if won:
+            return float(pots[node, 1 - fixed_player])
+        return -float(pots[node, fixed_player])
+    if node_type == public_tree.CHANCE:
+        return chance_cfr(next_nodes[node], fixed_player, p0, p1, node_types, players, children, next_nodes, pots,
+                          folded, subtree_decisions, node_ids, scores, regret_sum, strategy, strategy_sum,
+                          strategy_weight, prune, prune_threshold, counters)
+
+    current_player = players[node]
+    row = node_ids[node]
+    counters[0] += 1
+    num_actions = regret_sum.shape[1]
+    # NodeStore.update_strategy
+    realization_weight = p0 if current_player == 1 else p1
+    normalizing_sum = 0.0
+    for a in range(num_actions):
+        normalizing_sum += max(regret_sum[row, a], 0.0)
+    sigma = np.empty(num_actions)
+    for a in range(num_actions):
+        if normalizing_sum > 0:
+            sigma[a] = max(regret_sum[row, a], 0.0) / normalizing_sum
+        else:
+            sigma[a] = 1.0 / num_actions
+        strategy[row, a] = sigma[a]
+        strategy_sum[row, a] += (strategy_weight * realization_weight) * sigma[a]
+
+    util = np.zeros(num_actions)
+    pruned = np.zeros(num_actions, dtype=np.bool_)
+    node_util = 0.0
+    for a in range(num_actions):
+        child = children[node, a]
+        if child < 0:
+            continue
+        if prune and current_player == fixed_player and sigma[a] == 0.0 and regret_sum[row, a] < prune_threshold:
+            pruned[a] = True
+            counters[1] += 1
+            counters[2] += subtree_decisions[child]
+            continue
+        if current_player == 0:
+            util[a] = chance_cfr(child, fixed_player, p0 * sigma[a], p1, node_types, players, children, next_nodes,
+                                 pots, folded, subtree_decisions, node_ids, scores, regret_sum, strategy, strategy_sum,
+                                 strategy_weight, prune, prune_threshold, counters)
+        else:
+            util[a] = chance_cfr(child, fixed_player, p0, p1 * sigma[a], node_types, players, children, next_nodes,
+                                 pots, folded, subtree_decisions, node_ids, scores, regret_sum, strategy, strategy_sum,
+                                 strategy_weight, prune, prune_threshold, counters)
+        node_util += sigma[a] * util[a]
+
+    if current_player == fixed_player:
+        opponent_prob = p1 if fixed_player == 0 else p0
+        for a in range(num_actions):
+            if not pruned[a]:
+                regret_sum[row, a] += opponent_prob * (util[a] - node_util)
+    return node_util
+
+class TreeKernel:
+    """Compiled chance-sampled CFR over a 2-player public_tree.PublicTree.
+
+    The tree is copied into contiguous arrays once. Per deal, `resolve`
+    looks up the store rows of every decision node in Python (the info-set
+    keys need the node map's dict), so the compiled traversal only touches
+    NumPy arrays. Unlike the Python traversal, every info set of the deal
+    gets a row, pruned subtrees included.
+    """
+    def __init__(self, tree):
+        self.node_types = np.ascontiguousarray(tree.node_types)
+        self.players = np.ascontiguousarray(tree.players)
+        self.children = np.ascontiguousarray(tree.children)
+        self.next_nodes = np.ascontiguousarray(tree.next_nodes)
+        self.pots = np.ascontiguousarray(tree.pots)
+        self.folded = np.ascontiguousarray(tree.folded)
+        self.subtree_decisions = np.ascontiguousarray(tree.subtree_decisions)
+        self.decisions = tree.decision_nodes()
+        self.decision_key_bases = tree.key_bases[self.decisions].astype(np.int64)
+        self.decision_players = tree.players[self.decisions].astype(np.intp)
+        self.decision_rounds = tree.rounds[self.decisions].astype(np.intp)
+        self.node_ids = np.full(len(tree), -1, dtype=np.int64)
+
+    def resolve(self, store, codes):
+        # Store rows of the info sets of every decision node, codes as from HoldemCFR.cluster_codes
+        keys = self.decision_key_bases | np.array(codes, dtype=np.int64)[self.decision_players, self.decision_rounds]
+        node_ids = self.node_ids.copy()
+        node_ids[self.decisions] = [store.find_or_add(key) for key in keys.tolist()]
+        return node_ids
+
+    def cfr(self, cfr, node_ids, scores, fixed_player):
+        # One traversal for fixed_player, updating cfr.node_map and cfr's work counters
+        store = cfr.node_map
+        counters = np.zeros(3, dtype=np.int64)
+        prune_threshold = cfr.prune_threshold if cfr.prune_threshold is not None else 0.0
+        util = chance_cfr(0, fixed_player, 1.0, 1.0, self.node_types, self.players, self.children, self.next_nodes,
+                          self.pots, self.folded, self.subtree_decisions, node_ids, scores, store.regret_sum,
+                          store.strategy, store.strategy_sum, store.strategy_weight, cfr.pruning, prune_threshold,
+                          counters)
+        cfr.node_visits += int(counters[0])
+        cfr.pruned_branches += int(counters[1])
+        cfr.pruned_visits += int(counters[2])
+        return util
@@ -0,0 +1,120 @@
+import multiprocessing
+
+def _worker_loop(conn, cfr, worker_id, workers):
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        iterations, others, block = message
+        # Each worker deals its own hands from the stream of (iteration block, worker)
+        cfr.reseed(block, worker_id)
+        # Bring the local node map up to date with the other workers' deltas
+        for keys, regret_delta, strategy_delta in others:
+            cfr.node_map.merge(keys, regret_delta, strategy_delta, cfr.create_node)
+        snapshot = cfr.node_map.snapshot()
+        counters = [getattr(cfr, name) for name in cfr.COUNTERS]
+        phase_times = dict(cfr.phase_times)
+        # The round's iterations block + 1 .. block + batch are dealt out to the workers in turn, so
+        # pruning and its revisits follow the global iteration count
+        cfr.iteration = block + worker_id
+        for _ in range(iterations):
+            cfr.train_iteration()
+            cfr.iteration += workers - 1
+        counters = [getattr(cfr, name) - before for name, before in zip(cfr.COUNTERS, counters)]
+        phase_times = {phase: cfr.phase_times[phase] - before for phase, before in phase_times.items()}
+        conn.send((cfr.node_map.delta_since(snapshot), counters, phase_times))
+    conn.close()
+
+def train_parallel(cfr, iterations, workers, merge_every=100, callback=None):
+    """Run `iterations` training iterations of `cfr` on a pool of worker processes.
+
+    Every worker starts from a copy of the master node map and runs
+    `merge_every` independent deals through `cfr.train_iteration()`. The
+    regret_sum/strategy_sum deltas of all workers are then merged into the
+    master node map and forwarded to the other workers before the next round,
+    and the workers' work counters (cfr.COUNTERS) and phase times are added
+    to the master's. Worker w runs iterations i + w + 1, i + w + 1 +
+    workers, ... of a round starting at iteration i, and cfr.iteration is
+    i + batch after it.
+    `callback(previous, completed)` is called after each merge.
+
+    A round starting at iteration i deals from the stream (i, worker_id) of
+    cfr.streams, so runs with the same seed, workers and merge_every repeat.
+    """
+    if cfr.update_rule.name != "vanilla" or cfr.update_rule.averaging_power:
+        # Workers count iterations independently, so discounting and weighted
+        # averaging would be applied once per worker instead of once per round
+        raise ValueError("Parallel training only supports vanilla CFR updates")
+    connections = []
+    processes = []
+    for worker_id in range(workers):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=_worker_loop, args=(child_conn, cfr, worker_id, workers),
+                                          daemon=True)
+        process.start()
+        child_conn.close()
+        connections.append(parent_conn)
+        processes.append(process)
+
+    deltas = [None] * workers
+    first_iteration = cfr.iteration
+    completed = 0
+    try:
+        while completed < iterations:
+            batch = min(merge_every * workers, iterations - completed)
+            for worker_id, conn in enumerate(connections):
+                count = batch // workers + (1 if worker_id < batch % workers else 0)
+                others = [delta for other_id, delta in enumerate(deltas) if other_id != worker_id and delta is not None]
+                conn.send((count, others, first_iteration + completed))
+            results = [conn.recv() for conn in connections]
+            deltas = [delta for delta, _, _ in results]
+            for keys, regret_delta, strategy_delta in deltas:
+                cfr.node_map.merge(keys, regret_delta, strategy_delta, cfr.create_node)
+            for i, name in enumerate(cfr.COUNTERS):
+                setattr(cfr, name, getattr(cfr, name) + sum(counters[i] for _, counters, _ in results))
+            for phase in cfr.phase_times:
+                cfr.phase_times[phase] += sum(phase_times[phase] for _, _, phase_times in results)
+            previous = completed
+            completed += batch
+            cfr.iteration = first_iteration + completed
+            if callback is not None:
+                callback(previous, completed)
+    finally:
+        for conn in connections:
+            conn.send(None)
+            conn.close()
+        for process in processes:
+            process.join()
+    return cfr
+
+def run_training(cfr, iterations, workers=1, merge_every=100, start=0, monitor=None, checkpointer=None):
+    """Trains `iterations` more iterations of cfr after `start` completed ones,
+    on `workers` processes when workers > 1. After every iteration (every
+    merge when parallel) the metrics.TrainingMonitor records progress and the
+    checkpoint.Checkpointer saves a snapshot if one is due; both see the
+    total iteration count and are closed at the end.
+
+    Every block of merge_every iterations deals from its own stream of
+    cfr.streams, keyed by the block's first iteration, so a run resumed at
+    a block boundary deals the same hands as an uninterrupted one."""
+    def progress(previous, completed):
+        if workers > 1:
+            # Workers count their own iterations, the master only merges
+            cfr.iteration = start + completed
+        if monitor is not None:
+            monitor.step(start + completed)
+        if checkpointer is not None:
+            checkpointer.maybe_save(start + completed)
+    if workers > 1:
+        train_parallel(cfr, iterations, workers, merge_every, progress)
+    else:
+        for i in range(iterations):
+            if i % merge_every == 0:
+                cfr.reseed(start + i)
+            cfr.train_iteration()
+            progress(i, i + 1)
+    if monitor is not None:
+        monitor.close(start + iterations)
+    if checkpointer is not None:
+        checkpointer.close()
+    return cfr
@@ -0,0 +1,289 @@
+import multiprocessing
+import os
+from itertools import combinations
+import numpy as np
+import pandas as pd
+from deuces import Card
+import equity
+import evaluator
+import hand_engine
+import hand_index
+
+CANONICAL_BOARD_COUNTS = {3: 1755, 4: 16432, 5: 134459}
+# deuces card int of every card index (4 * rank + suit, suits in deuces bit order)
+CARD_INTS = np.array([Card.new(Card.STR_RANKS[c // 4] + "shdc"[c % 4]) for c in range(52)], dtype=np.int64)
+# Flop and turn buckets are keyed by the suit-isomorphic index of (hole cards, board)
+STREET_INDEXERS = {3: hand_index.HandIndexer((2, 3)), 4: hand_index.HandIndexer((2, 4))}
+RIVER_BINS = 100
+
+def sample_boards(size, num_boards, rng):
+    """Boards of `size` cards with their weights: every suit-canonical board
+    weighted by its class size when num_boards covers them all, else
+    num_boards uniformly random boards weighted 1 (the same distribution,
+    without enumerating the classes)."""
+    if num_boards is None or num_boards >= CANONICAL_BOARD_COUNTS[size]:
+        return equity.canonical_boards(size)
+    boards = np.argsort(rng.random((num_boards, 52)), axis=1)[:, :size]
+    return boards, np.ones(num_boards)
+
+def board_histograms(board, num_bins, fast_evaluator):
+    """Rank of every hand on `board` and the histogram of its river hand
+    strength over all completions of the board (shape (1326, num_bins))."""
+    board = list(board)
+    remaining = [c for c in range(52) if c not in board]
+    completions = np.array([board + list(extra) for extra in combinations(remaining, 5 - len(board))])
+    strengths = equity.hand_strengths(completions, fast_evaluator)
+    bins = np.minimum((np.nan_to_num(strengths) * num_bins).astype(np.int64), num_bins - 1)
+    hands = np.broadcast_to(np.arange(strengths.shape[1]), strengths.shape)
+    counts = np.bincount((hands * num_bins + bins).ravel(), weights=~np.isnan(strengths).ravel(),
+                         minlength=strengths.shape[1] * num_bins).reshape(-1, num_bins)
+    totals = counts.sum(axis=1, keepdims=True)
+    histograms = np.divide(counts, totals, out=np.zeros_like(counts), where=totals > 0)
+    ranks = equity.rank_all_combos(np.array([board]), fast_evaluator)[0]
+    return ranks, histograms
+
+def board_hands(board, valid):
+    # (n, 2 + len(board)) deuces ints of the valid hands of equity.COMBOS followed by board
+    cards = np.hstack([equity.COMBOS[valid], np.broadcast_to(board, (valid.sum(), len(board)))])
+    return CARD_INTS[cards]
+
+def _histogram_chunk(args):
+    # Canonical index, histogram and weight of every hand on every board of the chunk
+    boards, weights, num_bins = args
+    fast_evaluator = hand_engine.FastEvaluator()
+    indexer = STREET_INDEXERS[boards.shape[1]]
+    indices, histograms, hand_weights = [], [], []
+    for board, weight in zip(boards, weights):
+        ranks, board_histogram = board_histograms(board, num_bins, fast_evaluator)
+        valid = ranks > 0
+        indices.append(indexer.index_batch(board_hands(board, valid)))
+        histograms.append(board_histogram[valid].astype(np.float32))
+        hand_weights.append(np.full(valid.sum(), float(weight)))
+    return np.concatenate(indices), np.concatenate(histograms), np.concatenate(hand_weights)
+
+def _assign_chunk(args):
+    # Canonical index and nearest centroid of every hand on every board of the chunk
+    boards, num_bins, centroids = args
+    fast_evaluator = hand_engine.FastEvaluator()
+    indexer = STREET_INDEXERS[boards.shape[1]]
+    indices, clusters = [], []
+    for board in boards:
+        ranks, histograms = board_histograms(board, num_bins, fast_evaluator)
+        valid = ranks > 0
+        indices.append(indexer.index_batch(board_hands(board, valid)))
+        clusters.append(emd(np.cumsum(histograms[valid], axis=1), centroids).argmin(axis=1))
+    return np.concatenate(indices), np.concatenate(clusters)
+
+def _river_chunk(args):
+    # Total weight of the river hand strengths in each of RIVER_BINS bins
+    boards, weights = args
+    strengths = equity.hand_strengths(boards, hand_engine.FastEvaluator())
+    valid = ~np.isnan(strengths)
+    bins = np.minimum((strengths[valid] * RIVER_BINS).astype(np.int64), RIVER_BINS - 1)
+    return np.bincount(bins, weights=np.broadcast_to(weights[:, None], strengths.shape)[valid], minlength=RIVER_BINS)
+
+def hand_strength_batch(hands, boards, fast_evaluator=None):
+    """River hand strength, as in equity.hand_strengths, of each hand of an
+    (n, 2) array of deuces ints on the 5-card board of the same row."""
+    hands = evaluator.card_indices(hands)
+    boards = evaluator.card_indices(boards)
+    ranks = equity.rank_all_combos(boards, fast_evaluator).astype(np.int64)
+    rows = np.arange(len(hands))
+    own = ranks[rows, equity.COMBO_INDEX[hands[:, 0], hands[:, 1]]]
+    # Opponent hands share no card with the board (rank 0) nor with the hand
+    valid = ranks > 0
+    for column in (0, 1):
+        valid[rows[:, None], equity.CARD_COMBOS[hands[:, column]]] = False
+    worse = ((ranks > own[:, None]) & valid).sum(axis=1)
+    equal = ((ranks == own[:, None]) & valid).sum(axis=1)
+    return (worse + 0.5 * equal) / 990
+
+def cluster_centroids(histograms, weights, assignment, num_clusters):
+    # Weighted mean CDF of the members of every cluster, for assigning more histograms with emd
+    cdfs = np.cumsum(histograms, axis=1)
+    centroids = np.ones((num_clusters, histograms.shape[1]))
+    for k in range(num_clusters):
+        members = assignment == k
+        if weights[members].sum() > 0:
+            centroids[k] = np.average(cdfs[members], axis=0, weights=weights[members])
+    return centroids
+
+def emd(cdfs, centroids):
+    # Earth mover's distance between 1-D histograms is the L1 distance of their CDFs
+    return np.abs(cdfs[:, None, :] - centroids[None, :, :]).sum(axis=2)
+
+def emd_kmeans(histograms, weights, num_clusters, rng, max_iterations=100):
+    """Weighted k-means of histograms under EMD (k-means++ seeding, mean CDF
+    centroids). Returns the cluster of each histogram, numbered by
+    decreasing mean value so that cluster 0 holds the strongest hands."""
+    cdfs = np.cumsum(histograms, axis=1)
+    p = weights / weights.sum()
+    centroids = [cdfs[rng.choice(len(cdfs), p=p)]]
+    for _ in range(1, num_clusters):
+        distance = emd(cdfs, np.array(centroids)).min(axis=1) * weights
+        if distance.sum() == 0:
+            centroids.append(cdfs[rng.choice(len(cdfs), p=p)])
+        else:
+            centroids.append(cdfs[rng.choice(len(cdfs), p=distance / distance.sum())])
+    centroids = np.array(centroids)
+    assignment = None
+    for _ in range(max_iterations):
+        distances = emd(cdfs, centroids)
+        new_assignment = distances.argmin(axis=1)
+        if assignment is not None and (new_assignment == assignment).all():
+            break
+        assignment = new_assignment
+        for k in range(num_clusters):
+            members = assignment == k
+            if weights[members].sum() > 0:
+                centroids[k] = np.average(cdfs[members], axis=0, weights=weights[members])
+            else:
+                # Re-seed an empty cluster at the point furthest from its centroid
+                centroids[k] = cdfs[distances.min(axis=1).argmax()]
+    centers = (np.arange(histograms.shape[1]) + 0.5) / histograms.shape[1]
+    mean_values = np.array([np.average(histograms[assignment == k] @ centers, weights=weights[assignment == k])
+                            if weights[assignment == k].sum() > 0 else -1.0 for k in range(num_clusters)])
+    order = np.empty(num_clusters, dtype=np.int64)
+    order[np.argsort(-mean_values)] = np.arange(num_clusters)
+    return order[assignment]
+
+def point_histograms(values, num_bins=100):
+    values = np.asarray(values)
+    histograms = np.zeros((len(values), num_bins))
+    histograms[np.arange(len(values)), np.minimum((values * num_bins).astype(np.int64), num_bins - 1)] = 1.0
+    return histograms
+
+class PotentialClustering(evaluator.HandClustering):
+    """Potential-aware buckets keyed by the canonical (hole cards, board).
+
+    Flop and turn buckets are tables indexed by hand_index.HandIndexer
+    (rounds (2, 3) and (2, 4)), so two hands share a bucket only if their
+    river equity distributions are alike: a high card with a flush draw and
+    the same high card without one are told apart. The equity histogram of
+    every hand on a board is its river hand strength over all completions.
+    Hands from a sample of suit-canonical boards are clustered with EMD
+    k-means, then every hand of every canonical board is assigned to the
+    nearest centroid (unless complete is False, which leaves the other
+    indices without a bucket, for quick builds).
+
+    A river table indexed by hand would have 123,156,254 entries, so river
+    buckets are a table over the river hand strength on the board, which is
+    all that is left of the potential. Preflop buckets cluster the exact
+    all-in equities of the 169 classes.
+
+    The rank tables of HandClustering stay empty: look buckets up with
+    get_street_cluster(s), which DealEvaluation and BoardEvaluation use.
+    """
+    def __init__(self, num_bins=20, workers=1, seed=0, max_histograms=200000, complete=True):
+        super().__init__()
+        self.num_bins = num_bins
+        self.workers = workers
+        self.rng = np.random.default_rng(seed)
+        self.max_histograms = max_histograms
+        self.complete = complete
+        self.flop_index_map = np.full(STREET_INDEXERS[3].size(1), -1, dtype=np.int8)
+        self.turn_index_map = np.full(STREET_INDEXERS[4].size(1), -1, dtype=np.int8)
+        self.river_strength_map = np.full(RIVER_BINS, -1, dtype=np.int8)
+        self.fast_evaluator = hand_engine.FastEvaluator()
+
+    def _map(self, function, chunks):
+        if self.workers > 1:
+            with multiprocessing.Pool(self.workers) as pool:
+                return pool.map(function, chunks)
+        return [function(chunk) for chunk in chunks]
+
+    def _chunks(self, count):
+        size = max(1, min(256, count // (4 * self.workers)))
+        return [slice(i, i + size) for i in range(0, count, size)]
+
+    def build_preflop_table(self, num_simulations, num_clusters, exact=True):
+        equities = equity.preflop_equities(exact, num_simulations)
+        classes = list(equities)
+        combos = np.array([6 if r1 == r2 else 4 if suited == 's' else 12 for r1, r2, suited in classes])
+        clusters = emd_kmeans(point_histograms([equities[c] for c in classes]), combos, num_clusters, self.rng)
+        self.set_preflop_map({c: int(cluster) for c, cluster in zip(classes, clusters)})
+
+    def build_street_table(self, table, board_size, num_boards, num_clusters):
+        """Clusters the hands of up to num_boards canonical boards (fewer if
+        they hold over max_histograms hands), then assigns the hands of the
+        other canonical boards to the nearest centroid."""
+        boards, weights = equity.canonical_boards(board_size)
+        order = self.rng.permutation(len(boards))
+        num_sampled = min(len(boards), self.max_histograms // 1176 or 1)
+        if num_boards is not None:
+            num_sampled = min(num_sampled, num_boards)
+        sampled, rest = boards[order[:num_sampled]], boards[order[num_sampled:]]
+        sampled_weights = weights[order[:num_sampled]]
+        results = self._map(_histogram_chunk, [(sampled[chunk], sampled_weights[chunk], self.num_bins)
+                                               for chunk in self._chunks(len(sampled))])
+        indices = np.concatenate([r[0] for r in results])
+        histograms = np.concatenate([r[1] for r in results]).astype(np.float64)
+        hand_weights = np.concatenate([r[2] for r in results])
+        # Hands isomorphic on a board share an index and a histogram
+        indices, first, inverse = np.unique(indices, return_index=True, return_inverse=True)
+        histograms = histograms[first]
+        hand_weights = np.bincount(inverse.ravel(), weights=hand_weights)
+        clusters = emd_kmeans(histograms, hand_weights, num_clusters, self.rng)
+        table[indices] = clusters
+        if self.complete and len(rest):
+            centroids = cluster_centroids(histograms, hand_weights, clusters, num_clusters)
+            for indices, clusters in self._map(_assign_chunk, [(rest[chunk], self.num_bins, centroids)
+                                                               for chunk in self._chunks(len(rest))]):
+                table[indices] = clusters
+
+    def build_flop_table(self, num_boards, num_clusters):
+        self.build_street_table(self.flop_index_map, 3, num_boards, num_clusters)
+
+    def build_turn_table(self, num_boards, num_clusters):
+        self.build_street_table(self.turn_index_map, 4, num_boards, num_clusters)
+
+    def build_river_table(self, num_boards, num_clusters):
+        boards, weights = sample_boards(5, num_boards, self.rng)
+        bin_weights = sum(self._map(_river_chunk, [(boards[chunk], weights[chunk])
+                                                   for chunk in self._chunks(len(boards))]))
+        observed = np.flatnonzero(bin_weights > 0)
+        centers = (observed + 0.5) / RIVER_BINS
+        self.river_strength_map[observed] = emd_kmeans(point_histograms(centers, RIVER_BINS), bin_weights[observed],
+                                                       num_clusters, self.rng)
+        # Strengths not seen on any sampled board take the bucket of the nearest seen one
+        nearest = observed[np.abs(np.arange(RIVER_BINS)[:, None] - observed[None, :]).argmin(axis=1)]
+        self.river_strength_map[:] = self.river_strength_map[nearest]
+
+    def river_clusters(self, hands, boards, chunk_size=4096):
+        # Chunked, as hand_strength_batch ranks all 1326 hands on every row
+        strengths = np.concatenate([hand_strength_batch(hands[i:i + chunk_size], boards[i:i + chunk_size],
+                                                        self.fast_evaluator)
+                                    for i in range(0, len(hands), chunk_size)] or [np.empty(0)])
+        return self.river_strength_map[np.minimum((strengths * RIVER_BINS).astype(np.int64), RIVER_BINS - 1)]
+
+    def get_street_cluster(self, round, hand, board, evaluation):
+        if round == 3:
+            return self._cluster(int(self.river_clusters(np.array([hand]), np.array([board]))[0]))
+        table = self.flop_index_map if round == 1 else self.turn_index_map
+        return self._cluster(table.item(STREET_INDEXERS[len(board)].index(list(hand) + list(board))))
+
+    def get_street_clusters(self, round, hands, boards, evaluations):
+        hands = np.asarray(hands, dtype=np.int64)
+        boards = np.asarray(boards, dtype=np.int64)
+        if round == 3:
+            return self.river_clusters(hands, boards).astype(np.int16)
+        table = self.flop_index_map if round == 1 else self.turn_index_map
+        return table[STREET_INDEXERS[boards.shape[1]].index_batch(np.hstack([hands, boards]))].astype(np.int16)
+
+    def save_tables(self, directory="clustering_tables"):
+        super().save_tables(directory)
+        for name in ("flop_index_map", "turn_index_map", "river_strength_map"):
+            table = getattr(self, name)
+            pd.DataFrame({'cluster': table}).to_parquet(os.path.join(directory, f'{name}.parquet'), index=False)
+            print(f"Saved {name} with {(table >= 0).sum()} entries")
+
+    def load_tables(self, directory="clustering_tables", verbose=True):
+        super().load_tables(directory, verbose)
+        for name in ("flop_index_map", "turn_index_map", "river_strength_map"):
+            path = os.path.join(directory, f'{name}.parquet')
+            if os.path.exists(path):
+                setattr(self, name, pd.read_parquet(path)['cluster'].to_numpy().astype(np.int8))
+                if verbose:
+                    print(f"Loaded {name}")
+            elif verbose:
+                print(f"Warning: {path} not found")
@@ -0,0 +1,114 @@
+import numpy as np
+
+DECISION, CHANCE, TERMINAL, FOLDED = range(4)
+
+class PublicTree:
+    """Betting tree of a Hold'em engine, enumerated once into flat arrays.
+
+    The betting structure does not depend on the cards, so the tree is built
+    by running the engine's own rules (is_terminal, is_chance_node,
+    legal_actions, next_info_set, ...) from the root once; traversals then
+    follow integer node ids. For node i:
+
+    - node_types[i]: DECISION, CHANCE (the round ends), TERMINAL, or FOLDED
+      (an N-player seat that already folded and passes automatically)
+    - players[i]: the seat to act, -1 at chance and terminal nodes
+    - rounds[i], pots[i] (contribution of every seat) and folded[i] (bit
+      mask of the seats that folded)
+    - key_bases[i]: the info-set key without clusters; the key of the
+      acting seat is key_bases[i] | codec.cluster_code(its clusters)
+    - children[i, a]: the node after action a, -1 where a is not expanded
+    - next_nodes[i]: the node after a chance or FOLDED node, else -1
+    - subtree_decisions[i]: the number of DECISION nodes in the subtree of
+      i, itself included, i.e. the visits a full walk from i makes
+    - sampled_decisions[p][i]: the expected visits of an external sampling
+      walk from i for traverser p, with opponents sampling uniformly
+
+    The `*_list` attributes hold the same data as Python lists, which are
+    faster than NumPy scalars in per-node recursion; edges_list[i] lists
+    the (action, child) pairs of node i.
+    """
+    def __init__(self, game, root, num_actions, num_players):
+        self.num_actions = num_actions
+        self.num_players = num_players
+        node_types, players, rounds, pots, folded, key_bases, children, next_nodes = [], [], [], [], [], [], [], []
+        self.histories = []
+        stack = [(root, None, None)]
+        while stack:
+            history, parent, action = stack.pop()
+            node_id = len(node_types)
+            if parent is not None:
+                if action is None:
+                    next_nodes[parent] = node_id
+                else:
+                    children[parent][action] = node_id
+            player = game.current_player(history)
+            node_children = [-1] * num_actions
+            if game.is_terminal(history):
+                node_type, player = TERMINAL, -1
+            elif game.is_chance_node(history):
+                node_type, player = CHANCE, -1
+                stack.append((game.next_round(history), node_id, None))
+            elif game.has_folded(history, player):
+                node_type = FOLDED
+                stack.append((game.auto_fold(history, player), node_id, None))
+            else:
+                node_type = DECISION
+                for a in reversed(game.legal_actions(history)):
+                    stack.append((game.next_info_set(history, player, a), node_id, a))
+            node_types.append(node_type)
+            players.append(player)
+            rounds.append(history.round)
+            pots.append(list(history.pot))
+            folded.append(sum(1 << p for p in range(num_players) if game.has_folded(history, p)))
+            key_bases.append(game.key_base(history, player) if node_type == DECISION else 0)
+            children.append(node_children)
+            next_nodes.append(-1)
+            self.histories.append(history)
+        self.node_types = np.array(node_types, dtype=np.int8)
+        self.players = np.array(players, dtype=np.int8)
+        self.rounds = np.array(rounds, dtype=np.int8)
+        self.pots = np.array(pots, dtype=np.int16)
+        self.folded = np.array(folded, dtype=np.int16)
+        # Keys of wide codecs (KeyCodec.fits_int64() is False) stay Python ints
+        self.key_bases = np.array(key_bases, dtype=np.int64 if max(key_bases).bit_length() < 64 else object)
+        self.children = np.array(children, dtype=np.int32)
+        self.next_nodes = np.array(next_nodes, dtype=np.int32)
+        # Children always get larger ids than their parent, so one backward pass sums the subtrees
+        subtree_decisions = [int(node_type == DECISION) for node_type in node_types]
+        for node_id in range(len(node_types) - 1, -1, -1):
+            for child in children[node_id] + [next_nodes[node_id]]:
+                if child >= 0:
+                    subtree_decisions[node_id] += subtree_decisions[child]
+        self.subtree_decisions = np.array(subtree_decisions, dtype=np.int64)
+        sampled_decisions = []
+        for traverser in range(num_players):
+            sampled = [0.0] * len(node_types)
+            for node_id in range(len(node_types) - 1, -1, -1):
+                if next_nodes[node_id] >= 0:
+                    sampled[node_id] = sampled[next_nodes[node_id]]
+                elif node_types[node_id] == DECISION:
+                    below = [sampled[child] for child in children[node_id] if child >= 0]
+                    if below:
+                        sampled[node_id] = 1 + (sum(below) if players[node_id] == traverser else sum(below) / len(below))
+            sampled_decisions.append(sampled)
+        self.sampled_decisions = np.array(sampled_decisions)
+        self.node_types_list = node_types
+        self.players_list = players
+        self.rounds_list = rounds
+        self.pots_list = pots
+        self.folded_list = folded
+        self.key_bases_list = key_bases
+        self.edges_list = [[(a, child) for a, child in enumerate(row) if child >= 0] for row in children]
+        self.next_nodes_list = next_nodes
+        self.subtree_decisions_list = subtree_decisions
+        self.sampled_decisions_list = sampled_decisions
+
+    def __len__(self):
+        return len(self.node_types)
+
+    def decision_nodes(self, round=None):
+        mask = self.node_types == DECISION
+        if round is not None:
+            mask &= self.rounds == round
+        return np.flatnonzero(mask)
@@ -0,0 +1,61 @@
+import random
+import deuces
+import numpy as np
+
+FULL_DECK = np.array(deuces.Deck.GetFullDeck(), dtype=np.int64)
+
+class Dealer:
+    """Deals from shuffled copies of a deck, shuffled a block at a time.
+
+    `deal(count)` returns the first count cards of the next shuffled deck as
+    Python ints, like drawing them from a fresh deuces.Deck(), without
+    building and shuffling a card list per deal. Blocks start small and
+    double up to block_size, so short-lived dealers shuffle few decks.
+    """
+    def __init__(self, generator, deck=FULL_DECK, block_size=1024):
+        self.generator = generator
+        self.deck = np.asarray(deck)
+        self.block_size = block_size
+        self.decks = self.deck[:0].reshape(0, len(self.deck))
+        self.position = 0
+
+    def deal(self, count):
+        if self.position == len(self.decks):
+            size = min(max(2 * len(self.decks), 16), self.block_size)
+            self.decks = self.generator.permuted(np.tile(self.deck, (size, 1)), axis=1)
+            self.position = 0
+        cards = self.decks[self.position, :count].tolist()
+        self.position += 1
+        return cards
+
+class Stream:
+    """The generators of one random stream: `generator` (numpy) and the
+    `dealer` drawing from it, and `random`, a random.Random for scalar
+    draws such as sampled actions, which are faster through it."""
+    def __init__(self, sequence):
+        numpy_sequence, python_sequence = sequence.spawn(2)
+        self.generator = np.random.default_rng(numpy_sequence)
+        self.random = random.Random(int(python_sequence.generate_state(1, np.uint64)[0]))
+        self.dealer = Dealer(self.generator)
+
+class RandomStreams:
+    """Independent random streams derived from one root seed.
+
+    A stream is addressed by a path of non-negative ints, such as an
+    iteration block or (iteration block, worker): the same seed and path
+    always give the same stream and different paths independent ones
+    (numpy.random.SeedSequence spawn keys). Without a seed the root is drawn
+    from numpy.random, so seeding the global state still applies.
+    """
+    def __init__(self, seed=None):
+        self.seed = seed
+        self.entropy = seed if seed is not None else int(np.random.randint(2 ** 31))
+
+    def stream(self, *path):
+        return Stream(np.random.SeedSequence(self.entropy, spawn_key=tuple(int(i) for i in path)))
+
+def stream(seed=None):
+    # The root stream of seed; a Stream is passed through, so callers can continue one
+    if isinstance(seed, Stream):
+        return seed
+    return RandomStreams(seed).stream()
@@ -12,12 +12,12 @@ class RuleBasedNode(HoldemNode):
     """Node that always returns a fixed strategy."""
     def __init__(self, info_set_key, strategy):
         self.info_set_key = info_set_key
-        self.strategy = strategy
+        self.fixed_strategy = strategy
     
     def get_average_strategy(self):
         """Return the fixed strategy."""
-        return self.strategy
+        return self.fixed_strategy
     
     def get_strategy(self, realization_weight):
-        return self.strategy
+        return self.fixed_strategy
     
@@ -1,19 +1,18 @@
 from deuces import Card
 from deuces import Evaluator
-from deuces import Deck
 import numpy as np
+import random_streams
 
-def make_clusters(num_clusters, board_size):
+def make_clusters(num_clusters, board_size, seed=None):
+    dealer = random_streams.stream(seed).dealer
+    evaluator = Evaluator()
     borders = []
     for i in range(10):
         print("Iteration {i} started")
         evals = []
         for j in range((i+1)*10000):
-            deck = Deck()
-            hand = deck.draw(2)
-            board = deck.draw(board_size)
-            evaluator = Evaluator()
-            evals.append(evaluator.evaluate(hand, board))
+            cards = dealer.deal(2 + board_size)
+            evals.append(evaluator.evaluate(cards[:2], cards[2:]))
         evals.sort()
         cluster_size = int(np.floor(len(evals) / num_clusters))
         cluster_borders = []        
@@ -0,0 +1,119 @@
+import argparse
+import numpy as np
+import node_io
+
+MAGIC = b"PKRSTRAT"
+VERSION = 2
+# Version 1 files have no clustering key
+HEADER_DTYPES = {
+    1: np.dtype([("magic", "S8"), ("version", "<u4"), ("num_actions", "<u4"), ("count", "<u8")]),
+    2: np.dtype([("magic", "S8"), ("version", "<u4"), ("num_actions", "<u4"), ("count", "<u8"),
+                 ("clustering_key", "S16")]),
+}
+HEADER_DTYPE = HEADER_DTYPES[VERSION]
+
+def export_strategies(node_map, filename, clustering_key=None):
+    """Writes the average strategy of every node of a NodeStore as a
+    read-only strategy file.
+
+    Layout: a 40-byte header (magic, version, num_actions, count and the
+    clustering_cache key of the tables the map was trained with, empty if
+    unknown), the sorted int64 info-set keys, then a count x num_actions
+    float32 matrix whose row i is the average strategy of key i.
+    """
+    keys = np.fromiter(node_map.index.keys(), dtype=np.int64, count=len(node_map))
+    node_ids = np.fromiter(node_map.index.values(), dtype=np.intp, count=len(node_map))
+    order = np.argsort(keys, kind="stable")
+    strategies = node_map.average_strategy(node_ids[order]).astype("<f4")
+    header = np.array([(MAGIC, VERSION, node_map.num_actions, len(keys), (clustering_key or "").encode())],
+                      dtype=HEADER_DTYPE)
+    with open(filename, "wb") as f:
+        f.write(header.tobytes())
+        f.write(keys[order].astype("<i8").tobytes())
+        f.write(strategies.tobytes())
+
+class StrategyFile:
+    """Memory-mapped view of a file written by export_strategies.
+
+    Opening the file only maps it, so any number of processes share one copy
+    through the page cache; lookups are a binary search over the key index.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        data = np.memmap(filename, dtype=np.uint8, mode="r")
+        prefix = data[:HEADER_DTYPES[1].itemsize].view(HEADER_DTYPES[1])[0]
+        if prefix["magic"] != MAGIC or int(prefix["version"]) not in HEADER_DTYPES:
+            raise ValueError(f"{filename} is not a strategy file")
+        header_dtype = HEADER_DTYPES[int(prefix["version"])]
+        header = data[:header_dtype.itemsize].view(header_dtype)[0]
+        self.num_actions = int(header["num_actions"])
+        # Key of the clustering tables the strategy was trained with, None if not recorded
+        self.clustering_key = None
+        if "clustering_key" in header_dtype.names:
+            self.clustering_key = header["clustering_key"].decode() or None
+        count = int(header["count"])
+        keys_end = header_dtype.itemsize + 8 * count
+        self.keys = data[header_dtype.itemsize:keys_end].view("<i8")
+        self.strategies = data[keys_end:keys_end + 4 * count * self.num_actions].view("<f4").reshape(count, self.num_actions)
+
+    def check_clustering_key(self, clustering_key):
+        # As node_io.check_clustering_key, for the key recorded in the header
+        if clustering_key is None:
+            return
+        if self.clustering_key is None:
+            if not node_io.allow_unkeyed_maps():
+                raise ValueError(f"{self.filename} records no clustering tables and predates the current preflop "
+                                 f"buckets; re-export it, or set POKER_ALLOW_UNKEYED_MAPS=1 to load it anyway")
+            print(f"Warning: {self.filename} records no clustering tables; it may predate the current preflop "
+                  f"buckets and miss lookups of hands whose bucket changed")
+        elif self.clustering_key != clustering_key:
+            raise ValueError(f"{self.filename} was trained with clustering tables {self.clustering_key}, "
+                             f"not {clustering_key}")
+
+    def __len__(self):
+        return len(self.keys)
+
+    def find(self, key):
+        # Row of key, or -1 when the info set was never visited in training
+        row = int(np.searchsorted(self.keys, key))
+        if row < len(self.keys) and self.keys[row] == key:
+            return row
+        return -1
+
+    def __contains__(self, key):
+        return self.find(key) >= 0
+
+    def get(self, key, default=None):
+        row = self.find(key)
+        return default if row < 0 else self.strategies[row]
+
+    def __getitem__(self, key):
+        row = self.find(key)
+        if row < 0:
+            raise KeyError(key)
+        return self.strategies[row]
+
+    def get_batch(self, keys):
+        # Strategies of many keys at once; unknown keys get the uniform strategy
+        keys = np.asarray(keys, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self.keys, keys), max(len(self.keys) - 1, 0))
+        strategies = np.full((len(keys), self.num_actions), 1.0 / self.num_actions, dtype=np.float32)
+        if len(self.keys):
+            found = self.keys[rows] == keys
+            strategies[found] = self.strategies[rows[found]]
+        return strategies
+
+if __name__ == "__main__":
+    import holdem
+    parser = argparse.ArgumentParser(description="Export the average strategy of a Hold'em node map for serving.")
+    parser.add_argument("node_map", help="Parquet node map written by HoldemCFR.save_node_map")
+    parser.add_argument("output", help="Strategy file to write")
+    parser.add_argument("--actions", type=int, default=3)
+    parser.add_argument("--min-mass", type=float, default=None, help="Drop info sets whose strategy_sum mass is below this")
+    args = parser.parse_args()
+    node_map = holdem.load_node_map(args.node_map, args.actions)
+    if args.min_mass is not None:
+        pruned = node_map.prune(args.min_mass)
+        print(f"Pruned {len(node_map) - len(pruned):,} of {len(node_map):,} info sets")
+        node_map = pruned
+    export_strategies(node_map, args.output, node_io.read_clustering_key(args.node_map))
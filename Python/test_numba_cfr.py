@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+import evaluator
+import holdem
+import numba_cfr
+
+pytestmark = pytest.mark.skipif(not numba_cfr.AVAILABLE, reason="Numba is not installed")
+
+@pytest.fixture(scope="module")
+def clustering():
+    # Coarse percentile tables; the backends only have to agree on them
+    hc = evaluator.HandClustering()
+    hc.build_preflop_table(100, 5, exact=False)
+    hc.build_flop_table(2000, 5)
+    hc.build_turn_table(2000, 5)
+    hc.build_river_table(2000, 5)
+    return hc
+
+def assert_backends_match(clustering, seed, prune_threshold=None, iterations=100):
+    """Trains the Python and Numba backends from the same seed and asserts
+    that they build the same chance-sampled node map."""
+    maps = []
+    for backend in holdem.HoldemCFR.BACKENDS:
+        cfr = holdem.HoldemCFR(3, clustering, backend=backend, prune_threshold=prune_threshold, prune_after=50,
+                               seed=seed)
+        for _ in range(iterations):
+            cfr.train_iteration()
+        maps.append(cfr.node_map)
+    python_map, numba_map = maps
+    assert python_map.index.keys() <= numba_map.index.keys(), "numba backend lost info sets"
+    for key, node_id in python_map.index.items():
+        other = numba_map.index[key]
+        assert np.allclose(python_map.regret_sum[node_id], numba_map.regret_sum[other]), "regrets differ"
+        assert np.allclose(python_map.strategy_sum[node_id], numba_map.strategy_sum[other]), "strategy sums differ"
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+@pytest.mark.parametrize("prune_threshold", [None, -5.0])
+def test_backends_match(clustering, seed, prune_threshold):
+    assert_backends_match(clustering, seed, prune_threshold)
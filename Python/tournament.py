@@ -0,0 +1,262 @@
+import argparse
+import multiprocessing
+import os
+from statistics import NormalDist
+import numpy as np
+import pandas as pd
+import base
+import clustering_cache
+import deuces
+import evaluator
+import hand_engine
+import holdem
+import strategy_file
+from rule_based_models import RuleBasedModel
+
+ACTION_MAP = {0: 'p', 1: 'b', 2: 'f'}
+FULL_DECK = np.array(deuces.Deck.GetFullDeck(), dtype=np.int64)
+
+class FixedPolicy:
+    """The same strategy at every info set, for rule-based models."""
+    def __init__(self, strategy):
+        self.strategy = list(strategy)
+
+    def get(self, key):
+        return self.strategy
+
+    def get_batch(self, keys):
+        return np.tile(np.asarray(self.strategy, dtype=np.float64), (len(keys), 1))
+
+class TablePolicy:
+    """Average strategy per info-set key, read once from a node map or a
+    strategy file; keys never visited in training play uniformly."""
+    def __init__(self, keys, strategies):
+        self.table = dict(zip(keys, strategies))
+        self.uniform = [1.0 / strategies.shape[1]] * strategies.shape[1]
+        keys = np.asarray(keys, dtype=np.int64)
+        order = np.argsort(keys)
+        self.keys = keys[order]
+        self.strategies = strategies[order]
+
+    def get(self, key):
+        return self.table.get(key, self.uniform)
+
+    def get_batch(self, keys):
+        # Strategies of many keys at once, as an (n, num_actions) array
+        keys = np.asarray(keys, dtype=np.int64)
+        strategies = np.tile(np.asarray(self.uniform), (len(keys), 1))
+        if len(self.keys):
+            rows = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+            found = self.keys[rows] == keys
+            strategies[found] = self.strategies[rows[found]]
+        return strategies
+
+def load_policy(spec, num_actions=3, clustering_key=None):
+    """Policy of a model given as a RuleBasedModel, a HoldemCFR, a
+    base.NodeStore, a Parquet node map file or an exported strategy file."""
+    if isinstance(spec, RuleBasedModel):
+        return FixedPolicy(spec.strategy)
+    if isinstance(spec, holdem.HoldemCFR):
+        node_map = spec.node_map
+    elif isinstance(spec, base.NodeStore):
+        node_map = spec
+    elif spec.endswith(".parquet"):
+        node_map = holdem.load_node_map(spec, num_actions, clustering_key)
+    else:
+        strategies = strategy_file.StrategyFile(spec)
+        strategies.check_clustering_key(clustering_key)
+        return TablePolicy(strategies.keys.tolist(), np.asarray(strategies.strategies, dtype=np.float64))
+    keys = list(node_map.index.keys())
+    node_ids = np.fromiter(node_map.index.values(), dtype=np.intp, count=len(keys))
+    return TablePolicy(keys, node_map.average_strategy(node_ids))
+
+def play_deal(policies, deal, rng, rules):
+    """Plays one hand of policies[0] (seat 0) against policies[1] (seat 1)
+    on a dealt hand_engine.DealEvaluation, with the rules of
+    comparison.play_hand except that ties at showdown split the pot (the
+    training rules give them to the player whose utility is computed).
+    Returns the utility of seat 0."""
+    history = holdem.HoldemInfoSet()
+    current_player = 0
+    while True:
+        round = history.get_round()
+        if rules.is_terminal(history):
+            if not history.get_history().endswith("f") and deal.get_showdown_score(0) == deal.get_showdown_score(1):
+                return 0.0
+            return rules.get_terminal_utility(history, deal.cards, deal.get_board(round), 0, deal)
+        if rules.is_chance_node(history):
+            history.increment_round()
+            continue
+        history.clusters = deal.get_clusters(current_player, round)
+        strategy = np.maximum(policies[current_player].get(history.key()), 0.0)
+        total = strategy.sum()
+        if total <= 0:
+            strategy = np.full(len(strategy), 1.0 / len(strategy))
+        else:
+            strategy = strategy / total
+        action = min(int(np.searchsorted(np.cumsum(strategy), rng.random(), side="right")), len(strategy) - 1)
+        round_history = history.get_history()
+        # Only allow 2 raises/bets
+        if round_history.count('b') >= 2 and action == 1:
+            action = 0
+        amount = 0
+        if action == 0 and (round_history == "" or round_history == "p"):
+            amount = 0
+        elif action == 0 or (action == 1 and (round_history == "" or round_history == "p")):
+            amount = 1
+        elif action == 1:
+            amount = 2
+        history.set_history(round_history + ACTION_MAP[action])
+        if action != 2:
+            history.add_to_pot(current_player, amount)
+        current_player = 1 - current_player
+
+# Per-worker state, set once by _init_worker
+_policies = None
+_clustering = None
+
+def _init_worker(specs, num_clusters):
+    global _policies, _clustering
+    _clustering = clustering_cache.load_or_build(num_clusters)
+    _policies = {name: load_policy(spec, clustering_key=_clustering.cache_key) for name, spec in specs.items()}
+
+def _play_chunk(args):
+    """Duplicate matches of model a against model b: every deal is played
+    with a in seat 0, then with the models swapped and the same cards and
+    board. Returns the count, sum and sum of squares of a's utility per
+    hand, averaged over each duplicate pair."""
+    a, b, num_deals, seed = args
+    rng = np.random.default_rng(seed)
+    fast_evaluator = hand_engine.FastEvaluator()
+    rules = holdem.HoldemNode(holdem.HoldemInfoSet(), 3)
+    dealt = evaluator.sample_cards(rng, FULL_DECK, num_deals, 9).tolist()
+    values = np.empty(num_deals)
+    for i, cards in enumerate(dealt):
+        deal = hand_engine.DealEvaluation([cards[0:2], cards[2:4]], cards[4:7], cards[7], cards[8],
+                                          _clustering, fast_evaluator)
+        utility = play_deal((_policies[a], _policies[b]), deal, rng, rules)
+        swapped = play_deal((_policies[b], _policies[a]), deal, rng, rules)
+        values[i] = (utility - swapped) / 2
+    return num_deals, values.sum(), (values ** 2).sum()
+
+class PairingResult:
+    """Running mean and confidence interval of model a's winnings against
+    model b in milli-big-blinds per hand (1 unit of the pot = 1 big blind)."""
+    def __init__(self, a, b, confidence=0.95):
+        self.a = a
+        self.b = b
+        self.confidence = confidence
+        self.num_deals = 0
+        self.total = 0.0
+        self.total_squares = 0.0
+
+    def add(self, num_deals, total, total_squares):
+        self.num_deals += num_deals
+        self.total += total
+        self.total_squares += total_squares
+
+    @property
+    def mbb_per_hand(self):
+        return 1000 * self.total / self.num_deals
+
+    @property
+    def half_width(self):
+        # Normal interval over the duplicate pairs
+        if self.num_deals < 2:
+            return float("inf")
+        mean = self.total / self.num_deals
+        variance = max(self.total_squares / self.num_deals - mean * mean, 0.0) * self.num_deals / (self.num_deals - 1)
+        z = NormalDist().inv_cdf(0.5 + self.confidence / 2)
+        return 1000 * z * np.sqrt(variance / self.num_deals)
+
+    @property
+    def decided(self):
+        # A zero-width interval means both seatings of every deal cancel out exactly
+        return abs(self.mbb_per_hand) > self.half_width or self.half_width == 0
+
+    def __repr__(self):
+        return (f"{self.a} vs {self.b}: {self.mbb_per_hand:+.1f} +/- {self.half_width:.1f} mbb/hand "
+                f"over {2 * self.num_deals} hands")
+
+def run_tournament(models, num_clusters=5, num_hands=20000, workers=None, chunk_size=500, seed=0,
+                   confidence=0.95, early_stop=True, min_hands=2000, output=None):
+    """Round robin of duplicate matches between every pair of models.
+
+    models maps names to model specs accepted by load_policy; each worker
+    process loads them all once. Pairings are played in chunks of
+    chunk_size duplicate deals spread over the pool, up to num_hands hands
+    (half as many deals) per pairing. With early_stop, a pairing stops
+    once it has played min_hands hands and its confidence interval
+    excludes zero. Chunk seeds derive from seed, the pairing and the chunk
+    number, so without early stopping the results do not depend on the
+    number of workers.
+
+    Returns a names x names DataFrame of row-against-column mbb/hand and
+    the PairingResult list; output, if given, receives the matrix as CSV
+    with the interval half widths next to it.
+    """
+    names = list(models)
+    workers = workers or multiprocessing.cpu_count()
+    pairings = [PairingResult(names[i], names[j], confidence)
+                for i in range(len(names)) for j in range(i + 1, len(names))]
+    max_deals = num_hands // 2
+    chunks_played = [0] * len(pairings)
+    # Build missing tables once here rather than in every worker
+    clustering_cache.load_or_build(num_clusters)
+    with multiprocessing.Pool(workers, _init_worker, (models, num_clusters)) as pool:
+        while True:
+            tasks = []
+            for p, pairing in enumerate(pairings):
+                if pairing.num_deals >= max_deals:
+                    continue
+                if early_stop and 2 * pairing.num_deals >= min_hands and pairing.decided:
+                    continue
+                # One chunk per worker and pairing per round, so decided pairings drop out early
+                remaining = max_deals - pairing.num_deals
+                for _ in range(workers):
+                    if remaining <= 0:
+                        break
+                    size = min(chunk_size, remaining)
+                    remaining -= size
+                    chunk_seed = np.random.SeedSequence([seed, p, chunks_played[p]])
+                    chunks_played[p] += 1
+                    tasks.append((p, (pairing.a, pairing.b, size, chunk_seed)))
+            if not tasks:
+                break
+            for (p, _), result in zip(tasks, pool.map(_play_chunk, [task for _, task in tasks])):
+                pairings[p].add(*result)
+            for p in sorted({p for p, _ in tasks}):
+                print(pairings[p])
+    matrix = pd.DataFrame(0.0, index=names, columns=names)
+    half_widths = pd.DataFrame(0.0, index=names, columns=names)
+    for pairing in pairings:
+        matrix.loc[pairing.a, pairing.b] = pairing.mbb_per_hand
+        matrix.loc[pairing.b, pairing.a] = -pairing.mbb_per_hand
+        half_widths.loc[pairing.a, pairing.b] = half_widths.loc[pairing.b, pairing.a] = pairing.half_width
+    if output is not None:
+        pd.concat({"mbb_per_hand": matrix, "half_width": half_widths}, axis=1).to_csv(output)
+    return matrix, pairings
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Round robin of duplicate Hold'em matches between node maps.")
+    parser.add_argument("node_maps", nargs="+", help="Parquet node maps or exported strategy files")
+    parser.add_argument("--clusters", type=int, default=5)
+    parser.add_argument("--hands", type=int, default=20000, help="Maximum hands per pairing")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-early-stop", action="store_true")
+    parser.add_argument("--baselines", action="store_true", help="Add always-call and always-raise models")
+    parser.add_argument("--output", default="tournament.csv")
+    parser.add_argument("--allow-unkeyed", action="store_true",
+                        help="Load node maps that record no clustering tables (trained before the preflop bucket fix)")
+    args = parser.parse_args()
+    if args.allow_unkeyed:
+        # Read by node_io.allow_unkeyed_maps, here and in the worker processes
+        os.environ["POKER_ALLOW_UNKEYED_MAPS"] = "1"
+    models = {filename: filename for filename in args.node_maps}
+    if args.baselines:
+        models["always_call"] = RuleBasedModel(ACTION_MAP, [1.0, 0.0, 0.0])
+        models["always_raise"] = RuleBasedModel(ACTION_MAP, [0.0, 1.0, 0.0])
+    matrix, _ = run_tournament(models, args.clusters, args.hands, args.workers, seed=args.seed,
+                               early_stop=not args.no_early_stop, output=args.output)
+    print(matrix.round(1))